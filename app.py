@@ -6,21 +6,35 @@ from config import config
 from src.ingestion.file_parser import FileParser
 from src.ingestion.chunker import TextChunker
 from src.ingestion.embedder import EmbedderStore
+from src.ingestion.pipeline import IngestionPipeline
+from src.ingestion.ingest_cache import IngestionCache
 from src.retrieval.qa_chain import QAChain
+from src.retrieval.sessions import SessionManager
 from src.guardrails.safety import GuardRails
 from src.summarization.summarizer import Documentsummarizer
 
 file_parser = FileParser()
 chunker = TextChunker()
 embedder = EmbedderStore()
+ingestion = IngestionPipeline(file_parser, chunker, embedder, cache=IngestionCache())
 guardrails = GuardRails()
 
-qa_chain = None
-documents_cache = []
+# one LLM client shared by every browser session, created with the first one
+llm = None
 
-def upload_file(file):
-    global qa_chain, documents_cache
 
+def new_qa_chain():
+    global llm
+    if llm is None:
+        llm = QAChain.new_llm()
+    return QAChain(embedder.vector_store, retriever=embedder.as_retriever(), llm=llm)
+
+
+# each browser tab (gradio session hash) gets its own chat history
+sessions = SessionManager(new_qa_chain)
+
+
+def upload_file(file, request: gr.Request):
     if file is None:
         return "⚠️ Please select a file to upload."
 
@@ -44,24 +58,18 @@ def upload_file(file):
             shutil.copy2(file_path, save_path)
         print(f"📁 File saved: {save_path}")
 
-        raw_text = file_parser.parse(save_path)
-        print(f"📄 Extracted {len(raw_text)} characters")
-
-        documents = chunker.chunk_text(
-            raw_text,
-            metadata={"source": filename},
-        )
-        documents_cache = documents
-        stats = chunker.get_chunk_stats(documents)
-        print(f"Chunking stats: {stats}")
+        stats = ingestion.run(save_path, metadata={"source": filename})
+        print(f"📄 Ingestion stats: {stats}")
 
-        vector_store = embedder.create_and_store(documents)
-        qa_chain = QAChain(vector_store)
+        # this tab's questions search its own upload, not other tabs' documents
+        session = sessions.get(request.session_hash)
+        session.document_id = filename
+        session.chain.retriever = embedder.as_retriever(doc_id=filename)
 
         return (
             f"✅ **Successfully processed '{filename}'**\n\n"
             f"**Document Statistics:**\n"
-            f"- Characters extracted: {len(raw_text):,}\n"
+            f"- Characters extracted: {stats['characters']:,}\n"
             f"- Chunks created: {stats['total_chunks']}\n"
             f"- Average chunk size: {stats['avg_chunk_size']} characters\n\n"
             f"💡 Go to the **Chat** tab to ask questions!"
@@ -74,17 +82,15 @@ def upload_file(file):
         return f"❌ Error processing file: {str(e)}"
 
 
-def ask_question(question, chat_history):
+def ask_question(question, chat_history, request: gr.Request):
     """
     Handle questions using simple Textbox + Markdown.
     No fancy chat components — just works!
     """
-    global qa_chain
-
     if not question or not question.strip():
         return "", chat_history
 
-    if qa_chain is None:
+    if not embedder.documents:
         new_entry = f"**You:** {question}\n\n**Assistant:** ⚠️ No document uploaded yet. Please go to the Upload tab first.\n\n---\n\n"
         chat_history = (chat_history or "") + new_entry
         return "", chat_history
@@ -97,7 +103,9 @@ def ask_question(question, chat_history):
         return "", chat_history
 
     try:
-        result = qa_chain.ask(question)
+        session = sessions.get(request.session_hash)
+        result = session.chain.ask(question)
+        sessions.update(session)
 
         processed_answer, metadata = guardrails.check_output(
             result["answer"],
@@ -135,15 +143,17 @@ def ask_question(question, chat_history):
         return "", chat_history
 
 
-def summarize_document():
-    global documents_cache
-
-    if not documents_cache:
+def summarize_document(request: gr.Request):
+    if not embedder.documents:
         return "⚠️ No document uploaded yet. Please upload a document first."
 
     try:
+        # this session's upload, or every document
+        document_id = sessions.get(request.session_hash).document_id
+        if document_id not in embedder.documents:
+            document_id = None
         doc_summarizer = Documentsummarizer()
-        summary = doc_summarizer.summarize(documents_cache)
+        summary = doc_summarizer.summarize(embedder.get_documents(document_id))
         return f"📋 **Document Summary:**\n\n{summary}"
     except Exception as e:
         print(f"❌ Summarize error: {e}")
@@ -152,12 +162,8 @@ def summarize_document():
         return f"❌ Error generating summary: {str(e)}"
 
 
-def clear_session():
-    global qa_chain, documents_cache
-    if qa_chain:
-        qa_chain.clear_history()
-    qa_chain = None
-    documents_cache = []
+def clear_session(request: gr.Request):
+    sessions.drop(request.session_hash)
     return "🗑️ Session cleared. You can upload a new document."
 
 
@@ -166,6 +172,13 @@ def clear_chat():
     return ""
 
 
+def ask_example(question):
+    """Ask a fixed question from an example button."""
+    def ask(chat_history, request: gr.Request):
+        return ask_question(question, chat_history, request)
+    return ask
+
+
 
 with gr.Blocks(
     title="Smart Contract Q&A Assistant",
@@ -250,13 +263,13 @@ with gr.Blocks(
         )
 
         # Connect example buttons
-        ex1.click(fn=lambda h: ask_question("Who are the key parties involved in this contract?", h),
+        ex1.click(fn=ask_example("Who are the key parties involved in this contract?"),
                   inputs=[chat_display], outputs=[question_input, chat_display])
-        ex2.click(fn=lambda h: ask_question("What are the payment terms and conditions?", h),
+        ex2.click(fn=ask_example("What are the payment terms and conditions?"),
                   inputs=[chat_display], outputs=[question_input, chat_display])
-        ex3.click(fn=lambda h: ask_question("What is the termination or cancellation policy?", h),
+        ex3.click(fn=ask_example("What is the termination or cancellation policy?"),
                   inputs=[chat_display], outputs=[question_input, chat_display])
-        ex4.click(fn=lambda h: ask_question("What are the confidentiality obligations?", h),
+        ex4.click(fn=ask_example("What are the confidentiality obligations?"),
                   inputs=[chat_display], outputs=[question_input, chat_display])
 
         clear_chat_btn.click(fn=clear_chat, outputs=[chat_display])
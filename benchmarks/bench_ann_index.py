@@ -0,0 +1,70 @@
+"""
+Benchmark the index types EmbedderStore can pick (flat / HNSW / IVF): build time,
+recall@k against exact search and single-query p50/p99 latency.
+Run from the repo root: python -m benchmarks.bench_ann_index --sizes 10000,100000,1000000
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from config import config
+from src.ingestion.vector_index import INDEX_TYPES, build_index
+
+
+# unit vectors around a few thousand "topics", closer to real chunk
+# embeddings than uniform noise (which makes every ANN index look bad)
+def make_vectors(n: int, dim: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((max(16, n // 20), dim), dtype=np.float32)
+    vectors = centers[rng.integers(len(centers), size=n)] + spread * rng.standard_normal((n, dim), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def measure(index, queries: np.ndarray, k: int):
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+    return np.array(found), np.array(latencies) * 1000
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated vector counts")
+    arg_parser.add_argument("--dim", type=int, default=384)
+    arg_parser.add_argument("--queries", type=int, default=500)
+    arg_parser.add_argument("-k", type=int, default=10)
+    arg_parser.add_argument("--spread", type=float, default=1.0, help="noise around topic centres; higher is harder")
+    args = arg_parser.parse_args()
+
+    # measure each type as such, not the size-based fallback
+    config.IVF_MIN_VECTORS = 0
+    rng = np.random.default_rng(0)
+    print(f"dim={args.dim} spread={args.spread} k={args.k} queries={args.queries} "
+          f"hnsw(M={config.HNSW_M}, efSearch={config.HNSW_EF_SEARCH}) ivf(nprobe={config.IVF_NPROBE})")
+    print(f"{'vectors':>9s} {'index':6s} {'build s':>8s} {'recall@k':>9s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for n in (int(size) for size in args.sizes.split(",")):
+        vectors = make_vectors(n + args.queries, args.dim, args.spread, rng)
+        vectors, queries = vectors[:n], vectors[n:]
+        truth = None
+        for index_type in INDEX_TYPES:
+            start = time.perf_counter()
+            index = build_index(vectors, index_type)
+            build = time.perf_counter() - start
+            found, latencies = measure(index, queries, args.k)
+            if truth is None:
+                truth = found  # flat is first: exact neighbours
+            recall = np.mean([len(np.intersect1d(f, t)) / args.k for f, t in zip(found, truth)])
+            print(f"{n:9d} {index_type:6s} {build:8.1f} {recall:9.3f} "
+                  f"{np.percentile(latencies, 50):8.3f} {np.percentile(latencies, 99):8.3f}")
+            del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark the offset-span chunker against LangChain's RecursiveCharacterTextSplitter.
+Run from the repo root: python -m benchmarks.bench_chunker --copies 50
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from config import config
+from src.ingestion.chunker import TextChunker
+from src.ingestion.file_parser import FileParser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sample_contracts", "sample_service_agreement.pdf")
+
+
+def splitter_chunk_text(text: str, chunk_size: int, chunk_overlap: int):
+    # the previous TextChunker.chunk_text implementation
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=TextChunker.SEPARATORS,
+        length_function=len,
+    )
+    chunks = splitter.split_text(text)
+    return [
+        Document(
+            page_content=chunk,
+            metadata={"source": "bench", "chunk_index": i, "total_chunks": len(chunks), "chunk_size": len(chunk)},
+        )
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+def measure(fn, repeats: int):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / 1e6, len(result)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--copies", type=int, default=50, help="times the sample contract is repeated")
+    arg_parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    arg_parser.add_argument("--chunk-overlap", type=int, default=config.CHUNK_OVERLAP)
+    arg_parser.add_argument("--repeats", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    text = "\n".join([FileParser().parse(SAMPLE)] * args.copies)
+    chunker = TextChunker(args.chunk_size, args.chunk_overlap)
+    candidates = {
+        "RecursiveCharacterTextSplitter": lambda: splitter_chunk_text(text, args.chunk_size, args.chunk_overlap),
+        "TextChunker.chunk_spans": lambda: chunker.chunk_spans(text),
+        "TextChunker.chunk_text": lambda: chunker.chunk_text(text, metadata={"source": "bench"}),
+    }
+
+    print(f"text={len(text):,} chars chunk_size={args.chunk_size} chunk_overlap={args.chunk_overlap}")
+    for name, fn in candidates.items():
+        seconds, peak_mb, chunks = measure(fn, args.repeats)
+        print(f"{name:32s} {seconds * 1000:8.1f} ms  peak {peak_mb:7.1f} MB  {chunks} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Cold-start time and memory of EmbedderStore.load_store: rebuilding the index from
+the per-document segments vs opening the memory-mapped checkpoint.
+Run from the repo root: python -m benchmarks.bench_cold_start --vectors 10000,100000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.bench_ann_index import make_vectors
+
+# run in a fresh interpreter so timings and resident memory belong to the load alone
+LOAD = """
+import os, sys, time
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from src.ingestion.embedder import EmbedderStore
+embedder = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=int(sys.argv[2])))
+if sys.argv[3] == "rebuild":
+    embedder.checkpoint = lambda *args, **kwargs: None
+rss = lambda: int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+before = rss()
+start = time.perf_counter()
+embedder.load_store(sys.argv[1])
+embedder.vector_store.similarity_search_by_vector([0.0] * int(sys.argv[2]), k=4)
+print(time.perf_counter() - start, rss() - before)
+"""
+
+
+def load(path: str, dim: int, mode: str):
+    out = subprocess.run([sys.executable, "-c", LOAD, path, str(dim), mode],
+                         capture_output=True, text=True, check=True).stdout
+    seconds, rss_kb = out.strip().splitlines()[-1].split()
+    return float(seconds), int(rss_kb) / 1024
+
+
+# copy of the store without its checkpoint, so load_store rebuilds from segments
+def without_checkpoint(path: str) -> str:
+    copy = path + "-segments"
+    shutil.copytree(path, copy, ignore=shutil.ignore_patterns("checkpoint-*"))
+    manifest_path = os.path.join(copy, "documents.json")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["checkpoint"] = None
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return copy
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--vectors", default="10000,100000", help="comma-separated corpus sizes")
+    arg_parser.add_argument("--dim", type=int, default=384)
+    arg_parser.add_argument("--documents", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    from langchain_community.embeddings import DeterministicFakeEmbedding
+    from src.ingestion.embedder import EmbedderStore
+
+    rng = np.random.default_rng(0)
+    print(f"{'vectors':>9s} {'load':10s} {'seconds':>8s} {'RSS MB':>8s}")
+    for n in (int(size) for size in args.vectors.split(",")):
+        path = tempfile.mkdtemp()
+        try:
+            vectors = make_vectors(n, args.dim, 1.0, rng)
+            embedder = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=args.dim))
+            for doc, rows in enumerate(np.array_split(np.arange(n), args.documents)):
+                texts = [f"document {doc} chunk {row} " + "lorem ipsum " * 40 for row in rows]
+                embedder.create_from_embeddings(texts, vectors[rows], [{"source": f"doc{doc}.pdf"}] * len(rows),
+                                                save_path=path, doc_id=f"doc{doc}")
+            embedder.checkpoint(path)
+            del embedder, vectors
+            for mode, store in (("rebuild", without_checkpoint(path)), ("checkpoint", path)):
+                seconds, rss = load(store, args.dim, mode)
+                print(f"{n:9d} {mode:10s} {seconds:8.2f} {rss:8.1f}")
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            shutil.rmtree(path + "-segments", ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
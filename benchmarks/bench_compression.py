@@ -0,0 +1,73 @@
+"""
+Memory per vector and recall loss of the compressed index options (fp16 / SQ8 / PQ),
+with and without exact re-ranking against the float32 vectors.
+Run from the repo root: python -m benchmarks.bench_compression --vectors 100000
+"""
+
+import argparse
+import os
+import tempfile
+
+import faiss
+import numpy as np
+
+from benchmarks.bench_ann_index import make_vectors, measure
+from config import config
+from src.ingestion.vector_index import COMPRESSIONS, RerankingIndex, build_index, pq_subquantizers
+
+
+# size of the serialized index: codes plus codebooks / graph / lists
+def index_bytes(index) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.faiss")
+        faiss.write_index(index, path)
+        return os.path.getsize(path)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--vectors", type=int, default=100000)
+    arg_parser.add_argument("--dim", type=int, default=384)
+    arg_parser.add_argument("--index-type", default="flat", choices=["flat", "hnsw", "ivf"])
+    arg_parser.add_argument("--queries", type=int, default=500)
+    arg_parser.add_argument("-k", type=int, default=10)
+    arg_parser.add_argument("--spread", type=float, default=1.0, help="noise around topic centres; higher is harder")
+    args = arg_parser.parse_args()
+
+    # measure each option as such, not the size-based fallbacks
+    config.IVF_MIN_VECTORS = 0
+    config.PQ_MIN_VECTORS = min(config.PQ_MIN_VECTORS, args.vectors)
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.vectors + args.queries, args.dim, args.spread, rng)
+    vectors, queries = vectors[: args.vectors], vectors[args.vectors :]
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    def recall(found):
+        return np.mean([len(np.intersect1d(f, t)) / args.k for f, t in zip(found, truth)])
+
+    print(f"vectors={args.vectors} dim={args.dim} index={args.index_type} k={args.k} "
+          f"pq_m={pq_subquantizers(args.dim)} rerank_factor={config.RERANK_FACTOR}")
+    print(f"{'storage':8s} {'bytes/vec':>10s} {'vs f32':>7s} {'recall':>7s} {'+rerank':>8s} "
+          f"{'p50 ms':>7s} {'+rerank':>8s}")
+    baseline = None
+    for compression in COMPRESSIONS:
+        index = build_index(vectors, args.index_type, compression)
+        per_vector = index_bytes(index) / args.vectors
+        baseline = baseline or per_vector
+        found, latencies = measure(index, queries, args.k)
+        row = (f"{compression:8s} {per_vector:10.1f} {per_vector / baseline:6.0%} {recall(found):7.3f}")
+        if compression == "none":
+            print(f"{row} {'-':>8s} {np.percentile(latencies, 50):7.3f} {'-':>8s}")
+            continue
+        reranking = RerankingIndex(index, lambda positions: vectors[positions], config.RERANK_FACTOR)
+        reranked, rerank_latencies = measure(reranking, queries, args.k)
+        print(f"{row} {recall(reranked):8.3f} {np.percentile(latencies, 50):7.3f} "
+              f"{np.percentile(rerank_latencies, 50):8.3f}")
+        del index, reranking
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Throughput and latency of POST /ask with N parallel clients, optionally while a
+document is being uploaded, for three ways of serving it:
+  blocking   - QAChain.ask called in the async handler (the original server)
+  threadpool - QAChain.ask in Starlette's threadpool
+  async      - QAChain.aask, retrieval on a bounded executor (the current server)
+The server runs under uvicorn in a background thread and the clients connect
+over TCP. The LLM is a fake with a fixed network-like delay and the embeddings
+are deterministic fakes, so only the request path is measured.
+Run from the repo root: python -m benchmarks.bench_concurrency --clients 1,16,64 --upload
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, List, Optional
+
+import httpx
+import numpy as np
+import uvicorn
+from fastapi.concurrency import run_in_threadpool
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from config import config
+
+# everything the server writes goes to a scratch directory, never the real index
+WORKDIR = tempfile.mkdtemp(prefix="bench-concurrency-")
+config.UPLOAD_DIR = WORKDIR
+config.FAISS_INDEX_DIR = os.path.join(WORKDIR, "index")
+config.GROQ_API_KEY = config.GROQ_API_KEY or "bench-key"
+config.ANSWER_CACHE_ENABLED = False
+
+import server  # noqa: E402
+from server import QuestionRequest, app  # noqa: E402
+from src.ingestion.embedder import EmbedderStore  # noqa: E402
+from src.ingestion.pipeline import IngestionPipeline  # noqa: E402
+
+WORDS = ["payment", "invoice", "termination", "notice", "liability", "indemnity", "governing", "law",
+         "confidential", "warranty", "renewal", "assignment", "audit", "insurance", "dispute", "fees"]
+
+
+# answers after `delay_s`, like a hosted LLM: sleeps in the sync path, awaits in the async one
+class SlowChatModel(BaseChatModel):
+    delay_s: float = 0.2
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.delay_s)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Within 30 days (Source 1)."))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.delay_s)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Within 30 days (Source 1)."))])
+
+
+# fake model with a per-text cost, so uploads hold a thread while they embed
+class SlowFakeEmbeddings(DeterministicFakeEmbedding):
+    cost_s: float = 0.0005
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.cost_s * len(texts))
+        return super().embed_documents(texts)
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(12)) + f" clause {rng.randint(1, 300)}."
+
+
+def write_docx(path: str, paragraphs: int, rng: random.Random):
+    from docx import Document
+
+    document = Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(" ".join(sentence(rng) for _ in range(4)))
+    document.save(path)
+
+
+# the two pre-async ways of serving /ask, for comparison
+@app.post("/bench/ask/blocking")
+async def ask_blocking(request: QuestionRequest):
+    return server.get_session(None).chain.ask(request.question)
+
+
+@app.post("/bench/ask/threadpool")
+async def ask_threadpool(request: QuestionRequest):
+    return await run_in_threadpool(server.get_session(None).chain.ask, request.question)
+
+
+@app.post("/bench/upload/blocking")
+async def upload_blocking(path: str):
+    return server.ingestion.run(path, metadata={"source": os.path.basename(path)}, doc_id=path)
+
+
+async def client(http: httpx.AsyncClient, route: str, questions: int, rng: random.Random, latencies: list):
+    for _ in range(questions):
+        start = time.perf_counter()
+        response = await http.post(route, json={"question": f"When is {rng.choice(WORDS)} due?"})
+        assert response.status_code == 200, response.text
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def upload(http: httpx.AsyncClient, mode: str, path: str):
+    if mode == "blocking":
+        response = await http.post("/bench/upload/blocking", params={"path": path})
+    else:
+        with open(path, "rb") as f:
+            response = await http.post("/upload", files={"file": (os.path.basename(path), f.read())},
+                                       data={"document_id": path})
+    response.raise_for_status()
+
+
+async def run(base_url: str, mode: str, clients: int, questions: int, upload_path: Optional[str]):
+    route = {"blocking": "/bench/ask/blocking", "threadpool": "/bench/ask/threadpool", "async": "/ask"}[mode]
+    latencies: List[float] = []
+    rng = random.Random(clients)
+    limits = httpx.Limits(max_connections=clients + 1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as http:
+        tasks = [client(http, route, questions, rng, latencies) for _ in range(clients)]
+        if upload_path:
+            tasks.append(upload(http, mode, upload_path))
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+# uvicorn on a free port in a daemon thread; returns its base URL
+def serve() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                                   backlog=4096))
+    threading.Thread(target=uvicorn_server.run, daemon=True).start()
+    while not uvicorn_server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--clients", default="1,16,64", help="comma-separated numbers of parallel clients")
+    arg_parser.add_argument("--questions", type=int, default=10, help="questions per client")
+    arg_parser.add_argument("--llm-ms", type=float, default=200, help="fake LLM latency")
+    arg_parser.add_argument("--chunks", type=int, default=5000, help="chunks indexed before the run")
+    arg_parser.add_argument("--upload", action="store_true", help="upload a document during each run")
+    arg_parser.add_argument("--upload-paragraphs", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(0)
+    embedder = EmbedderStore(embeddings=SlowFakeEmbeddings(size=384), query_cache=None)
+    texts = [" ".join(sentence(rng) for _ in range(3)) for _ in range(args.chunks)]
+    vectors = embedder.embeddings.embed_documents(texts)
+    embedder.create_from_embeddings(texts, vectors, [{"chunk_index": n, "source": "msa.docx"} for n in range(len(texts))],
+                                    doc_id="msa.docx")
+    server.embedder = embedder
+    server.ingestion = IngestionPipeline(server.file_parser, server.chunker, embedder)
+    # shared by every session's chain; each client request is a new session
+    server.llm = SlowChatModel(delay_s=args.llm_ms / 1000)
+    base_url = serve()
+    if args.upload:
+        # the first upload may rebuild the index as a larger type; not part of any run
+        warm_up = os.path.join(WORKDIR, "warm-up.docx")
+        write_docx(warm_up, args.upload_paragraphs, rng)
+        server.ingestion.run(warm_up, doc_id=warm_up)
+        embedder.delete_document(warm_up)
+
+    print(f"{'mode':>10s} {'clients':>7s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for clients in (int(n) for n in args.clients.split(",")):
+        for mode in ("blocking", "threadpool", "async"):
+            upload_path = None
+            if args.upload:
+                upload_path = os.path.join(WORKDIR, f"upload-{mode}-{clients}.docx")
+                write_docx(upload_path, args.upload_paragraphs, rng)
+            rate, p50, p99 = asyncio.run(run(base_url, mode, clients, args.questions, upload_path))
+            if upload_path:
+                # same index size for every run
+                embedder.delete_document(upload_path)
+            print(f"{mode:>10s} {clients:7d} {rate:8.1f} {p50:8.1f} {p99:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Prompt tokens per question with verbatim chunk concatenation vs ContextBuilder,
+which merges overlapping and adjacent chunks. Chunks of the sample contract are
+retrieved by BM25 for a set of typical questions; tokens are counted on the
+formatted context as it is sent to the LLM.
+Run from the repo root: python -m benchmarks.bench_context --k 4,8 --chunk-overlap 50,100
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from config import config
+from src.ingestion.chunker import TextChunker
+from src.ingestion.file_parser import FileParser
+from src.ingestion.lexical_index import BM25Index
+from src.ingestion.tokenizer import get_token_counter
+from src.retrieval.context_builder import ContextBuilder
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sample_contracts", "sample_service_agreement.pdf")
+
+QUESTIONS = [
+    "Who are the parties to this agreement?",
+    "What are the payment terms and conditions?",
+    "When are invoices due and what happens with late payment?",
+    "What is the termination or cancellation policy?",
+    "How much notice is required to terminate?",
+    "What are the confidentiality obligations?",
+    "Which law governs the agreement and where are disputes resolved?",
+    "What is the limitation of liability?",
+    "What warranties does the service provider give?",
+    "Who owns the intellectual property created under the agreement?",
+    "What services are provided and what is the scope of work?",
+    "How long is the term of the agreement and does it renew?",
+    "What insurance must the provider maintain?",
+    "Can either party assign the agreement?",
+    "What happens in case of force majeure?",
+    "What are the indemnification obligations?",
+]
+
+
+# the previous QAChain.fit_to_budget + format_context: chunks verbatim, each under its own header
+def verbatim_context(documents, budget):
+    selected, used = [], 0
+    for doc in documents:
+        if selected and used + doc.metadata["token_count"] > budget:
+            continue
+        selected.append(doc)
+        used += doc.metadata["token_count"]
+    return "\n\n".join(f"--- Source {i} (chunk {doc.metadata['chunk_index']} from {doc.metadata['source']}) ---\n"
+                       f"{doc.page_content}" for i, doc in enumerate(selected, 1))
+
+
+def format_merged(passages):
+    parts = []
+    for i, doc in enumerate(passages, 1):
+        indices = doc.metadata.get("chunk_indices")
+        chunks = f"chunks {indices[0]}-{indices[-1]}" if indices else f"chunk {doc.metadata['chunk_index']}"
+        parts.append(f"--- Source {i} ({chunks} from {doc.metadata['source']}) ---\n{doc.page_content}")
+    return "\n\n".join(parts)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--k", default="4,8", help="comma-separated numbers of chunks retrieved")
+    arg_parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    arg_parser.add_argument("--chunk-overlap", default=str(config.CHUNK_OVERLAP), help="comma-separated")
+    arg_parser.add_argument("--budget", type=int, default=config.CONTEXT_TOKEN_BUDGET)
+    args = arg_parser.parse_args()
+
+    count_tokens = get_token_counter()
+    text = FileParser().parse(SAMPLE)
+    print(f"{'overlap':>7s} {'k':>3s} {'chunks':>6s} {'verbatim':>9s} {'merged':>8s} {'saved':>6s} {'saved %':>7s} {'build us':>8s}")
+    for overlap in (int(n) for n in args.chunk_overlap.split(",")):
+        chunker = TextChunker(chunk_size=args.chunk_size, chunk_overlap=overlap, token_counter=count_tokens)
+        chunks = chunker.chunk_text(text, metadata={"source": os.path.basename(SAMPLE)})
+        index = BM25Index()
+        index.add([str(n) for n in range(len(chunks))], [doc.page_content for doc in chunks])
+        builder = ContextBuilder(count_tokens)
+        for k in (int(n) for n in args.k.split(",")):
+            verbatim, merged, build_us = [], [], []
+            for question in QUESTIONS:
+                retrieved = [chunks[int(chunk_id)] for chunk_id, _ in index.search(question, k)]
+                if not retrieved:
+                    continue
+                start = time.perf_counter()
+                context = builder.build(retrieved, args.budget)
+                build_us.append((time.perf_counter() - start) * 1e6)
+                verbatim.append(count_tokens(verbatim_context(retrieved, args.budget)))
+                merged.append(count_tokens(format_merged(context.passages)))
+            saved = np.mean(verbatim) - np.mean(merged)
+            print(f"{overlap:7d} {k:3d} {len(chunks):6d} {np.mean(verbatim):9.1f} {np.mean(merged):8.1f} "
+                  f"{saved:6.1f} {100 * saved / np.mean(verbatim):6.1f}% {np.median(build_us):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark the streaming DOCX reader against python-docx's object model.
+Each backend runs in a fresh process so peak RSS is measured in isolation (Linux only).
+Run from the repo root: python -m benchmarks.bench_docx_parse --paragraphs 20000
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import docx  # python-docx
+
+from src.ingestion.file_parser import FileParser
+
+CLAUSE = (
+    "{n}. The Client shall pay the Service Provider the fees set out in Schedule B "
+    "within thirty (30) days of receipt of a valid invoice. Late payments accrue "
+    "interest at one percent (1%) per month until paid in full."
+)
+
+
+def build_docx(path: str, paragraphs: int, table_every: int):
+    document = docx.Document()
+    for n in range(paragraphs):
+        document.add_paragraph(CLAUSE.format(n=n))
+        if n and n % table_every == 0:
+            table = document.add_table(rows=6, cols=3)
+            for i, row in enumerate(table.rows):
+                row.cells[0].text = f"Milestone {n}.{i}"
+                row.cells[1].text = f"USD {1000 * (i + 1):,}"
+                row.cells[2].text = f"Net {30 + i}"
+    document.save(path)
+
+
+def python_docx_backend(path: str) -> int:
+    # the pre-streaming implementation: body paragraphs only
+    document = docx.Document(path)
+    return sum(len(p.text) for p in document.paragraphs if p.text.strip())
+
+
+def streaming_backend(path: str) -> int:
+    return sum(len(piece) for piece in FileParser().iter_pages(path))
+
+
+BACKENDS = {"python-docx": python_docx_backend, "streaming": streaming_backend}
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def _measure(name: str, path: str, results):
+    # reset the peak-RSS watermark so import-time allocations don't count
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = _status_kb("VmRSS")
+    start = time.perf_counter()
+    characters = BACKENDS[name](path)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, (_status_kb("VmHWM") - baseline) / 1024, characters))
+
+
+def measure(name: str, path: str):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(name, path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--paragraphs", type=int, default=20000)
+    arg_parser.add_argument("--table-every", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "synthetic_agreement.docx")
+        build_docx(path, args.paragraphs, args.table_every)
+        print(f"paragraphs={args.paragraphs} file size={os.path.getsize(path) / 1e6:.1f} MB")
+        for name in BACKENDS:
+            elapsed, peak_mb, characters = measure(name, path)
+            print(f"{name:12s} {elapsed:7.3f}s  peak RSS +{peak_mb:7.1f} MB  {characters:,} chars extracted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Ingestion embedding throughput (chunks/sec): SentenceTransformer.encode on the
+chunks in arrival order (the previous HuggingFaceEmbeddings path, batch size 32)
+vs BatchEmbeddings with length buckets and 1..N worker processes.
+Run from the repo root: python -m benchmarks.bench_embedding --chunks 2000 --workers 1,4,8
+Use --random-model to time a randomly initialised model of all-MiniLM-L6-v2's
+shape when the real one can't be downloaded.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from config import config
+from src.ingestion.batch_embedder import BatchEmbeddings, _load_model
+from src.ingestion.tokenizer import get_token_counter
+
+WORDS = ("party agreement term payment notice clause shall pursuant liability indemnify breach "
+         "confidential termination renewal invoice governing law dispute arbitration assign").split()
+
+
+# chunk lengths as the chunker produces them: mostly full, a tail of short
+# end-of-section pieces
+def make_chunks(n: int, rng: np.random.Generator):
+    full = rng.random(n) < 0.7
+    lengths = np.where(full, rng.integers(150, 220, n), rng.integers(5, 150, n))
+    return [" ".join(rng.choice(WORDS, length)) + "." for length in lengths]
+
+
+# all-MiniLM-L6-v2's architecture (6 layers, 384 hidden) with random weights
+def random_model(path: str) -> str:
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab = os.path.join(path, "vocab.txt")
+    with open(vocab, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", ".", *WORDS]))
+    bert = os.path.join(path, "bert")
+    BertTokenizerFast(vocab_file=vocab).save_pretrained(bert)
+    BertModel(BertConfig(vocab_size=len(WORDS) + 6, hidden_size=384, num_hidden_layers=6,
+                         num_attention_heads=12, intermediate_size=1536)).save_pretrained(bert)
+    transformer = models.Transformer(bert, max_seq_length=config.EMBED_MAX_SEQ_TOKENS)
+    model = SentenceTransformer(modules=[transformer, models.Pooling(384, "mean")], device="cpu")
+    model.save(os.path.join(path, "model"))
+    return os.path.join(path, "model")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--chunks", type=int, default=2000)
+    arg_parser.add_argument("--call-size", type=int, default=config.EMBED_BATCH_SIZE,
+                            help="chunks per embed_documents call (the pipeline's EMBED_BATCH_SIZE)")
+    arg_parser.add_argument("--workers", default=f"1,{os.cpu_count()}", help="comma-separated pool sizes")
+    arg_parser.add_argument("--model", default=config.EMBEDDING_MODEL)
+    arg_parser.add_argument("--random-model", action="store_true")
+    args = arg_parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    chunks = make_chunks(args.chunks, rng)
+    calls = [chunks[start : start + args.call_size] for start in range(0, len(chunks), args.call_size)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_name = random_model(tmp) if args.random_model else args.model
+        print(f"chunks={args.chunks} call_size={args.call_size} cpus={os.cpu_count()} model={args.model}"
+              f"{' (random weights)' if args.random_model else ''}")
+        print(f"{'path':24s} {'seconds':>8s} {'chunks/s':>9s}")
+
+        model = _load_model(model_name)
+        model.encode(chunks[:32])  # warm-up
+        start = time.perf_counter()
+        for call in calls:
+            model.encode(call, batch_size=32, normalize_embeddings=True)
+        seconds = time.perf_counter() - start
+        print(f"{'arrival order, bs=32':24s} {seconds:8.1f} {args.chunks / seconds:9.1f}")
+        del model
+
+        for workers in (int(w) for w in args.workers.split(",")):
+            embeddings = BatchEmbeddings(model_name, workers=workers, token_counter=get_token_counter())
+            # start the pool and load the model(s) outside the timing
+            embeddings.embed_documents(chunks[: args.call_size * workers])
+            start = time.perf_counter()
+            for call in calls:
+                embeddings.embed_documents(call)
+            seconds = time.perf_counter() - start
+            print(f"{f'buckets, {workers} worker(s)':24s} {seconds:8.1f} {args.chunks / seconds:9.1f}")
+            embeddings.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Chat-history tokens in the prompt, turn by turn, for a long conversation: the
+previous QAChain history (the last 20 messages verbatim) vs ChatHistory, which
+keeps recent turns verbatim and folds older ones into a running summary in the
+background. Answers are ~--answer-tokens long; the summarizer is a fake LLM
+with a network-like delay that returns a summary of --summary-tokens, so the
+numbers show prompt size and how long the request path waits on history.
+Run from the repo root: python -m benchmarks.bench_history --turns 50 --answer-tokens 300,1000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from config import config
+from src.ingestion.tokenizer import get_token_counter
+from src.retrieval.chat_history import ChatHistory
+
+WORDS = ["payment", "invoice", "termination", "notice", "liability", "indemnity", "governing", "law",
+         "confidential", "warranty", "renewal", "assignment", "audit", "insurance", "dispute", "fees",
+         "the", "of", "within", "days", "section", "shall", "party", "agreement"]
+
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+# the previous QAChain._remember
+class LastMessages:
+
+    def __init__(self, count_tokens, keep: int = 20):
+        self.count_tokens = count_tokens
+        self.keep = keep
+        self.messages = []
+
+    def add(self, question: str, answer: str):
+        self.messages = (self.messages + [question, answer])[-self.keep:]
+
+    def tokens(self) -> int:
+        return sum(self.count_tokens(m) for m in self.messages)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--turns", type=int, default=50)
+    arg_parser.add_argument("--answer-tokens", default="300,1000", help="comma-separated approximate answer lengths")
+    arg_parser.add_argument("--budget", type=int, default=config.HISTORY_TOKEN_BUDGET)
+    arg_parser.add_argument("--summary-tokens", type=int, default=config.HISTORY_SUMMARY_TOKENS)
+    arg_parser.add_argument("--summary-ms", type=float, default=800, help="fake summarizer latency")
+    arg_parser.add_argument("--turn-ms", type=float, default=1500, help="time between a user's questions")
+    args = arg_parser.parse_args()
+
+    count_tokens = get_token_counter()
+    # ~0.75 words per token for English prose
+    print(f"{'answer':>6s} {'history':>11s} {'mean tok':>8s} {'p95 tok':>8s} {'max tok':>8s} "
+          f"{'last 10':>8s} {'add us':>7s} {'folded':>6s} {'dropped':>7s}")
+    for answer_tokens in (int(n) for n in args.answer_tokens.split(",")):
+        rng = random.Random(answer_tokens)
+
+        def summarize(messages):
+            time.sleep(args.summary_ms / 1000)
+            return text(rng, int(args.summary_tokens * 0.75))
+
+        histories = {
+            "last 20 msg": LastMessages(count_tokens),
+            "ChatHistory": ChatHistory(summarize, count_tokens, token_budget=args.budget,
+                                       summary_tokens=args.summary_tokens),
+        }
+        tokens = {name: [] for name in histories}
+        add_us = {name: [] for name in histories}
+        for turn in range(args.turns):
+            question = text(rng, 15)
+            answer = text(rng, int(answer_tokens * 0.75))
+            for name, history in histories.items():
+                # the prompt for this turn carries the history so far
+                tokens[name].append(history.tokens())
+                start = time.perf_counter()
+                history.add(question, answer)
+                add_us[name].append((time.perf_counter() - start) * 1e6)
+            # the user reads the answer and types the next question
+            time.sleep(args.turn_ms / 1000)
+        histories["ChatHistory"].wait()
+
+        for name, history in histories.items():
+            counts = np.array(tokens[name])
+            folded = getattr(history, "folded", "-")
+            dropped = getattr(history, "dropped", "-")
+            print(f"{answer_tokens:6d} {name:>11s} {counts.mean():8.0f} {np.percentile(counts, 95):8.0f} "
+                  f"{counts.max():8d} {counts[-10:].mean():8.0f} {np.median(add_us[name]):7.1f} "
+                  f"{folded!s:>6s} {dropped!s:>7s}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+BM25 query latency of the inverted index behind hybrid search, on synthetic
+contract-like chunks with a Zipf vocabulary.
+Run from the repo root: python -m benchmarks.bench_lexical --chunks 100000,1000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.ingestion.lexical_index import BM25Index
+
+
+def make_chunks(n: int, vocabulary: int, words: int, rng: np.random.Generator):
+    ranks = np.minimum(rng.zipf(1.2, size=(n, words)), vocabulary) - 1
+    return [" ".join(f"w{r}" for r in row) + f" section {i % 500}.{i % 17}" for i, row in enumerate(ranks)]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--chunks", default="100000", help="comma-separated corpus sizes")
+    arg_parser.add_argument("--vocabulary", type=int, default=50000)
+    arg_parser.add_argument("--words", type=int, default=150, help="words per chunk")
+    arg_parser.add_argument("--queries", type=int, default=500)
+    arg_parser.add_argument("-k", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>9s} {'build s':>8s} {'postings':>10s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for n in (int(size) for size in args.chunks.split(",")):
+        chunks = make_chunks(n, args.vocabulary, args.words, rng)
+        index = BM25Index()
+        start = time.perf_counter()
+        for batch in range(0, n, 10000):
+            index.add([str(i) for i in range(batch, min(batch + 10000, n))], chunks[batch : batch + 10000])
+        index.search("warm up", args.k)
+        build = time.perf_counter() - start
+        # a few common words plus an exact reference, like a real question
+        queries = [f"w{rng.integers(0, 50)} w{rng.integers(50, 5000)} section {rng.integers(500)}.{rng.integers(17)}"
+                   for _ in range(args.queries)]
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"{n:9d} {build:8.1f} {len(index._terms):10d} "
+              f"{np.percentile(latencies, 50):8.2f} {np.percentile(latencies, 99):8.2f}")
+        del index, chunks
+
+
+if __name__ == "__main__":
+    main()
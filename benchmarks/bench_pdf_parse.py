@@ -0,0 +1,69 @@
+"""
+Benchmark serial vs. process-pool PDF extraction in FileParser.
+Run from the repo root: python -m benchmarks.bench_pdf_parse --pages 400
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from src.ingestion.file_parser import FileParser
+
+CLAUSE = (
+    "{n}. The Service Provider shall deliver the services described in Exhibit {n} "
+    "in accordance with the agreed schedule. Payment is due within thirty (30) days "
+    "of receipt of a valid invoice. Either party may terminate this section upon "
+    "sixty (60) days written notice to the other party."
+)
+
+
+def build_pdf(path: str, pages: int):
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        text = "\n\n".join(CLAUSE.format(n=page_number * 10 + i) for i in range(10))
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), text, fontsize=9)
+    document.save(path)
+    document.close()
+
+
+def time_parse(parser: FileParser, path: str, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _page in parser.iter_pdf_pages(path):
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--pages", type=int, default=400)
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument("--pages-per-task", type=int, default=16)
+    arg_parser.add_argument("--repeats", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "synthetic_contract.pdf")
+        build_pdf(path, args.pages)
+
+        serial = FileParser(parallel=False)
+        parallel = FileParser(parallel=True, workers=args.workers, pages_per_task=args.pages_per_task)
+        assert serial.parse(path) == parallel.parse(path), "parallel output differs from serial"
+
+        serial_time = time_parse(serial, path, args.repeats)
+        parallel_time = time_parse(parallel, path, args.repeats)
+
+    print(f"pages={args.pages} workers={args.workers} pages_per_task={args.pages_per_task}")
+    print(f"serial:   {serial_time:.3f}s ({args.pages / serial_time:.0f} pages/s)")
+    print(f"parallel: {parallel_time:.3f}s ({args.pages / parallel_time:.0f} pages/s)")
+    print(f"speedup:  {serial_time / parallel_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
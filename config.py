@@ -10,15 +10,127 @@ class config:
     GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
     #Embedding
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL",'all-MiniLM-L6-v2')
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED","true").lower() == "true"
+    EMBEDDING_CACHE_MAX_VECTORS = int(os.getenv("EMBEDDING_CACHE_MAX_VECTORS",200000))
+    #question embeddings kept in memory (0 disables)
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE",1024))
+    #concurrent questions arriving within this window are embedded in one
+    #forward pass (0 disables batching)
+    QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS",5))
+    QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE",32))
     #chunking 
     CHUNK_SIZE = int(os.getenv('CHUNK_SIZE',500))
     CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP',50))
+    #"chars" or "tokens": unit of CHUNK_SIZE / CHUNK_OVERLAP
+    CHUNK_LENGTH = os.getenv("CHUNK_LENGTH","chars")
+    #"tiktoken:<encoding>" or "hf:<model>", used for chunk and prompt token counts
+    TOKENIZER = os.getenv("TOKENIZER","tiktoken:cl100k_base")
+    #parsing
+    PDF_PARALLEL = os.getenv("PDF_PARALLEL","true").lower() == "true"
+    PDF_WORKERS = int(os.getenv("PDF_WORKERS",os.cpu_count() or 1))
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK",16))
+    #streaming ingestion
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE",8))
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE",64))
+    INGEST_CACHE_MAX_MB = int(os.getenv("INGEST_CACHE_MAX_MB",512))
+    #ingestion embedding: chunks are bucketed by token length and each batch
+    #holds up to EMBED_BATCH_TOKENS padded tokens, spread over EMBED_WORKERS
+    #processes that each load the model. An upload batch (EMBED_BATCH_SIZE
+    #chunks) usually fits in one bucket, so only bulk ingestion gains from
+    #the pool and the server embeds in-process by default
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS",1))
+    EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS",8192))
+    EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE",128))
+    #the embedding model truncates longer inputs (256 for all-MiniLM-L6-v2)
+    EMBED_MAX_SEQ_TOKENS = int(os.getenv("EMBED_MAX_SEQ_TOKENS",256))
+    #bulk ingestion
+    BULK_WORKERS = int(os.getenv("BULK_WORKERS",os.cpu_count() or 1))
+    BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE",256))
+    BULK_EMBED_WORKERS = int(os.getenv("BULK_EMBED_WORKERS",os.cpu_count() or 1))
 
     #retrieval
     TOP_RESULTS = 4
+    #"dense" is embeddings only; "hybrid" (opt in) fuses dense and BM25 rankings
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE","dense")
+    #candidates taken from each ranking, reciprocal-rank-fusion constant and
+    #the dense ranking's share of the fused score
+    HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K",20))
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K",60))
+    HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT",0.5))
+    BM25_K1 = float(os.getenv("BM25_K1",1.2))
+    BM25_B = float(os.getenv("BM25_B",0.75))
+    #maximal marginal relevance: drop near-duplicate (overlapping) chunks from
+    #the top results; MMR_LAMBDA trades relevance (1.0) against diversity (0.0)
+    MMR_ENABLED = os.getenv("MMR_ENABLED","false").lower() == "true"
+    MMR_LAMBDA = float(os.getenv("MMR_LAMBDA",0.7))
+    MMR_FETCH_K = int(os.getenv("MMR_FETCH_K",20))
+    #optional cross-encoder second stage: over-retrieve CROSS_ENCODER_CANDIDATES
+    #chunks and keep the TOP_RESULTS it scores best; past the latency budget
+    #the first-stage order is kept
+    CROSS_ENCODER_ENABLED = os.getenv("CROSS_ENCODER_ENABLED","false").lower() == "true"
+    CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL","cross-encoder/ms-marco-MiniLM-L-6-v2")
+    CROSS_ENCODER_CANDIDATES = int(os.getenv("CROSS_ENCODER_CANDIDATES",20))
+    CROSS_ENCODER_BATCH_SIZE = int(os.getenv("CROSS_ENCODER_BATCH_SIZE",16))
+    CROSS_ENCODER_BUDGET_MS = float(os.getenv("CROSS_ENCODER_BUDGET_MS",300))
+    CROSS_ENCODER_CACHE_SIZE = int(os.getenv("CROSS_ENCODER_CACHE_SIZE",4096))
+    #optional semantic answer cache: a question whose embedding is at least this
+    #cosine-similar to an earlier one (same index version) gets that answer back
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED","false").lower() == "true"
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD",0.95))
+    ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S",3600))
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE",1024))
+    #"auto" picks by corpus size (flat below FLAT_MAX_VECTORS, hnsw below
+    #IVF_MIN_VECTORS, ivf above), or force "flat", "hnsw" or "ivf"
+    INDEX_TYPE = os.getenv("INDEX_TYPE","auto")
+    FLAT_MAX_VECTORS = int(os.getenv("FLAT_MAX_VECTORS",20000))
+    IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS",200000))
+    #0 = ~4*sqrt(n) lists
+    IVF_NLIST = int(os.getenv("IVF_NLIST",0))
+    IVF_TRAIN_POINTS_PER_LIST = int(os.getenv("IVF_TRAIN_POINTS_PER_LIST",64))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE",16))
+    HNSW_M = int(os.getenv("HNSW_M",32))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION",80))
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH",64))
+    #vector storage in the index: "none" (float32), "fp16", "sq8" or "pq";
+    #PQ stores PQ_M bytes per vector and falls back to sq8 below PQ_MIN_VECTORS
+    INDEX_COMPRESSION = os.getenv("INDEX_COMPRESSION","none")
+    PQ_M = int(os.getenv("PQ_M",48))
+    PQ_MIN_VECTORS = int(os.getenv("PQ_MIN_VECTORS",10000))
+    #compressed indexes: re-rank k * RERANK_FACTOR candidates by exact distance
+    #to the float32 vectors on disk (0 or 1 disables)
+    RERANK_FACTOR = int(os.getenv("RERANK_FACTOR",4))
+    #HNSW/IVF indexes hide deleted vectors from searches and are rebuilt
+    #without them once they make up this fraction of the index
+    INDEX_COMPACT_FRACTION = float(os.getenv("INDEX_COMPACT_FRACTION",0.1))
+    #rewrite the memory-mapped index checkpoint once this fraction of the
+    #corpus has changed since the last one (it's always refreshed on load)
+    CHECKPOINT_FRACTION = float(os.getenv("CHECKPOINT_FRACTION",0.25))
+    #checkpoints kept on disk (the newest ones), for processes still opening an older one
+    CHECKPOINT_KEEP = int(os.getenv("CHECKPOINT_KEEP",2))
+    #max tokens of retrieved chunks sent to the LLM per question
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET",2000))
+    #per-user sessions (chat history): idle ones expire after SESSION_TTL_S, and
+    #the least recently used are evicted past SESSION_MAX or SESSION_MAX_MB
+    SESSION_MAX = int(os.getenv("SESSION_MAX",10000))
+    SESSION_TTL_S = float(os.getenv("SESSION_TTL_S",3600))
+    SESSION_MAX_MB = int(os.getenv("SESSION_MAX_MB",256))
+    #chat history per session: recent turns verbatim, older ones folded by the
+    #LLM into a summary of up to HISTORY_SUMMARY_TOKENS, HISTORY_TOKEN_BUDGET in
+    #all; summaries run in the background on HISTORY_SUMMARY_WORKERS threads
+    HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET",1500))
+    HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS",300))
+    HISTORY_SUMMARY_WORKERS = int(os.getenv("HISTORY_SUMMARY_WORKERS",2))
+    #API server thread pools: QUERY_WORKERS for retrieval/reranking, and
+    #INGEST_WORKERS for parsing and indexing uploads (index writes still
+    #happen one at a time). Searches partly wait on locks and release the GIL,
+    #so a few more query workers than cores keeps the CPU busy.
+    QUERY_WORKERS = int(os.getenv("QUERY_WORKERS",min(32,(os.cpu_count() or 1) + 4)))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS",1))
     
     UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "data", "uploads")
     FAISS_INDEX_DIR = os.path.join(os.path.dirname(__file__), "data", "faiss_index")
+    INGEST_CACHE_DIR = os.path.join(os.path.dirname(__file__), "data", "ingest_cache")
+    EMBEDDING_CACHE_DIR = os.path.join(os.path.dirname(__file__), "data", "embedding_cache")
     
     #guard rails
     RELEVANCE_THRESHOLD = 0.3
@@ -27,6 +139,8 @@ class config:
     def ensure_directories(cls):
         os.makedirs(cls.UPLOAD_DIR,exist_ok = True)
         os.makedirs(cls.FAISS_INDEX_DIR,exist_ok=True)
+        os.makedirs(cls.INGEST_CACHE_DIR,exist_ok=True)
+        os.makedirs(cls.EMBEDDING_CACHE_DIR,exist_ok=True)
     
     @classmethod
     def validate(cls):
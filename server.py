@@ -1,16 +1,30 @@
 import os
+import json
 import shutil
-from typing import Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import asyncio
+import functools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from config import config
 from src.ingestion.file_parser import FileParser
 from src.ingestion.chunker import TextChunker
 from src.ingestion.embedder import EmbedderStore
+from src.ingestion.pipeline import IngestionPipeline
+from src.ingestion.ingest_cache import IngestionCache
+from src.ingestion.bulk import BulkIngestor
+from src.ingestion.query_batcher import Histogram
 from src.retrieval.qa_chain import QAChain
+from src.retrieval.reranker import CrossEncoderReranker
+from src.retrieval.answer_cache import SemanticAnswerCache
+from src.retrieval.sessions import Session, SessionManager
 from src.guardrails.safety import GuardRails
-from src.summarization.summarizer import summarizer
+from src.summarization.summarizer import Documentsummarizer
 
 app = FastAPI(
     title = "Smart Contract Q&A Assistance",
@@ -22,9 +36,94 @@ app.add_middleware(CORSMiddleware,allow_origins=['*'],allow_methods=["*"], allow
 file_parser = FileParser()
 chunker=TextChunker()
 embedder = EmbedderStore()
+ingest_cache = IngestionCache()
+ingestion = IngestionPipeline(file_parser,chunker,embedder,cache=ingest_cache)
+bulk_ingestor = BulkIngestor(embedder,chunker)
 guardrails= GuardRails()
-qa_chain:Optional[QAChain] = None
-documents_cache : list =[]
+reranker = CrossEncoderReranker() if config.CROSS_ENCODER_ENABLED else None
+#shared by every QAChain; a document's answers are dropped when it changes
+answer_cache = SemanticAnswerCache() if config.ANSWER_CACHE_ENABLED else None
+#LLM latency per answered question (cache hits excluded)
+LATENCY_MS_BOUNDS = (100,250,500,1000,2000,5000,10000,30000)
+ttft_ms = Histogram(LATENCY_MS_BOUNDS)
+generation_ms = Histogram(LATENCY_MS_BOUNDS)
+#prompt tokens saved per answered question by merging overlapping chunks
+context_tokens_saved = Histogram((0,25,50,100,200,500,1000))
+#Blocking work runs here, never on the event loop: retrieval/reranking for
+#questions, and parsing/embedding/indexing for uploads and deletes. Separate,
+#bounded pools so a large upload can't starve questions (or vice versa).
+query_executor = ThreadPoolExecutor(max_workers=config.QUERY_WORKERS,thread_name_prefix="query")
+ingest_executor = ThreadPoolExecutor(max_workers=config.INGEST_WORKERS,thread_name_prefix="ingest")
+#documents indexed by earlier runs stay in the store; new uploads are added to them
+if os.path.exists(os.path.join(config.FAISS_INDEX_DIR,EmbedderStore.MANIFEST_FILE)) \
+        or os.path.exists(os.path.join(config.FAISS_INDEX_DIR,"index.faiss")):
+    try:
+        embedder.load_store()
+    except ValueError as e:
+        #an index from an older version: left alone until it is migrated
+        print(f"Index not loaded: {e}")
+
+#load the cross-encoder before the first question, which would otherwise wait for it
+@app.on_event("startup")
+async def load_reranker():
+    if reranker is not None:
+        await run_in(query_executor,reranker.load)
+
+#write a memory-mapped checkpoint so the next start opens it instead of rebuilding. Workers
+#started on the same store share its pages; each one's writes take turns on the store's lock
+#file and first pick up what the others saved (until then a worker searches what it loaded)
+@app.on_event("shutdown")
+def checkpoint_store():
+    ingest_executor.shutdown(wait=True)
+    query_executor.shutdown(wait=False)
+    if embedder.vector_store is not None and embedder.store_path:
+        embedder.checkpoint()
+
+#await fn(*args, **kwargs) on one of the pools above
+async def run_in(executor:ThreadPoolExecutor,fn,*args,**kwargs):
+    return await asyncio.get_running_loop().run_in_executor(executor,functools.partial(fn,*args,**kwargs))
+
+#uploads are saved under unique names: two files called nda.pdf (from different
+#folders or sessions) never overwrite each other while they are ingested
+def upload_path(filename:str)->str:
+    return os.path.join(config.UPLOAD_DIR,f"{uuid.uuid4().hex}-{os.path.basename(filename)}")
+
+def save_upload(file:UploadFile,file_path:str):
+    with open(file_path,"wb") as f:
+        shutil.copyfileobj(file.file,f)
+
+#one LLM client for every session, created with the first one
+llm = None
+
+#Retriever over one document's chunks (all documents when None). The reranker
+#picks TOP_RESULTS from a larger candidate set.
+def new_retriever(document_id:Optional[str]=None):
+    k = config.CROSS_ENCODER_CANDIDATES if reranker else config.TOP_RESULTS
+    return embedder.as_retriever(k=k,doc_id=document_id)
+
+#A session's chain; everything but the chat history and retriever is shared.
+#It searches the whole index until the session uploads its own document.
+def new_qa_chain()->QAChain:
+    global llm
+    if llm is None:
+        llm = QAChain.new_llm()
+    #answers are cached per document revision of whatever the chain's retriever
+    #currently searches (it is re-pointed when the session uploads)
+    chain = QAChain(embedder.vector_store,retriever=new_retriever(),reranker=reranker,
+                    answer_cache=answer_cache,index_version=lambda: embedder.search_version(chain.retriever.doc_id),
+                    executor=query_executor,llm=llm)
+    return chain
+
+#Conversations by X-Session-ID header; a request without one starts a new
+#session, whose ID is returned so the client can send it next time
+sessions = SessionManager(new_qa_chain)
+
+def get_session(session_id:Optional[str])->Session:
+    return sessions.get(session_id or uuid.uuid4().hex)
+
+def require_documents():
+    if not embedder.documents:
+        raise HTTPException(status_code=400, detail="No document uploaded yet. Please upload a document first.")
 
 class QuestionRequest(BaseModel):
     question:str
@@ -34,49 +133,77 @@ class AnswerResponse(BaseModel):
     sources:list
     num_sources: int
     guardrail_warnings:list=[]
+    #answered from the semantic answer cache (no LLM call)
+    cached:bool=False
+    #send back as X-Session-ID to continue the conversation
+    session_id:Optional[str]=None
 
 ## api endpoint
 @app.get("/health")
 async def health_check():
     #check if the server is running 
-    return {"status": "healthy", "vector_store_loaded": qa_chain is not None}
+    return {"status": "healthy", "vector_store_loaded": bool(embedder.documents), "sessions": len(sessions)}
+
+
+@app.get("/stats")
+async def cache_stats():
+    #hit/miss counters of the server's caches
+    stats = {"ingest_cache": ingest_cache.stats()}
+    if embedder.embedding_cache is not None:
+        stats["embedding_cache"] = embedder.embedding_cache.stats()
+    if embedder.query_cache is not None:
+        stats["query_cache"] = embedder.query_cache.stats()
+    if embedder.query_batcher is not None:
+        stats["query_batcher"] = embedder.query_batcher.stats()
+    if reranker is not None:
+        stats["reranker"] = reranker.stats()
+    if answer_cache is not None:
+        stats["answer_cache"] = answer_cache.stats()
+    stats["sessions"] = sessions.stats()
+    stats["ttft_ms"] = ttft_ms.snapshot()
+    stats["generation_ms"] = generation_ms.snapshot()
+    stats["context_tokens_saved"] = context_tokens_saved.snapshot()
+    return stats
 
 
 @app.post('/upload')
-async def upload_document(file:UploadFile = File(...)):
+async def upload_document(file:UploadFile = File(...),document_id:Optional[str] = Form(None),
+                          x_session_id:Optional[str] = Header(None)):
     ##Upload and process a document
-    global qa_chain,documents_cache
+    ##document_id groups revisions of one contract (default: the filename);
+    ##re-uploading a revision only embeds the chunks that changed. It becomes
+    ##the session's document: what its questions search and what /summarize
+    ##summarizes by default.
     _,ext = os.path.splitext(file.filename)
     if ext.lower() not in FileParser.SUPPORTED_EXTENSIONS:
         raise HTTPException(status_code=400,detail=f"Unsupported file type: {ext}. Supported: {FileParser.SUPPORTED_EXTENSIONS}")
     
     try:
         #save file 
-        file_path = os.path.join(config.UPLOAD_DIR,file.filename)
-        with open(file_path,"wd") as f:
-            shutil.copyfileobj(file.file,f)
+        file_path = upload_path(file.filename)
+        await run_in(ingest_executor,save_upload,file,file_path)
         print(f"file saved:{file_path}")
 
-        #parse text
-        raw_text = file_parser.parse(file_path)
-        print(f"Extracted {len(raw_text)} characters")
-
-        #chunk text
-        documents = chunker.chunk_text(raw_text,metadata={"source":file.filename})
-        documents_cache = documents         #save for summarizing
-        stats = chunker.get_chunk_stats(documents)
-        print(f"Chunking stats: {stats}")
+        #parse, chunk, embed and index as overlapping streaming stages
+        stats = await run_in(ingest_executor,ingestion.run,file_path,metadata={"source":file.filename},
+                             doc_id=document_id or file.filename)
+        print(f"Ingestion stats: {stats}")
 
-        #embedding and vwctor store
-        vector_store = embedder.create_and_store(documents)
-        #QA inirialization
-        qa_chain = QAChain(vector_store)
+        session = get_session(x_session_id)
+        session.document_id = document_id or file.filename
+        session.chain.retriever = new_retriever(session.document_id)
         return {
             "message": f"Successfully processed '{file.filename}'",
+            "session_id": session.session_id,
             "stats": {
-                "characters": len(raw_text),
+                "characters": stats["characters"],
                 "chunks": stats["total_chunks"],
                 "avg_chunk_size": stats["avg_chunk_size"],
+                "cached": stats["cached"],
+                "embedded": stats["embedded"],
+                "reused": stats["reused"],
+                "removed": stats["removed"],
+                "embedding_cache_hit_rate": stats["embedding_cache_hit_rate"],
             },
         }
 
@@ -85,12 +212,49 @@ async def upload_document(file:UploadFile = File(...)):
     
 
 
-@app.post("/ask",response_model=AnswerResponse)
-async def ask_question(request:QuestionRequest):
-    global qa_chain
+@app.post('/upload/bulk')
+async def upload_documents(files:List[UploadFile] = File(...)):
+    ##Upload a batch of documents and index them together into one combined index.
+    ##Each file is a document named by its file name as sent, which may include
+    ##the folder it was picked from (2023/nda.pdf and 2024/nda.pdf stay apart)
+    file_paths = []
+    sources = []
+    rejected = []
+    for file in files:
+        _,ext = os.path.splitext(file.filename)
+        source = file.filename.replace("\\","/").lstrip("/")
+        if ext.lower() not in FileParser.SUPPORTED_EXTENSIONS:
+            rejected.append({"file": file.filename, "status": "failed", "error": f"Unsupported file type: {ext}"})
+            continue
+        if source in sources:
+            rejected.append({"file": file.filename, "status": "failed", "error": "Duplicate file name in this upload"})
+            continue
+        file_path = upload_path(file.filename)
+        await run_in(ingest_executor,save_upload,file,file_path)
+        file_paths.append(file_path)
+        sources.append(source)
+
+    try:
+        result = await run_in(ingest_executor,bulk_ingestor.run,file_paths,sources=sources,
+                              on_progress=lambda entry: print(f"Bulk ingest: {entry}"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-    if qa_chain is None :
-            raise HTTPException(status_code=400, detail="No document uploaded yet. Please upload a document first.")
+    return {
+        "message": f"Indexed {result['succeeded']} of {len(files)} files",
+        "files": result["files"] + rejected,
+        "stats": {
+            "characters": result["characters"],
+            "chunks": result["total_chunks"],
+            "failed": result["failed"] + len(rejected),
+        },
+    }
+
+
+@app.post("/ask",response_model=AnswerResponse)
+async def ask_question(request:QuestionRequest,x_session_id:Optional[str] = Header(None)):
+    require_documents()
+    session = get_session(x_session_id)
 # Input guard rail check
     is_safe, message = guardrails.check_input(request.question)
     if not is_safe:
@@ -99,11 +263,17 @@ async def ask_question(request:QuestionRequest):
             sources=[],
             num_sources=0,
             guardrail_warnings=["Input blocked by guard rails"],
+            session_id=session.session_id,
         )
 
     try:
-        # Get answer from QA chain
-        result = qa_chain.ask(request.question)
+        # Get answer from QA chain; retrieval runs on query_executor and the
+        # LLM call is awaited, so other requests are served meanwhile
+        result = await session.chain.aask(request.question)
+        sessions.update(session)
+        if not result.get("cached"):
+            generation_ms.observe(result["generation_ms"])
+            context_tokens_saved.observe(result["context_tokens_saved"])
 
         # Output guard rail check
         processed_answer, metadata = guardrails.check_output(
@@ -116,37 +286,99 @@ async def ask_question(request:QuestionRequest):
             sources=result["sources"],
             num_sources=result["num_sources"],
             guardrail_warnings=metadata.get("warnings", []),
+            cached=result.get("cached", False),
+            session_id=session.session_id,
         )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/summarize")
-async def summarize_document():
-    global documents_cache
+#one server-sent event
+def sse(event:str,data:dict)->str:
+    return f"event: {event}\ndata: {json.dumps(data,default=str)}\n\n"
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(request:QuestionRequest,x_session_id:Optional[str] = Header(None)):
+    ##like /ask, as server-sent events: "sources" first, then a "token" per
+    ##LLM chunk, then "done" with the guard-railed answer and timings; the
+    ##session ID comes back in the X-Session-ID response header
+    require_documents()
+    is_safe, message = guardrails.check_input(request.question)
+    if not is_safe:
+        raise HTTPException(status_code=400, detail=message)
+    session = get_session(x_session_id)
+
+    #a plain generator: Starlette runs it in the threadpool, one chunk at a time
+    def events():
+        try:
+            for event in session.chain.ask_stream(request.question):
+                kind = event.pop("event")
+                if kind != "done":
+                    yield sse(kind,event)
+                    continue
+                sessions.update(session)
+                if not event.get("cached"):
+                    ttft_ms.observe(event["ttft_ms"])
+                    generation_ms.observe(event["generation_ms"])
+                    context_tokens_saved.observe(event["context_tokens_saved"])
+                # Output guard rail check, on the complete answer
+                processed_answer, metadata = guardrails.check_output(event["answer"],event["sources"])
+                yield sse("done",{**event,"answer":processed_answer,
+                                  "guardrail_warnings":metadata.get("warnings", [])})
+        except Exception as e:
+            yield sse("error",{"detail":str(e)})
+
+    return StreamingResponse(events(),media_type="text/event-stream",
+                             headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no",
+                                      "X-Session-ID":session.session_id})
 
-    if not documents_cache:
+
+@app.post("/summarize")
+async def summarize_document(document_id:Optional[str] = None,x_session_id:Optional[str] = Header(None)):
+    ##summarize one indexed document: document_id, else the session's upload;
+    ##all of them when neither is given
+    if not embedder.documents:
         raise HTTPException(
             status_code=400,
             detail="No document uploaded yet.",
         )
+    if document_id is None and x_session_id and x_session_id in sessions:
+        session_document = sessions.get(x_session_id).document_id
+        if session_document in embedder.documents:
+            document_id = session_document
+    if document_id is not None and document_id not in embedder.documents:
+        raise HTTPException(status_code=404, detail=f"Unknown document: {document_id}")
 
     try:
-        summarizer = summarizer()
-        summary = summarizer.summarize(documents_cache)
+        summarizer = Documentsummarizer()
+        #mostly waiting on the LLM: the shared threadpool, not the bounded pools
+        summary = await run_in_threadpool(summarizer.summarize,embedder.get_documents(document_id))
         return {"summary": summary}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id:str):
+    ##remove one document from the index; the other documents stay searchable
+    if document_id not in embedder.documents:
+        raise HTTPException(status_code=404, detail=f"Unknown document: {document_id}")
+
+    try:
+        removed = await run_in(ingest_executor,embedder.delete_document,document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {"message": f"Deleted '{document_id}'", "chunks_removed": removed, "documents": len(embedder.documents)}
+
+
 @app.post("/clear")
-async def clear_session():
-    global qa_chain, documents_cache
-    if qa_chain:
-        qa_chain.clear_history()
-    qa_chain = None
-    documents_cache = []
+async def clear_session(x_session_id:Optional[str] = Header(None)):
+    ##forget this session's conversation; other sessions are unaffected
+    if x_session_id:
+        sessions.drop(x_session_id)
     return {"message": "Session cleared"}
 
 
@@ -1,3 +1,9 @@
 from .file_parser import FileParser
 from .chunker import TextChunker
-from .embedder import EmbedderStore
\ No newline at end of file
+from .embedder import EmbedderStore
+from .batch_embedder import BatchEmbeddings
+from .pipeline import IngestionPipeline
+from .ingest_cache import IngestionCache
+from .bulk import BulkIngestor
+from .embedding_cache import EmbeddingCache, CachedEmbeddings, QueryEmbeddingCache
+from .query_batcher import QueryBatcher, Histogram
\ No newline at end of file
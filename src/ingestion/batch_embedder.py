@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import config
+from .tokenizer import get_token_counter
+
+# the model held by each worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def _load_model(model_name: str):
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name, device="cpu")
+
+
+# Runs in a worker process: load the model once and split the CPU cores
+# between the workers instead of letting each one use all of them.
+def _init_worker(model_name: str, threads: int):
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads)
+    _worker_model = _load_model(model_name)
+
+
+def _encode(model, texts: List[str], normalize: bool) -> np.ndarray:
+    return np.asarray(
+        model.encode(texts, batch_size=len(texts), normalize_embeddings=normalize,
+                     convert_to_numpy=True, show_progress_bar=False),
+        dtype=np.float32,
+    )
+
+
+# Runs in a worker process: embed one length bucket.
+def _encode_in_worker(texts: List[str], normalize: bool) -> np.ndarray:
+    return _encode(_worker_model, texts, normalize)
+
+
+# Group text positions into batches of similar token length. Longest texts
+# come first; each batch holds as many texts as fit in batch_tokens once
+# padded to its longest member, so short chunks go in large batches and long
+# ones in small batches, and little compute is spent on padding.
+def plan_batches(lengths: List[int], batch_tokens: int, max_batch_size: int) -> List[List[int]]:
+    order = sorted(range(len(lengths)), key=lambda n: lengths[n], reverse=True)
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for n in order:
+        longest = lengths[batch[0]] if batch else max(lengths[n], 1)
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * longest > batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(n)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# SentenceTransformer embeddings for ingestion. Chunks are bucketed by token
+# length (see plan_batches) and the buckets spread over a pool of worker
+# processes that each hold the model; vectors come back in input order.
+# The pool starts on the first call with more than one batch and is reused;
+# queries and single batches are embedded in-process.
+class BatchEmbeddings(Embeddings):
+
+    def __init__(
+        self,
+        model_name: str = None,
+        workers: int = None,
+        batch_tokens: int = None,
+        max_batch_size: int = None,
+        max_seq_length: int = None,
+        normalize: bool = True,
+        token_counter: Callable[[str], int] = None,
+    ):
+        self.model_name = model_name or config.EMBEDDING_MODEL
+        self.workers = workers or config.EMBED_WORKERS
+        self.batch_tokens = batch_tokens or config.EMBED_BATCH_TOKENS
+        self.max_batch_size = max_batch_size or config.EMBED_MAX_BATCH_SIZE
+        self.max_seq_length = max_seq_length or config.EMBED_MAX_SEQ_TOKENS
+        self.normalize = normalize
+        self.count_tokens = token_counter or get_token_counter()
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            # concurrent first callers wait for one load instead of each loading a copy
+            with self._model_lock:
+                if self._model is None:
+                    self._model = _load_model(self.model_name)
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # the model truncates anything longer, so it pads no further either
+        lengths = [min(self.count_tokens(text), self.max_seq_length) for text in texts]
+        batches = plan_batches(lengths, self.batch_tokens, self.max_batch_size)
+
+        vectors: Optional[np.ndarray] = None
+        for batch, batch_vectors in zip(batches, self._encode_batches([[texts[n] for n in batch] for batch in batches])):
+            if vectors is None:
+                vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype=np.float32)
+            vectors[batch] = batch_vectors
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return _encode(self.model, [text], self.normalize)[0].tolist()
+
+    # a batch of questions in one in-process forward pass (see QueryBatcher)
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return _encode(self.model, texts, self.normalize).tolist()
+
+    def _encode_batches(self, batches: List[List[str]]):
+        if self.workers <= 1 or len(batches) == 1:
+            for texts in batches:
+                yield _encode(self.model, texts, self.normalize)
+            return
+        pool = self._get_pool()
+        yield from pool.map(_encode_in_worker, batches, [self.normalize] * len(batches))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            # spawn: forking a process that already runs torch threads can deadlock
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, threads),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
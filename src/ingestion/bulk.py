@@ -0,0 +1,180 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from langchain.schema import Document
+from config import config
+from .file_parser import FileParser
+from .chunker import TextChunker
+from .embedder import EmbedderStore
+
+
+# Runs in a worker process: parse and chunk one file, filed under source.
+# Page ranges are not parallelised again here; the pool already spreads files.
+def _parse_and_chunk(
+    file_path: str, source: str, chunk_size: int, chunk_overlap: int, length_mode: str
+) -> Tuple[int, List[Document]]:
+    text = FileParser(parallel=False).parse(file_path)
+    chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_mode=length_mode)
+    return len(text), chunker.chunk_text(text, metadata={"source": source})
+
+
+# Ingest many files into one combined index.
+# Parsing and chunking fan out over a process pool; finished chunks from all
+# files are pooled into large embedding batches and appended to a single FAISS
+# index that is saved once at the end. A file that fails is reported and
+# skipped without aborting the rest of the batch. Each file is one document of
+# the store, identified by its source (a path relative to the scanned
+# directory, so contracts/2023/nda.pdf and contracts/2024/nda.pdf stay apart).
+class BulkIngestor:
+
+    def __init__(
+        self,
+        embedder: EmbedderStore = None,
+        chunker: TextChunker = None,
+        workers: int = None,
+        batch_size: int = None,
+    ):
+        # large pooled batches split across config.BULK_EMBED_WORKERS encoding processes
+        self.embedder = embedder or EmbedderStore(embed_workers=config.BULK_EMBED_WORKERS)
+        self.chunker = chunker or TextChunker()
+        self.workers = workers or config.BULK_WORKERS
+        self.batch_size = batch_size or config.BULK_EMBED_BATCH_SIZE
+
+    # sources: document ID of each file (default: its file name); must be unique
+    # on_progress is called once per file with its report as soon as it's chunked
+    def run(
+        self,
+        file_paths: List[str],
+        save_path: str = None,
+        on_progress: Optional[Callable[[Dict], None]] = None,
+        sources: Optional[List[str]] = None,
+    ) -> Dict:
+        sources = sources or [os.path.basename(path) for path in file_paths]
+        duplicates = sorted({source for source in sources if sources.count(source) > 1})
+        if duplicates:
+            raise ValueError(f"Several files would be indexed as the same document: {duplicates}")
+        reports: List[Dict] = []
+
+        def report(entry: Dict):
+            entry = {**entry, "done": len(reports) + 1, "total": len(file_paths)}
+            reports.append(entry)
+            if on_progress:
+                on_progress(entry)
+
+        batches = self._batches(self._chunk_files(list(zip(file_paths, sources)), report))
+        try:
+            self.embedder.create_and_store_stream(batches, save_path)
+            indexed = True
+        except ValueError:
+            # nothing could be chunked: keep the current index untouched
+            if any(r["status"] == "ok" and r["chunks"] for r in reports):
+                raise
+            indexed = False
+
+        ok = [r for r in reports if r["status"] == "ok"]
+        return {
+            "files": reports,
+            "succeeded": len(ok),
+            "failed": len(reports) - len(ok),
+            "total_chunks": sum(r["chunks"] for r in ok),
+            "characters": sum(r["characters"] for r in ok),
+            "indexed": indexed,
+        }
+
+    def run_directory(self, directory: str, save_path: str = None, on_progress=None) -> Dict:
+        file_paths = find_documents(directory)
+        sources = [os.path.relpath(path, directory).replace(os.sep, "/") for path in file_paths]
+        return self.run(file_paths, save_path, on_progress, sources=sources)
+
+    # Yield chunks file by file as workers finish, keeping a bounded number
+    # of files in flight so thousands of inputs don't pile up in memory
+    def _chunk_files(self, files: List[Tuple[str, str]], report: Callable[[Dict], None]) -> Iterator[Document]:
+        if not files:
+            return
+        workers = min(self.workers, len(files))
+        window = workers * 4
+        remaining = iter(files)
+        # spawn: the server process runs torch/faiss threads, which fork can deadlock
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = {}
+
+            def submit_next() -> bool:
+                path, source = next(remaining, (None, None))
+                if path is None:
+                    return False
+                future = pool.submit(
+                    _parse_and_chunk,
+                    path,
+                    source,
+                    self.chunker.chunk_size,
+                    self.chunker.chunk_overlap,
+                    self.chunker.length_mode,
+                )
+                pending[future] = source
+                return True
+
+            while len(pending) < window and submit_next():
+                pass
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = pending.pop(future)
+                    submit_next()
+                    try:
+                        characters, documents = future.result()
+                    except Exception as e:
+                        report({"file": source, "status": "failed", "error": str(e)})
+                        continue
+                    report({"file": source, "status": "ok", "chunks": len(documents), "characters": characters})
+                    yield from documents
+
+    def _batches(self, documents: Iterator[Document]) -> Iterator[List[Document]]:
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+#every supported file under directory, in a stable order
+def find_documents(directory: str) -> List[str]:
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(f"Directory not found: {directory}")
+
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in FileParser.SUPPORTED_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory of contracts into one FAISS index.")
+    parser.add_argument("directory")
+    parser.add_argument("--save-path", default=None, help="index directory (default: config.FAISS_INDEX_DIR)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+
+    def print_progress(entry: Dict):
+        if entry["status"] == "ok":
+            print(f"[{entry['done']}/{entry['total']}] ok     {entry['file']} ({entry['chunks']} chunks)")
+        else:
+            print(f"[{entry['done']}/{entry['total']}] FAILED {entry['file']}: {entry['error']}")
+
+    ingestor = BulkIngestor(workers=args.workers, batch_size=args.batch_size)
+    result = ingestor.run_directory(args.directory, args.save_path, on_progress=print_progress)
+    print(
+        f"Done: {result['succeeded']} succeeded, {result['failed']} failed, "
+        f"{result['total_chunks']} chunks indexed"
+    )
+
+
+if __name__ == "__main__":
+    main()
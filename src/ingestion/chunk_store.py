@@ -0,0 +1,101 @@
+import json
+import os
+from collections.abc import Mapping
+from typing import Iterator, List, Optional, Union
+import numpy as np
+import xxhash
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+
+
+# Read-only, pickle-free store of chunk texts and metadata, one record per
+# index position, opened memory-mapped so only the records that are looked
+# up are ever read and several processes share the same pages.
+#
+#   chunks.bin          [chunk_id, text, metadata] as UTF-8 JSON, back to back
+#   chunks.offsets.npy  uint64 start of record i (n + 1 entries)
+#   chunks.keys.npy     sorted xxh3_64 of the chunk IDs
+#   chunks.slots.npy    position of the record for each key
+class ChunkStore:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data = np.memmap(os.path.join(path, "chunks.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(path, "chunks.bin")) else np.zeros(0, dtype=np.uint8)
+        self._offsets = np.load(os.path.join(path, "chunks.offsets.npy"), mmap_mode="r")
+        self._keys = np.load(os.path.join(path, "chunks.keys.npy"), mmap_mode="r")
+        self._slots = np.load(os.path.join(path, "chunks.slots.npy"), mmap_mode="r")
+
+    @staticmethod
+    def write(path: str, ids: List[str], documents: List[Document]):
+        offsets = np.zeros(len(ids) + 1, dtype=np.uint64)
+        with open(os.path.join(path, "chunks.bin"), "wb") as f:
+            for n, (chunk_id, doc) in enumerate(zip(ids, documents)):
+                record = json.dumps([chunk_id, doc.page_content, doc.metadata], ensure_ascii=False).encode("utf-8")
+                f.write(record)
+                offsets[n + 1] = offsets[n] + len(record)
+        keys = np.array([ChunkStore._key(chunk_id) for chunk_id in ids], dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        np.save(os.path.join(path, "chunks.offsets.npy"), offsets)
+        np.save(os.path.join(path, "chunks.keys.npy"), keys[order])
+        np.save(os.path.join(path, "chunks.slots.npy"), order.astype(np.int64))
+
+    @staticmethod
+    def _key(chunk_id: str) -> int:
+        return xxhash.xxh3_64_intdigest(chunk_id)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def record(self, position: int) -> list:
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return json.loads(self._data[start:end].tobytes())
+
+    def id_at(self, position: int) -> str:
+        return self.record(position)[0]
+
+    # index position of a chunk ID, or None
+    def position(self, chunk_id: str) -> Optional[int]:
+        key = np.uint64(self._key(chunk_id))
+        lo = int(np.searchsorted(self._keys, key, side="left"))
+        while lo < len(self._keys) and self._keys[lo] == key:
+            slot = int(self._slots[lo])
+            if self.id_at(slot) == chunk_id:
+                return slot
+            lo += 1
+        return None
+
+    def document(self, position: int) -> Document:
+        _, text, metadata = self.record(position)
+        return Document(page_content=text, metadata=metadata)
+
+
+# LangChain docstore view of a ChunkStore
+class LazyDocstore(Docstore):
+
+    def __init__(self, chunks: ChunkStore):
+        self.chunks = chunks
+
+    def search(self, search: str) -> Union[str, Document]:
+        position = self.chunks.position(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.chunks.document(position)
+
+
+# index position -> chunk ID, read from the ChunkStore on demand
+class LazyIdMap(Mapping):
+
+    def __init__(self, chunks: ChunkStore):
+        self.chunks = chunks
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < len(self.chunks):
+            raise KeyError(position)
+        return self.chunks.id_at(int(position))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self.chunks)))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
@@ -1,40 +1,224 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import re
+from bisect import bisect_right
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
 from langchain.schema import Document
-from typing import List 
 from config import config
+from .tokenizer import get_token_counter
+
+# "[Page N]" markers inserted by FileParser for PDFs
+_PAGE_MARKER = re.compile(r"\[Page (\d+)\]")
+
+
+# A chunk as a slice of the source text: text[start:end], plus the PDF page it starts on
+class ChunkSpan(NamedTuple):
+    start: int
+    end: int
+    page: Optional[int]
+
 
 class TextChunker:
 
-    def __init__(self,chunk_size:int =None,chunk_overlap:int=None):
+    # how many chunks worth of text iter_chunks reads before dropping consumed text
+    # or splitting a piece that no separator has ended yet
+    WINDOW_CHUNKS = 8
+    # rough characters per token, to size that window in "tokens" mode
+    CHARS_PER_TOKEN = 4
+    SEPARATORS = ["\n\n","\n",". "," ","" ]
+
+    #length_mode: "chars" measures chunk_size/chunk_overlap in characters,
+    #"tokens" in tokenizer tokens. Either way every chunk records its token_count.
+    def __init__(self,chunk_size:int =None,chunk_overlap:int=None,length_mode:str=None,
+                 token_counter:Callable[[str],int]=None):
         self.chunk_size = chunk_size or config.CHUNK_SIZE
         self.chunk_overlap = chunk_overlap or config.CHUNK_OVERLAP
-        
-        self.splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size,
-                                                       chunk_overlap = self.chunk_overlap,
-                                                       separators=["\n\n","\n",". "," ","" ],
-                                                        length_function =len)
+        self.length_mode = length_mode or config.CHUNK_LENGTH
+        if self.length_mode not in ("chars","tokens"):
+            raise ValueError(f"Unknown length mode: {self.length_mode}. Use 'chars' or 'tokens'.")
+        self.count_tokens = token_counter or get_token_counter()
+        self.separators = self.SEPARATORS
+
+    #everything that changes the chunks produced for a given text (used in cache keys)
+    @property
+    def config_key(self)->str:
+        tokenizer = f"/{config.TOKENIZER}" if self.length_mode == "tokens" else ""
+        return f"{self.length_mode}{tokenizer}:{self.chunk_size}:{self.chunk_overlap}"
 
 
     #Split text into chunks, each wrapped as a LangChain Document
     def chunk_text(self,text:str,metadata:dict=None)->List[Document]:
         if not text.strip():
             return[]
-        
+
         metadata = metadata or {}
-        chunks = self.splitter.split_text(text)
-        documents =[] 
-        for i, chunk in enumerate(chunks):
-            doc_metadata ={
-                **metadata, #source file info 
-                "chunk_index": i,
-                "total_chunks": len(chunks),  
-                "chunk_size": len(chunk),
-            }
-        
-            documents.append(Document(page_content=chunk,metadata=doc_metadata))
-
-        return documents
-    
+        return [self._make_document(text,span,i,metadata) for i,span in enumerate(self.chunk_spans(text))]
+
+    #Split text into (start, end, page) spans without copying any substrings.
+    #Same separator hierarchy, chunk_size and chunk_overlap semantics as
+    #LangChain's RecursiveCharacterTextSplitter (keep_separator, strip_whitespace),
+    #and text[start:end] gives exactly the chunks it would produce.
+    def chunk_spans(self,text:str,first_page:Optional[int]=None)->List[ChunkSpan]:
+        spans: List[tuple] = []
+        self._split(text,0,len(text),0,spans)
+
+        markers = [(m.start(),int(m.group(1))) for m in _PAGE_MARKER.finditer(text)]
+        positions = [pos for pos,_ in markers]
+        result = []
+        for start,end in spans:
+            i = bisect_right(positions,start)
+            result.append(ChunkSpan(start,end,markers[i - 1][1] if i else first_page))
+        return result
+
+    #Recursively split text[start:end] with separators[level:], appending spans to out
+    def _split(self,text:str,start:int,end:int,level:int,out:List[tuple]):
+        separators = self.separators
+        separator = separators[-1]
+        next_level = len(separators)
+        for i in range(level,len(separators)):
+            if separators[i] == "":
+                separator = ""
+                break
+            if text.find(separators[i],start,end) != -1:
+                separator = separators[i]
+                next_level = i + 1
+                break
+
+        current = deque()
+        total = 0
+        for piece in self._pieces(text,start,end,separator):
+            total = self._add_piece(text,piece[0],piece[1],next_level,current,total,out)
+        self._flush(text,current,out)
+
+    #Pieces of text[start:end] cut just before every separator occurrence
+    #(the separator stays at the start of the following piece)
+    @staticmethod
+    def _pieces(text:str,start:int,end:int,separator:str)->Iterator[tuple]:
+        if separator == "":
+            for i in range(start,end):
+                yield (i,i + 1)
+            return
+
+        piece_start = start
+        found = text.find(separator,start,end)
+        while found != -1:
+            if found > piece_start:
+                yield (piece_start,found)
+            piece_start = found
+            found = text.find(separator,found + len(separator),end)
+        if end > piece_start:
+            yield (piece_start,end)
+
+    def _length(self,text:str,start:int,end:int)->int:
+        if self.length_mode == "tokens":
+            return self.count_tokens(text[start:end])
+        return end - start
+
+    #Add the piece text[start:end] found at one split level. Pieces under
+    #chunk_size are merged greedily into the chunk being built in `current`
+    #((start, end, length) pieces totalling `total`), starting each new chunk
+    #with up to chunk_overlap of the previous one; a bigger piece ends that
+    #chunk and is split further with separators[next_level:]. Returns the new total.
+    def _add_piece(self,text:str,start:int,end:int,next_level:int,current:deque,total:int,out:List[tuple])->int:
+        length = self._length(text,start,end)
+        if length < self.chunk_size:
+            if total + length > self.chunk_size and current:
+                self._emit(text,current[0][0],current[-1][1],out)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= current.popleft()[2]
+            current.append((start,end,length))
+            return total + length
+        self._flush(text,current,out)
+        if next_level >= len(self.separators):
+            out.append((start,end))
+        else:
+            self._split(text,start,end,next_level,out)
+        return 0
+
+    #emit the chunk being built, if any
+    def _flush(self,text:str,current:deque,out:List[tuple]):
+        if current:
+            self._emit(text,current[0][0],current[-1][1],out)
+            current.clear()
+
+    #append text[start:end] with surrounding whitespace trimmed, unless it's blank
+    @staticmethod
+    def _emit(text:str,start:int,end:int,out:List[tuple]):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            out.append((start,end))
+
+    #offset: position of text[0] in the full document (for streamed windows)
+    def _make_document(self,text:str,span:ChunkSpan,chunk_index:int,metadata:dict,offset:int=0)->Document:
+        content = text[span.start:span.end]
+        return Document(page_content=content,metadata={
+            **metadata, #source file info
+            "chunk_index": chunk_index,
+            "chunk_size": span.end - span.start,
+            "token_count": self.count_tokens(content),
+            "start_index": offset + span.start,
+            "page": span.page,
+        })
+
+    #Chunk a stream of text pieces (pages, paragraphs) joined by "\n" without
+    #holding the whole text; yields exactly the chunks of chunk_text on the
+    #joined text. The text is read by a _StreamLevel per separator: each
+    #complete piece goes through the same merge as in _split, and a piece that
+    #outgrows the window before its separator ends it (e.g. a DOCX, whose
+    #paragraphs are joined by "\n" and never leave a blank line) is split on
+    #the next separator as it arrives. Text before the chunk being built at
+    #the deepest level is dropped from the buffer, so it stays about a window
+    #long, plus the piece being read.
+    def iter_chunks(self,pieces:Iterable[str],metadata:dict=None)->Iterator[Document]:
+        metadata = metadata or {}
+        window = self.chunk_size * self.WINDOW_CHUNKS
+        if self.length_mode == "tokens":
+            window *= self.CHARS_PER_TOKEN
+        buffer = None
+        offset = 0          # position of buffer[0] in the full joined text
+        markers = []        # (position, page) of the page markers seen so far
+        positions = []
+        top = _StreamLevel(self,0,0,window)
+        chunk_index = 0
+        for piece in pieces:
+            if buffer is None:
+                buffer = piece
+                piece_offset = 0
+            else:
+                buffer = f"{buffer}\n{piece}"
+                piece_offset = len(buffer) - len(piece)
+            for m in _PAGE_MARKER.finditer(piece):
+                markers.append((offset + piece_offset + m.start(),int(m.group(1))))
+                positions.append(markers[-1][0])
+
+            out: List[tuple] = []
+            top.feed(buffer,len(buffer),out)
+            for start,end in out:
+                yield self._stream_document(buffer,start,end,offset,markers,positions,chunk_index,metadata)
+                chunk_index += 1
+
+            keep = top.keep()
+            if keep >= window:
+                buffer = buffer[keep:]
+                offset += keep
+                top.shift(keep)
+
+        if buffer is None or not buffer.strip():
+            return
+        out = []
+        top.finish(buffer,len(buffer),out)
+        for start,end in out:
+            yield self._stream_document(buffer,start,end,offset,markers,positions,chunk_index,metadata)
+            chunk_index += 1
+
+    def _stream_document(self,buffer:str,start:int,end:int,offset:int,markers:List[tuple],
+                         positions:List[int],chunk_index:int,metadata:dict)->Document:
+        i = bisect_right(positions,offset + start)
+        span = ChunkSpan(start,end,markers[i - 1][1] if i else None)
+        return self._make_document(buffer,span,chunk_index,metadata,offset)
+
     def get_chunk_stats(self, documents: List[Document]) -> dict:
         if not documents:
             return {"total_chunks": 0}
@@ -46,6 +230,81 @@ class TextChunker:
             "min_chunk_size": min(sizes),
             "max_chunk_size": max(sizes),
             "total_characters": sum(sizes),
+            "total_tokens": sum(d.metadata.get("token_count",0) for d in documents),
         }   
     
          
+
+# One separator level of TextChunker.iter_chunks: reads text from `start` the
+# way _split would at this level, cutting it on separators[level] and merging
+# the pieces. A piece that is already a window long with no separator ending
+# it will be split further however it ends (it's over chunk_size), so it is
+# handed to a child level that splits it on the next separator as the text
+# arrives. Positions are indices into the caller's buffer.
+class _StreamLevel:
+
+    def __init__(self,chunker:TextChunker,level:int,start:int,window:int):
+        self.chunker = chunker
+        self.level = level
+        self.separator = chunker.separators[level]
+        self.window = window
+        self.split = False          # whether the separator has shown up yet
+        self.piece_start = start    # start of the piece being read
+        self.scan = start           # where the next separator may start
+        self.current = deque()      # pieces of the chunk being built
+        self.total = 0
+        self.child :Optional[_StreamLevel] = None
+        # splitting into single characters ("") isn't worth streaming
+        self.can_descend = level + 2 < len(chunker.separators)
+
+    #read text[:limit], all of which belongs to this level
+    def feed(self,text:str,limit:int,out:List[tuple]):
+        separator = self.separator
+        found = text.find(separator,self.scan,limit)
+        while found != -1:
+            self._end_piece(text,found,out)
+            self.split = True
+            self.piece_start = found
+            self.scan = found + len(separator)
+            found = text.find(separator,self.scan,limit)
+        # a separator may still start in the last characters
+        self.scan = max(self.scan,limit - len(separator) + 1)
+        if self.child is None and self.can_descend and self.scan - self.piece_start >= self.window \
+                and self.chunker._length(text,self.piece_start,self.scan) >= self.chunker.chunk_size:
+            self.chunker._flush(text,self.current,out)
+            self.total = 0
+            self.child = _StreamLevel(self.chunker,self.level + 1,self.piece_start,self.window)
+        if self.child is not None:
+            self.child.feed(text,self.scan,out)
+
+    #read the rest of this level's text, up to `end`, and emit what's left
+    def finish(self,text:str,end:int,out:List[tuple]):
+        self.feed(text,end,out)
+        if self.split or self.child is not None:
+            self._end_piece(text,end,out)
+            self.chunker._flush(text,self.current,out)
+        else:
+            # the separator never showed up: _split moves on to the next one
+            self.chunker._split(text,self.piece_start,end,self.level,out)
+
+    #where the text still needed starts: the chunk being built at the deepest level
+    def keep(self)->int:
+        if self.child is not None:
+            return self.child.keep()
+        return self.current[0][0] if self.current else self.piece_start
+
+    #the first n characters were dropped from the buffer
+    def shift(self,n:int):
+        self.piece_start -= n
+        self.scan -= n
+        self.current = deque((start - n,end - n,length) for start,end,length in self.current)
+        if self.child is not None:
+            self.child.shift(n)
+
+    #the piece being read ends at `end`
+    def _end_piece(self,text:str,end:int,out:List[tuple]):
+        if self.child is not None:
+            self.child.finish(text,end,out)
+            self.child = None
+        elif end > self.piece_start:
+            self.total = self.chunker._add_piece(text,self.piece_start,end,self.level + 1,self.current,self.total,out)
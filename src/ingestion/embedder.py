@@ -1,55 +1,940 @@
 import os 
-from typing import List,Optional 
+import json
+import shutil
+import threading
+import faiss
+import numpy as np
+import xxhash
+from collections.abc import MutableMapping
+from filelock import FileLock
+from typing import Callable,Dict,Iterable,List,Optional,Tuple 
 from langchain.schema import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from config import config
+from .batch_embedder import BatchEmbeddings
+from .embedding_cache import CachedEmbeddings,EmbeddingCache,QueryEmbeddingCache
+from .query_batcher import QueryBatcher
+from .chunk_store import ChunkStore,LazyDocstore,LazyIdMap
+from .lexical_index import BM25Index
+from .vector_index import (INDEX_TYPES,MmapFlatIndex,RerankingIndex,TombstoneIndex,choose_compression,choose_index_type,
+                           compression_of,index_type_of,mmr_select,new_index,rebuild_index,set_search_params,
+                           supports_remove,tombstones_of,unwrap)
+
+
+#doc_id -> chunk IDs, read from a document's segment the first time it's needed,
+#so opening a checkpointed store doesn't parse every segment
+class _LazyDocuments(MutableMapping):
+
+    def __init__(self,doc_ids:Iterable[str],load:Callable[[str],List[str]]):
+        self._ids :Dict[str,Optional[List[str]]] = dict.fromkeys(doc_ids)
+        self._load = load
+
+    def __getitem__(self,doc_id:str)->List[str]:
+        ids = self._ids[doc_id]
+        if ids is None:
+            ids = self._ids[doc_id] = self._load(doc_id)
+        return ids
+
+    def __setitem__(self,doc_id:str,ids:List[str]):
+        self._ids[doc_id] = ids
+
+    def __delitem__(self,doc_id:str):
+        del self._ids[doc_id]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self)->int:
+        return len(self._ids)
+
 
 class EmbedderStore:
-    def __init__(self,embedding_model_name:str=None):
+
+    MANIFEST_FILE = "documents.json"
+    SEGMENT_DIR = "segments"
+    FORMAT_VERSION = 3
+
+    #embeddings: reuse an already-loaded embeddings object instead of loading the model again
+    #embedding_cache: persistent chunk-embedding cache; by default one is opened for a
+    #model loaded here (config.EMBEDDING_CACHE_ENABLED)
+    #query_cache: LRU of question embeddings used by similarity search and any
+    #retriever built on vector_store (config.QUERY_CACHE_SIZE, 0 disables)
+    #index_type: "auto", "flat", "hnsw" or "ivf" (config.INDEX_TYPE, see vector_index)
+    #compression: "none", "fp16", "sq8" or "pq" (config.INDEX_COMPRESSION); compressed
+    #indexes re-rank rerank_factor * k candidates against the float32 vectors on disk
+    #query_batcher: micro-batches concurrent question embeddings (on by default
+    #for the built-in model while config.QUERY_BATCH_WINDOW_MS > 0)
+    #embed_workers: encoding processes for the built-in model (config.EMBED_WORKERS)
+    def __init__(self,embedding_model_name:str=None,embeddings:Embeddings=None,embedding_cache:EmbeddingCache=None,
+                 query_cache:QueryEmbeddingCache=None,index_type:str=None,compression:str=None,rerank_factor:int=None,
+                 query_batcher:QueryBatcher=None,embed_workers:int=None):
         model = embedding_model_name or config.EMBEDDING_MODEL
-        self.embeddings=HuggingFaceEmbeddings(model_name =model,model_kwargs ={"device":"cpu"},
-                                              encode_kwargs={"normalize_embeddings":True})  # normalize for cosine similarity
+        self.model_name = getattr(embeddings,"model_name",model) if embeddings else model
+        #length-bucketed, multi-process; normalized for cosine similarity
+        base_embeddings=embeddings or BatchEmbeddings(model,workers=embed_workers,normalize=True)
+        if embedding_cache is None and embeddings is None and config.EMBEDDING_CACHE_ENABLED:
+            embedding_cache = EmbeddingCache(self.model_name)
+        if query_cache is None and config.QUERY_CACHE_SIZE > 0:
+            query_cache = QueryEmbeddingCache(self.model_name)
+        if query_batcher is None and embeddings is None and config.QUERY_BATCH_WINDOW_MS > 0:
+            query_batcher = QueryBatcher(base_embeddings)
+        #cache hits never wait in the batcher's queue
+        if query_batcher is not None:
+            base_embeddings = query_batcher
+        self.query_batcher = query_batcher
+        self.embedding_cache = embedding_cache
+        self.query_cache = query_cache
+        if embedding_cache or query_cache:
+            self.embeddings = CachedEmbeddings(base_embeddings,embedding_cache,query_cache)
+        else:
+            self.embeddings = base_embeddings
+        self.index_type = index_type or config.INDEX_TYPE
+        self.compression = compression or config.INDEX_COMPRESSION
+        self.rerank_factor = config.RERANK_FACTOR if rerank_factor is None else rerank_factor
+        # validate early
+        choose_index_type(0,self.index_type)
+        choose_compression(0,self.compression)
         
         self.vector_store :Optional[FAISS] =None
+        #doc_id -> chunk IDs (docstore IDs) in document order
+        self.documents :Dict[str,List[str]] = {}
+        #embedded / reused / removed and embedding-cache counts of the last ingestion
+        self.last_update :Dict = {}
+        #directory the in-memory store was loaded from / last saved to
+        self.store_path :Optional[str] = None
+        #_write_lock serialises ingestions and deletes; _lock guards the index
+        #and docstore while they change, and is what searches wait on
+        self._write_lock = threading.RLock()
+        self._lock = threading.RLock()
+        #store directory -> lock file that writers in other processes take turns on
+        self._file_locks :Dict[str,FileLock] = {}
+        self._reset()
 
+    def _reset(self):
+        self.vector_store = None
+        self.documents = {}
+        #chunk ID -> position in the FAISS index (rebuilt lazily after deletes)
+        self._positions :Optional[Dict[str,int]] = None
+        #where exact float32 vectors live when the index is compressed: chunks
+        #added since the last save are pending, the rest are rows of the
+        #saved segments (memory-mapped on first use)
+        self._pending :Dict[str,np.ndarray] = {}
+        self._saved :Dict[str,List[str]] = {}
+        self._rows :Dict[str,tuple] = {}
+        self._segments :Dict[str,np.ndarray] = {}
+        #every save bumps the generation; a checkpoint (whole index + chunk
+        #store, opened memory-mapped) is current when it has the same one
+        self._generation = 0
+        self._checkpoint :Optional[Dict] = None
+        #doc_id -> revision (hash of its chunk IDs) as of the last save; replaced,
+        #never changed in place, so it can be read without a lock
+        self._revisions :Dict[str,str] = {}
+        self._changed = 0
+        #opened from a checkpoint: read-only until _materialize()
+        self._chunk_store :Optional[ChunkStore] = None
+        self._checkpoint_vectors :Optional[np.ndarray] = None
+        #BM25 inverted index over the same chunks, for exact-term retrieval
+        self.lexical_index = BM25Index()
 
-    #Embed all document chunks and create a FAISS index
-    def create_and_store(self,documents:List[Document],save_path:str=None) ->FAISS:
+
+    #Embed all document chunks and add them to the FAISS index
+    def create_and_store(self,documents:List[Document],save_path:str=None,doc_id:str=None) ->FAISS:
         if not documents:
             raise ValueError('no vector embed')
 
+        return self.create_and_store_stream([documents],save_path,doc_id)
+
+    #Embed and index batches of chunks as they arrive (see IngestionPipeline),
+    #so only one batch of texts and vectors is in flight at a time.
+    #The store at save_path holds many documents: a new doc_id is appended,
+    #one that is already indexed is treated as a new revision of it (chunks
+    #whose text is unchanged keep their vector and ID and only metadata is
+    #refreshed, only new/changed chunks are embedded, and chunks that no
+    #longer exist are deleted). Without a doc_id each chunk is filed under its
+    #"source" metadata. Only the segments of the touched documents are saved.
+    def create_and_store_stream(self,document_batches:Iterable[List[Document]],save_path:str=None,doc_id:str=None) ->FAISS:
+        return self._ingest(((batch,None) for batch in document_batches),save_path,doc_id)
+
+    #Index vectors computed earlier (e.g. an IngestionCache hit) as doc_id
+    def create_from_embeddings(self,texts:List[str],vectors,metadatas:List[dict],save_path:str=None,doc_id:str=None) ->FAISS:
+        if not texts:
+            raise ValueError('no vector embed')
+
+        doc_id = doc_id or metadatas[0].get("source","document")
+        documents = [Document(page_content=text,metadata=metadata) for text,metadata in zip(texts,metadatas)]
+        return self._ingest([(documents,np.asarray(vectors,dtype=np.float32))],save_path,doc_id)
+
+    #Remove a document's chunks from the index (in place for a flat index)
+    def delete_document(self,doc_id:str,save_path:str=None)->int:
         save_path = save_path or config.FAISS_INDEX_DIR
-        #embedded each document page , create faiss index and store vectors with associated documents
-        self.vector_store = FAISS.from_documents(documents=documents,embedding=self.embeddings) 
-        #save to disk
-        self.vector_store.save_local(save_path)
+        with self._write_lock,self._store_lock(save_path):
+            with self._lock:
+                self._open_store(save_path)
+                self._sync(save_path)
+                if doc_id not in self.documents:
+                    raise KeyError(f"Document '{doc_id}' is not indexed")
+
+                self._materialize()
+                ids = self.documents.pop(doc_id)
+                self._remove(ids)
+                self._save(save_path,[doc_id])
+            self._compact_index()
+            self._checkpoint_if_due(save_path)
+        print(f"Deleted {len(ids)} chunks of '{doc_id}' from {save_path}")
+        return len(ids)
+
+    #Batches are (chunks, precomputed vectors or None). Writers take turns
+    #(_write_lock, and the store's lock file across processes); searches only
+    #wait while the index itself is changed (_lock), not while chunks are embedded.
+    def _ingest(self,batches:Iterable[tuple],save_path:str,doc_id:str) ->FAISS:
+        save_path = save_path or config.FAISS_INDEX_DIR
+        with self._write_lock,self._store_lock(save_path):
+            return self._ingest_locked(batches,save_path,doc_id)
+
+    def _ingest_locked(self,batches:Iterable[tuple],save_path:str,doc_id:str) ->FAISS:
+        with self._lock:
+            self._open_store(save_path)
+            self._sync(save_path)
+            self._materialize()
+        #owner -> chunk IDs it had before this ingestion
+        previous :Dict[str,set] = {}
+        chunk_ids :Dict[str,List[str]] = {}
+        occurrences :Dict[str,int] = {}
+        embedded = reused = 0
+        hits_before,misses_before = self._cache_counts()
+        #chunks put in the index so far, taken out again if the stream fails
+        added :List[str] = []
+        created = self.vector_store is None
+
+        try:
+            for batch,vectors in batches:
+                if not len(batch):
+                    continue
+                ids = []
+                unchanged = {}
+                fresh = []
+                for n,doc in enumerate(batch):
+                    owner = doc_id or doc.metadata.get("source","document")
+                    if owner not in previous:
+                        previous[owner] = set(self.documents.get(owner,()))
+                    chunk_id = self._chunk_id(owner,doc.page_content,occurrences)
+                    ids.append(chunk_id)
+                    chunk_ids.setdefault(owner,[]).append(chunk_id)
+                    if chunk_id in previous[owner]:
+                        unchanged[chunk_id] = doc
+                    else:
+                        fresh.append(n)
+
+                if unchanged:
+                    with self._lock:
+                        self.vector_store.docstore.delete(list(unchanged))
+                        self.vector_store.docstore.add(unchanged)
+                    reused += len(unchanged)
+                if not fresh:
+                    continue
+
+                texts = [batch[n].page_content for n in fresh]
+                if vectors is None:
+                    fresh_vectors = self.embeddings.embed_documents(texts)
+                    embedded += len(fresh)
+                else:
+                    fresh_vectors = vectors[fresh]
+                    reused += len(fresh)
+                with self._lock:
+                    self._add([ids[n] for n in fresh],texts,[batch[n].metadata for n in fresh],fresh_vectors)
+                added.extend(ids[n] for n in fresh)
+        except BaseException:
+            self._roll_back(added,created)
+            raise
+
+        if not chunk_ids:
+            raise ValueError('no vector embed')
+
+        removed = [i for owner,ids in chunk_ids.items() for i in previous[owner].difference(ids)]
+        with self._lock:
+            if removed:
+                self._remove(removed)
+            self.documents.update(chunk_ids)
+        self._compact_index()
+        self._fit_index()
+        with self._lock:
+            hits,misses = self._cache_counts()
+            self.last_update = {"doc_id":doc_id,"embedded":embedded,"reused":reused,"removed":len(removed),
+                                "cache_hits":hits - hits_before,"cache_misses":misses - misses_before}
+            self._save(save_path,list(chunk_ids))
+        self._checkpoint_if_due(save_path)
         print(f"FAISS index saved to {save_path}")
-        print(f"Total vectors stored: {len(documents)}")
-        
+        print(f"Vectors stored for {len(chunk_ids)} document(s): {embedded} embedded, {reused} reused, {len(removed)} removed "
+              f"({self.vector_store.index.ntotal} in index)")
+
         return self.vector_store
-    
-    #load the saved FAISS index from disk
+
+    #Undo the index changes of a failed ingestion: the chunks it added go
+    #(with the index, if it created it), so they aren't searchable without a
+    #document owning them and a retry can add them again
+    def _roll_back(self,added:List[str],created:bool):
+        with self._lock:
+            if created:
+                self._reset_index()
+            elif added:
+                self._remove(added)
+                for chunk_id in added:
+                    self._pending.pop(chunk_id,None)
+        self._compact_index()
+
+    #drop an index this process created, with everything added to it
+    def _reset_index(self):
+        self.vector_store = None
+        self._positions = None
+        self._pending = {}
+        self.lexical_index = BM25Index()
+
+    #append vectors to the index, creating it on first use
+    def _add(self,ids:List[str],texts:List[str],metadatas:List[dict],vectors):
+        vectors = np.asarray(vectors,dtype=np.float32)
+        if self.vector_store is None:
+            index = new_index(vectors,choose_index_type(len(vectors),self.index_type),
+                              choose_compression(len(vectors),self.compression))
+            self.vector_store = FAISS(self.embeddings,index,InMemoryDocstore(),{})
+            self._set_index(index)
+            self._positions = {}
+        if self.compression != "none":
+            self._pending.update(zip(ids,vectors))
+        start = self.vector_store.index.ntotal
+        self.vector_store.add_embeddings(zip(texts,vectors),metadatas=metadatas,ids=ids)
+        self.lexical_index.add(ids,texts)
+        if self._positions is not None:
+            self._positions.update((chunk_id,start + n) for n,chunk_id in enumerate(ids))
+
+    #install an index, wrapped to hide deleted vectors when it can't remove
+    #them in place, and for exact re-ranking when it is compressed
+    def _set_index(self,index):
+        if not supports_remove(index):
+            index = TombstoneIndex(index)
+        if compression_of(index) != "none" and self.rerank_factor > 1:
+            index = RerankingIndex(index,self._exact_vectors,self.rerank_factor)
+        self.vector_store.index = index
+
+    #Drop chunks from the index. LangChain's delete relies on remove_ids
+    #compacting positions, which only IndexFlat does; in HNSW/IVF indexes the
+    #chunks' positions are tombstoned instead (see _compact_index)
+    def _remove(self,ids:List[str]):
+        store = self.vector_store
+        self.lexical_index.remove(ids)
+        if supports_remove(store.index):
+            store.delete(ids)
+            self._positions = None
+            return
+        tombstones_of(store.index).delete(self._position_map()[chunk_id] for chunk_id in ids)
+        store.docstore.delete(ids)
+        self._positions = None
+
+    #Rebuild an HNSW/IVF index without its tombstoned positions once they are
+    #more than config.INDEX_COMPACT_FRACTION of it (any at all with force).
+    #Runs under _write_lock only: the copy is built while searches keep using
+    #the current index, and _lock is held just to read the vectors and swap.
+    def _compact_index(self,force:bool=False):
+        store = self.vector_store
+        tombstones = tombstones_of(store.index) if store is not None else None
+        if tombstones is None or not tombstones.deleted:
+            return
+        if not force and len(tombstones.deleted) <= config.INDEX_COMPACT_FRACTION * tombstones.ntotal:
+            return
+        with self._lock:
+            kept = self._live_ids()
+            vectors = self._vectors(kept)
+        index = rebuild_index(store.index,vectors)
+        with self._lock:
+            self._set_index(index)
+            store.index_to_docstore_id = dict(enumerate(kept))
+            self._positions = None
+
+    #chunk IDs of the index positions that aren't tombstoned, in position order
+    def _live_ids(self)->List[str]:
+        store = self.vector_store
+        tombstones = tombstones_of(store.index)
+        deleted = tombstones.deleted if tombstones is not None else ()
+        return [store.index_to_docstore_id[i] for i in range(store.index.ntotal) if i not in deleted]
+
+    def _position_map(self)->Dict[str,int]:
+        if self._positions is None:
+            tombstones = tombstones_of(self.vector_store.index)
+            deleted = tombstones.deleted if tombstones is not None else ()
+            self._positions = {chunk_id:i for i,chunk_id in self.vector_store.index_to_docstore_id.items() if i not in deleted}
+        return self._positions
+
+    #Move to a more scalable index type once the corpus has grown past its
+    #threshold (e.g. train IVF when there are enough vectors), or to the
+    #configured compression once it can be trained (PQ). Tombstoned positions
+    #are compacted first, the rest are unchanged; the index is never downgraded
+    #when documents are deleted.
+    def _fit_index(self):
+        store = self.vector_store
+        if store is None:
+            return
+        tombstones = tombstones_of(store.index)
+        n = store.index.ntotal - (len(tombstones.deleted) if tombstones is not None else 0)
+        current = index_type_of(store.index),compression_of(store.index)
+        target_type = choose_index_type(n,self.index_type)
+        target_compression = choose_compression(n,self.compression)
+        upgrade_type = INDEX_TYPES.index(target_type) > INDEX_TYPES.index(current[0])
+        upgrade_compression = current[1] != target_compression == self.compression
+        if not (upgrade_type or upgrade_compression):
+            return
+        target = (target_type if upgrade_type else current[0]),target_compression
+        self._compact_index(force=True)
+        print(f"Rebuilding {'/'.join(current)} index as {'/'.join(target)} for {n} vectors")
+        vectors = self._vectors([store.index_to_docstore_id[i] for i in range(n)])
+        index = new_index(vectors,*target)
+        index.add(vectors)
+        #searches keep using the old index until the new one is ready
+        with self._lock:
+            self._set_index(index)
+
+    #the store at save_path is the corpus: load it unless it's the one in memory
+    def _open_store(self,save_path:str):
+        if self.store_path == save_path and (self.vector_store is not None or self.documents):
+            return
+        self._reset()
+        self.store_path = save_path
+        if os.path.exists(os.path.join(save_path,self.MANIFEST_FILE)) or os.path.exists(os.path.join(save_path,"index.faiss")):
+            self.load_store(save_path)
+
+    #Several processes (server workers) may write one store: each write holds its lock file
+    def _store_lock(self,save_path:str)->FileLock:
+        if save_path not in self._file_locks:
+            os.makedirs(save_path,exist_ok=True)
+            self._file_locks[save_path] = FileLock(os.path.join(save_path,"write.lock"))
+        return self._file_locks[save_path]
+
+    #Before changing anything, take over whatever other processes saved since
+    #this one last read or wrote the manifest (its generation moved)
+    def _sync(self,save_path:str):
+        manifest = self._read_manifest(save_path)
+        if not self._is_current(manifest) or manifest.get("generation",0) == self._generation:
+            return
+        if self._chunk_store is not None:
+            #nothing changed here: open the current store (the checkpoint this
+            #one was opened from may be gone)
+            self.load_store(save_path)
+            return
+
+        theirs = manifest.get("revisions",{})
+        for doc_id in [doc_id for doc_id in self.documents if doc_id not in manifest["documents"]]:
+            self._remove(self.documents.pop(doc_id))
+            self._forget_segment(doc_id)
+        segment_dir = os.path.join(save_path,self.SEGMENT_DIR)
+        for doc_id,name in manifest["documents"].items():
+            if doc_id in self.documents and theirs.get(doc_id) is not None and theirs[doc_id] == self._revisions.get(doc_id):
+                continue
+            base = os.path.join(segment_dir,name)
+            with open(base + ".json",encoding="utf-8") as f:
+                segment = json.load(f)
+            ids = segment["ids"]
+            if self.documents.get(doc_id):
+                self._remove(self.documents.pop(doc_id))
+            self._add(ids,segment["texts"],segment["metadatas"],np.load(base + ".npy"))
+            self.documents[doc_id] = ids
+            self._forget_segment(doc_id)
+            for chunk_id in ids:
+                self._pending.pop(chunk_id,None)
+            self._saved[doc_id] = list(ids)
+            self._rows.update((chunk_id,(doc_id,row)) for row,chunk_id in enumerate(ids))
+        self._revisions = {doc_id:theirs.get(doc_id) or self._revision(ids) for doc_id,ids in self.documents.items()}
+        self._generation = manifest.get("generation",0)
+        self._checkpoint = manifest.get("checkpoint")
+        print(f"Picked up changes saved by another process ({len(self.documents)} documents)")
+
+    #forget what's cached about a document's saved segment
+    def _forget_segment(self,doc_id:str):
+        for chunk_id in self._saved.pop(doc_id,()):
+            self._rows.pop(chunk_id,None)
+        self._segments.pop(doc_id,None)
+
+    def _cache_counts(self)->tuple:
+        if self.embedding_cache is None:
+            return 0,0
+        return self.embedding_cache.hits,self.embedding_cache.misses
+
+    #Stable chunk ID: document + hash of the chunk text (+ a counter when the
+    #same text repeats), so an unchanged chunk maps to the same ID in every revision
+    @staticmethod
+    def _chunk_id(doc_id:str,text:str,occurrences:Dict[str,int])->str:
+        chunk_id = f"{doc_id}:{xxhash.xxh3_64_hexdigest(text)}"
+        seen = occurrences.get(chunk_id,0)
+        occurrences[chunk_id] = seen + 1
+        return f"{chunk_id}:{seen}" if seen else chunk_id
+
+    @staticmethod
+    def _segment_name(doc_id:str)->str:
+        return xxhash.xxh3_64_hexdigest(doc_id)
+
+    #chunk IDs hash their chunks, so this changes only when the document does
+    @staticmethod
+    def _revision(ids:List[str])->str:
+        return xxhash.xxh3_64_hexdigest("\n".join(ids))
+
+    #Write the segments (chunks + vectors) of the given documents and the
+    #document -> segment manifest; segments of other documents are untouched,
+    #so saving costs the size of the change, not of the corpus
+    def _save(self,save_path:str,doc_ids:Iterable[str]):
+        segment_dir = os.path.join(save_path,self.SEGMENT_DIR)
+        os.makedirs(segment_dir,exist_ok=True)
+        doc_ids = list(doc_ids)
+        self._changed += sum(max(len(self._saved.get(doc_id,())),len(self.documents.get(doc_id,()))) for doc_id in doc_ids)
+        #read every vector before any segment (which may hold some of them) is replaced
+        vectors = {doc_id:self._vectors(self.documents[doc_id]) for doc_id in doc_ids if self.documents.get(doc_id)}
+        revisions = dict(self._revisions)
+        for doc_id in doc_ids:
+            base = os.path.join(segment_dir,self._segment_name(doc_id))
+            ids = self.documents.get(doc_id)
+            self._forget_segment(doc_id)
+            if not ids:
+                revisions.pop(doc_id,None)
+                for ext in (".json",".npy"):
+                    if os.path.exists(base + ext):
+                        os.remove(base + ext)
+                continue
+            documents = [self.vector_store.docstore.search(chunk_id) for chunk_id in ids]
+            with open(base + ".json.tmp","w",encoding="utf-8") as f:
+                json.dump({"doc_id":doc_id,"ids":ids,
+                           "texts":[doc.page_content for doc in documents],
+                           "metadatas":[doc.metadata for doc in documents]},f)
+            with open(base + ".npy.tmp","wb") as f:
+                np.save(f,vectors[doc_id])
+            os.replace(base + ".npy.tmp",base + ".npy")
+            os.replace(base + ".json.tmp",base + ".json")
+            self._saved[doc_id] = list(ids)
+            self._rows.update((chunk_id,(doc_id,row)) for row,chunk_id in enumerate(ids))
+            for chunk_id in ids:
+                self._pending.pop(chunk_id,None)
+            revisions[doc_id] = self._revision(ids)
+
+        self._revisions = revisions
+        self._generation += 1
+        self._write_manifest(save_path)
+        self.store_path = save_path
+
+    #refresh the checkpoint once enough of the corpus has changed since the
+    #last one, so its cost is amortised over many small saves
+    def _checkpoint_if_due(self,save_path:str):
+        total = self.vector_store.index.ntotal if self.vector_store is not None else 0
+        if self._changed > config.CHECKPOINT_FRACTION * total:
+            self.checkpoint(save_path)
+
+    def _write_manifest(self,save_path:str):
+        manifest = {"format":self.FORMAT_VERSION,
+                    "generation":self._generation,
+                    "documents":{doc_id:self._segment_name(doc_id) for doc_id in self.documents},
+                    "revisions":self._revisions,
+                    "checkpoint":self._checkpoint}
+        manifest_path = os.path.join(save_path,self.MANIFEST_FILE)
+        with open(manifest_path + ".tmp","w",encoding="utf-8") as f:
+            json.dump(manifest,f)
+        os.replace(manifest_path + ".tmp",manifest_path)
+
+    #changes whenever the indexed chunks do (every save bumps the generation);
+    #caches of answers derived from the index key on it
+    @property
+    def index_version(self)->str:
+        return f"{self.store_path}:{self._generation}"
+
+    #(doc_id, revision) of what a search over doc_id can return, for answer
+    #caches; the revision changes only when that document is saved. The whole
+    #index (doc_id None) uses index_version. Takes no lock (it's called on the
+    #event loop while saves and checkpoints hold _lock): saves replace _revisions
+    def search_version(self,doc_id:str=None)->Tuple[Optional[str],str]:
+        if doc_id is None:
+            return None,self.index_version
+        revision = self._revisions.get(doc_id)
+        if revision is None:
+            #opened from a manifest written before revisions were recorded
+            revision = self._revision(self.documents.get(doc_id) or [])
+        return doc_id,revision
+
+    #Write the whole index plus a pickle-free chunk store as checkpoint-<generation>/
+    #so the next load_store() can open it memory-mapped instead of rebuilding
+    #the index from the segments. Only the newest config.CHECKPOINT_KEEP are
+    #kept: a process still opening an older one (it read the manifest just
+    #before) finds it, and one that has it mapped keeps its pages. Searches
+    #only wait while the chunks are collected, not while the files are written.
+    def checkpoint(self,save_path:str=None):
+        save_path = save_path or self.store_path or config.FAISS_INDEX_DIR
+        with self._write_lock,self._store_lock(save_path):
+            with self._lock:
+                self._sync(save_path)
+            self._write_checkpoint(save_path)
+
+    def _write_checkpoint(self,save_path:str):
+        if self.vector_store is None or self._chunk_store is not None:
+            return
+        if self._checkpoint and self._checkpoint["generation"] == self._generation:
+            return
+
+        #the checkpoint holds live vectors only
+        self._compact_index(force=True)
+        store = self.vector_store
+        name = f"checkpoint-{self._generation}"
+        path = os.path.join(save_path,name)
+        shutil.rmtree(path + ".tmp",ignore_errors=True)
+        os.makedirs(path + ".tmp")
+        with self._lock:
+            ids = [store.index_to_docstore_id[i] for i in range(store.index.ntotal)]
+            documents = [store.docstore.search(chunk_id) for chunk_id in ids]
+            vectors = self._vectors(ids)
+            self.lexical_index.save(path + ".tmp",ids)
+        ChunkStore.write(path + ".tmp",ids,documents)
+        np.save(os.path.join(path + ".tmp","vectors.npy"),vectors)
+        index = unwrap(store.index)
+        #a flat float32 index is served straight from vectors.npy; no writer
+        #can change it meanwhile (_write_lock) and searches only read it
+        if index_type_of(index) != "flat" or compression_of(index) != "none":
+            faiss.write_index(index,os.path.join(path + ".tmp","index.faiss"))
+        with open(os.path.join(path + ".tmp","documents.json"),"w",encoding="utf-8") as f:
+            json.dump(dict(self.documents),f)
+        shutil.rmtree(path,ignore_errors=True)
+        os.replace(path + ".tmp",path)
+
+        self._checkpoint = {"generation":self._generation,"dir":name}
+        self._write_manifest(save_path)
+        self._changed = 0
+        self._remove_old_checkpoints(save_path)
+        print(f"Checkpoint written to {path} ({len(ids)} vectors)")
+
+    def _remove_old_checkpoints(self,save_path:str):
+        generations = []
+        for entry in os.listdir(save_path):
+            if not entry.startswith("checkpoint-"):
+                continue
+            if entry.endswith(".tmp"):
+                #left by a writer that died (writers hold the lock file)
+                shutil.rmtree(os.path.join(save_path,entry),ignore_errors=True)
+            elif entry[len("checkpoint-"):].isdigit():
+                generations.append(int(entry[len("checkpoint-"):]))
+        generations.sort()
+        for generation in generations[:-max(config.CHECKPOINT_KEEP,1)]:
+            shutil.rmtree(os.path.join(save_path,f"checkpoint-{generation}"),ignore_errors=True)
+
+    #Open a current checkpoint without reading it: the index is memory-mapped
+    #(IVF lists via faiss, flat vectors via MmapFlatIndex; HNSW and flat SQ/PQ
+    #can't be mapped by faiss and are read, but never rebuilt), and chunks and
+    #document IDs are read on demand
+    def _open_checkpoint(self,path:str,manifest:Dict):
+        chunks = ChunkStore(path)
+        vectors = np.load(os.path.join(path,"vectors.npy"),mmap_mode="r")
+        index_path = os.path.join(path,"index.faiss")
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path,faiss.IO_FLAG_MMAP)
+            set_search_params(index)
+        else:
+            index = MmapFlatIndex(vectors)
+        self.vector_store = FAISS(self.embeddings,index,LazyDocstore(chunks),LazyIdMap(chunks))
+        self._set_index(index)
+        self.lexical_index = BM25Index.load(path,LazyIdMap(chunks))
+        self.documents = _LazyDocuments(manifest["documents"],self._segment_ids)
+        self._chunk_store = chunks
+        self._checkpoint_vectors = vectors
+
+    def _segment_ids(self,doc_id:str)->List[str]:
+        path = os.path.join(self.store_path,self.SEGMENT_DIR,self._segment_name(doc_id) + ".json")
+        with open(path,encoding="utf-8") as f:
+            return json.load(f)["ids"]
+
+    #Load a memory-mapped checkpoint into writable in-memory structures before
+    #the store is modified (read-only processes never pay for this)
+    def _materialize(self):
+        if self._chunk_store is None:
+            return
+        path = os.path.join(self.store_path,self._checkpoint["dir"])
+        chunks = self._chunk_store
+        docstore = {}
+        for position in range(len(chunks)):
+            chunk_id,text,metadata = chunks.record(position)
+            docstore[chunk_id] = Document(page_content=text,metadata=metadata)
+        index_path = os.path.join(path,"index.faiss")
+        if os.path.exists(index_path):
+            index = faiss.read_index(index_path)
+            set_search_params(index)
+        else:
+            index = faiss.IndexFlatL2(self._checkpoint_vectors.shape[1])
+            index.add(np.ascontiguousarray(self._checkpoint_vectors))
+        with open(os.path.join(path,"documents.json"),encoding="utf-8") as f:
+            self.documents = json.load(f)
+        self._revisions = {doc_id:self._revision(ids) for doc_id,ids in self.documents.items()}
+        #swap the contents in place: retrievers built on the store keep working
+        self.vector_store.docstore = InMemoryDocstore(docstore)
+        self.vector_store.index_to_docstore_id = dict(enumerate(docstore))
+        self.lexical_index.materialize(list(docstore))
+        self._chunk_store = None
+        self._checkpoint_vectors = None
+        self._positions = None
+        self._set_index(index)
+        self._saved = {doc_id:list(ids) for doc_id,ids in self.documents.items()}
+        self._rows = {chunk_id:(doc_id,row) for doc_id,ids in self.documents.items() for row,chunk_id in enumerate(ids)}
+
+    #float32 vectors of the given chunks; exact even when the index is compressed
+    def _vectors(self,ids:List[str])->np.ndarray:
+        if self._chunk_store is not None:
+            positions = [self._chunk_store.position(chunk_id) for chunk_id in ids]
+            return np.asarray(self._checkpoint_vectors[positions],dtype=np.float32)
+        if compression_of(self.vector_store.index) != "none":
+            return self._stored_vectors(ids)
+        positions = self._position_map()
+        keys = np.array([positions[chunk_id] for chunk_id in ids],dtype=np.int64)
+        return self.vector_store.index.reconstruct_batch(keys)
+
+    def _stored_vectors(self,ids:List[str])->np.ndarray:
+        vectors = np.empty((len(ids),self.vector_store.index.d),dtype=np.float32)
+        for n,chunk_id in enumerate(ids):
+            vector = self._pending.get(chunk_id)
+            if vector is None:
+                doc_id,row = self._rows[chunk_id]
+                vector = self._segment(doc_id)[row]
+            vectors[n] = vector
+        return vectors
+
+    def _segment(self,doc_id:str)->np.ndarray:
+        if doc_id not in self._segments:
+            path = os.path.join(self.store_path,self.SEGMENT_DIR,self._segment_name(doc_id) + ".npy")
+            self._segments[doc_id] = np.load(path,mmap_mode="r")
+        return self._segments[doc_id]
+
+    #exact vectors by index position, for RerankingIndex
+    def _exact_vectors(self,positions:np.ndarray)->np.ndarray:
+        if self._checkpoint_vectors is not None:
+            return np.asarray(self._checkpoint_vectors[positions])
+        to_id = self.vector_store.index_to_docstore_id
+        return self._stored_vectors([to_id[int(p)] for p in positions])
+
+    #stored vectors, shape (n, dim), aligned with get_documents()
+    def get_embeddings(self,doc_id:str=None)->np.ndarray:
+        if self.vector_store is None:
+            raise ValueError("No vector store loaded.")
+
+        return self._vectors(self._chunk_order(doc_id))
+
+    #stored chunks in document order (e.g. for summarizing a document);
+    #all documents unless doc_id is given
+    def get_documents(self,doc_id:str=None)->List[Document]:
+        if self.vector_store is None:
+            raise ValueError("No vector store loaded.")
+
+        return [self.vector_store.docstore.search(chunk_id) for chunk_id in self._chunk_order(doc_id)]
+
+    def _chunk_order(self,doc_id:str=None)->List[str]:
+        if doc_id is not None:
+            if doc_id not in self.documents:
+                raise KeyError(f"Document '{doc_id}' is not indexed")
+            return self.documents[doc_id]
+        return [chunk_id for ids in self.documents.values() for chunk_id in ids]
+
+    #load the saved index from disk: a current checkpoint is opened
+    #memory-mapped, so start-up doesn't depend on corpus size; otherwise the
+    #index is rebuilt from the per-document segments and a checkpoint written.
+    #An older single-file index (index.faiss/index.pkl) has to be converted
+    #once with migrate_legacy() first
     def load_store(self,load_path:str=None)->FAISS:
         load_path = load_path or config.FAISS_INDEX_DIR
-        if not os.path.exists(load_path):
+        manifest = self._read_manifest(load_path)
+        if not self._is_current(manifest):
+            if os.path.exists(os.path.join(load_path,"index.faiss")):
+                raise ValueError(
+                    f"{load_path} holds a FAISS index from an older version. "
+                    f"Convert it once with: python -m src.ingestion.migrate {load_path}")
             raise FileNotFoundError(
                 f"No FAISS index found at {load_path}. "
                 "Please upload and process a document first.")
-        
-        self.vector_store = FAISS.load_local(load_path,embeddings=self.embeddings,allow_dangerous_deserialization=True)
-        print("FAISS INDEX LOADED")
+
+        self._reset()
+        self.store_path = load_path
+        self._generation = manifest.get("generation",0)
+        self._revisions = manifest.get("revisions",{})
+        checkpoint = manifest.get("checkpoint")
+        if checkpoint and checkpoint["generation"] == self._generation \
+                and BM25Index.exists(os.path.join(load_path,checkpoint["dir"])):
+            self._checkpoint = checkpoint
+            self._open_checkpoint(os.path.join(load_path,checkpoint["dir"]),manifest)
+            print(f"FAISS INDEX OPENED ({len(self.documents)} documents, memory-mapped)")
+            return self.vector_store
+
+        segment_dir = os.path.join(load_path,self.SEGMENT_DIR)
+        docstore = {}
+        vectors = []
+        for doc_id,name in manifest["documents"].items():
+            base = os.path.join(segment_dir,name)
+            with open(base + ".json",encoding="utf-8") as f:
+                segment = json.load(f)
+            for chunk_id,text,metadata in zip(segment["ids"],segment["texts"],segment["metadatas"]):
+                docstore[chunk_id] = Document(page_content=text,metadata=metadata)
+            vectors.append(np.load(base + ".npy"))
+            self.documents[doc_id] = segment["ids"]
+            self._saved[doc_id] = list(segment["ids"])
+            self._rows.update((chunk_id,(doc_id,row)) for row,chunk_id in enumerate(segment["ids"]))
+        self._revisions = {doc_id:self._revision(ids) for doc_id,ids in self.documents.items()}
+        if vectors:
+            #one build for the whole corpus, of the type its size calls for
+            vectors = np.concatenate(vectors)
+            index = new_index(vectors,choose_index_type(len(vectors),self.index_type),
+                              choose_compression(len(vectors),self.compression))
+            index.add(vectors)
+            self.vector_store = FAISS(self.embeddings,index,InMemoryDocstore(docstore),dict(enumerate(docstore)))
+            self._set_index(index)
+            self.lexical_index.add(list(docstore),[doc.page_content for doc in docstore.values()])
+        print(f"FAISS INDEX LOADED ({len(self.documents)} documents)")
+        self.checkpoint(load_path)
+
+        return self.vector_store
+
+    #One-time conversion of an older single-file index (index.faiss +
+    #index.pkl, written by FAISS.save_local) to per-document segments. The
+    #pickle is trusted here, so only run it on an index you wrote yourself;
+    #the old files are left in place (a current manifest takes precedence).
+    def migrate_legacy(self,load_path:str=None)->FAISS:
+        load_path = load_path or config.FAISS_INDEX_DIR
+        manifest = self._read_manifest(load_path)
+        if self._is_current(manifest):
+            raise ValueError(f"{load_path} is already in the current format")
+        if not os.path.exists(os.path.join(load_path,"index.faiss")):
+            raise FileNotFoundError(f"No FAISS index found at {load_path}.")
+
+        with self._write_lock,self._store_lock(load_path),self._lock:
+            self._reset()
+            self.store_path = load_path
+            self.vector_store = FAISS.load_local(load_path,embeddings=self.embeddings,allow_dangerous_deserialization=True)
+            if manifest:
+                #doc_id -> chunk IDs, written before the manifest had a format
+                self.documents = manifest
+            else:
+                #no manifest: file chunks under their source
+                self.documents = {}
+                store = self.vector_store
+                for i in range(store.index.ntotal):
+                    chunk_id = store.index_to_docstore_id[i]
+                    source = store.docstore.search(chunk_id).metadata.get("source","document")
+                    self.documents.setdefault(source,[]).append(chunk_id)
+            ids = [self.vector_store.index_to_docstore_id[i] for i in range(self.vector_store.index.ntotal)]
+            self.lexical_index.add(ids,[self.vector_store.docstore.search(chunk_id).page_content for chunk_id in ids])
+
+            self._save(load_path,list(self.documents))
+            self._fit_index()
+            self.checkpoint(load_path)
+        print(f"Converted the FAISS index at {load_path} to per-document segments "
+              f"({len(self.documents)} documents); index.faiss/index.pkl were kept and can be removed")
 
         return self.vector_store
+
+    def _read_manifest(self,load_path:str):
+        manifest_path = os.path.join(load_path,self.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path,encoding="utf-8") as f:
+            return json.load(f)
+
+    def _is_current(self,manifest)->bool:
+        return isinstance(manifest,dict) and manifest.get("format") in (2,self.FORMAT_VERSION)
     
-    #find the most similar chuncks to a query
-    def similarity_search(self,query:str,k:int=None)->List[Document]:
+    #find the most similar chuncks to a query; only doc_id's chunks when given
+    def similarity_search(self,query:str,k:int=None,doc_id:str=None)->List[Document]:
         if self.vector_store is None:
             raise ValueError("No vector store loaded.")
         
         k = k or config.TOP_RESULTS
-        results =self.vector_store.similarity_search(query,k=k)
+        vector = self.vector_store.embedding_function.embed_query(query)
+        with self._lock:
+            if doc_id is not None:
+                ranking = self._dense_search(query,k,np.array(vector,dtype=np.float32),doc_id)
+                return [self.vector_store.docstore.search(chunk_id) for chunk_id,_ in ranking]
+            results =self.vector_store.similarity_search_by_vector(vector,k=k)
         return results
+
+    #chunks ranked by BM25 (exact terms such as "Section 12.3" or "net 30")
+    def lexical_search(self,query:str,k:int=None)->List[Tuple[Document,float]]:
+        if self.vector_store is None:
+            raise ValueError("No vector store loaded.")
+        k = k or config.TOP_RESULTS
+        with self._lock:
+            return [(self.vector_store.docstore.search(chunk_id),score) for chunk_id,score in self.lexical_index.search(query,k)]
+
+    #Fuse the dense and BM25 rankings by reciprocal rank fusion: each list
+    #contributes weight / (rrf_k + rank), so a chunk ranked well by either one
+    #(or fairly well by both) comes first, without calibrating the two scores.
+    #With doc_id both rankings only hold that document's chunks.
+    def hybrid_search(self,query:str,k:int=None,fetch_k:int=None,doc_id:str=None)->List[Document]:
+        if self.vector_store is None:
+            raise ValueError("No vector store loaded.")
+        k = k or config.TOP_RESULTS
+        fetch_k = max(fetch_k or config.HYBRID_FETCH_K,k)
+        query_vector = np.array(self.vector_store.embedding_function.embed_query(query),dtype=np.float32)
+        with self._lock:
+            ids = None if doc_id is None else set(self.documents.get(doc_id) or ())
+            rankings = ((self._dense_search(query,fetch_k,query_vector,doc_id),config.HYBRID_DENSE_WEIGHT),
+                        (self.lexical_index.search(query,fetch_k,ids),1 - config.HYBRID_DENSE_WEIGHT))
+            fused :Dict[str,float] = {}
+            for ranking,weight in rankings:
+                for rank,(chunk_id,_) in enumerate(ranking):
+                    fused[chunk_id] = fused.get(chunk_id,0.0) + weight / (config.HYBRID_RRF_K + rank + 1)
+            best = sorted(fused,key=fused.get,reverse=True)
+            if config.MMR_ENABLED and best:
+                #fused scores as relevance, scaled to the cosine range
+                relevance = np.array([fused[chunk_id] for chunk_id in best])
+                best = self._diversify(best,relevance / relevance.max(),k)
+            return [self.vector_store.docstore.search(chunk_id) for chunk_id in best[:k]]
+
+    #Dense search diversified by maximal marginal relevance over the fetch_k
+    #nearest chunks (of doc_id, when given), using the vectors already in the
+    #index (nothing is re-embedded)
+    def mmr_search(self,query:str,k:int=None,fetch_k:int=None,lambda_mult:float=None,doc_id:str=None)->List[Document]:
+        if self.vector_store is None:
+            raise ValueError("No vector store loaded.")
+        k = k or config.TOP_RESULTS
+        fetch_k = max(fetch_k or config.MMR_FETCH_K,k)
+        query_vector = np.array(self.vector_store.embedding_function.embed_query(query),dtype=np.float32)
+        with self._lock:
+            ids = [chunk_id for chunk_id,_ in self._dense_search(query,fetch_k,query_vector,doc_id)]
+            if not ids:
+                return []
+            vectors = self._vectors(ids)
+            relevance = vectors @ query_vector / np.maximum(np.linalg.norm(vectors,axis=1) * np.linalg.norm(query_vector),1e-12)
+            ids = self._diversify(ids,relevance,k,lambda_mult,vectors)
+            return [self.vector_store.docstore.search(chunk_id) for chunk_id in ids]
+
+    def _diversify(self,ids:List[str],relevance:np.ndarray,k:int,lambda_mult:float=None,vectors:np.ndarray=None)->List[str]:
+        vectors = self._vectors(ids) if vectors is None else vectors
+        return [ids[n] for n in mmr_select(relevance,vectors,k,lambda_mult)]
+
+    #(chunk ID, squared L2 distance) of the k nearest chunks. Within one document
+    #the search is exact over its stored vectors: a contract is a few thousand
+    #chunks at most, and the shared index can't be asked for one document only.
+    def _dense_search(self,query:str,k:int,query_vector:np.ndarray=None,doc_id:str=None)->List[Tuple[str,float]]:
+        store = self.vector_store
+        if query_vector is None:
+            query_vector = np.array(store.embedding_function.embed_query(query),dtype=np.float32)
+        if doc_id is not None:
+            ids = self.documents.get(doc_id) or []
+            if not ids:
+                return []
+            distances = np.square(self._vectors(ids) - query_vector).sum(axis=1)
+            nearest = np.argsort(distances,kind="stable")[:k]
+            return [(ids[n],float(distances[n])) for n in nearest]
+        vector = query_vector.reshape(1,-1)
+        distances,positions = store.index.search(vector,min(k,store.index.ntotal))
+        return [(store.index_to_docstore_id[int(p)],float(d)) for d,p in zip(distances[0],positions[0]) if p >= 0]
+
+    #retriever for QAChain: dense only (default) or hybrid (config.RETRIEVAL_MODE=
+    #"hybrid"), either one diversified by MMR when config.MMR_ENABLED. It searches
+    #through this store, so searches are safe while documents are ingested.
+    #doc_id limits it to one document's chunks (e.g. the one a session uploaded).
+    def as_retriever(self,k:int=None,doc_id:str=None):
+        from src.retrieval.hybrid import HybridRetriever
+
+        k = k or config.TOP_RESULTS
+        if config.RETRIEVAL_MODE == "hybrid":
+            search_type = "hybrid"
+        else:
+            search_type = "mmr" if config.MMR_ENABLED else "dense"
+        return HybridRetriever(embedder=self,k=k,search_type=search_type,doc_id=doc_id)
     
     def similarity_search_with_scores(
         self,
@@ -0,0 +1,264 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+import xxhash
+from filelock import FileLock
+from langchain_core.embeddings import Embeddings
+from config import config
+
+
+# Persistent, memory-mapped store of chunk embeddings for one model.
+# Vectors live in a fixed-capacity float32 memmap; a parallel memmap holds the
+# 64-bit key of each slot (0 = free) and another its last-use clock, so the
+# cache reopens instantly and only touched pages are read. When it's full the
+# least recently used slots are recycled.
+# Several processes (server workers, the bulk CLI) can share one cache: writes
+# take a file lock and first re-read the slot table if another process has
+# written since (a shared generation counter says so), and a read checks the
+# slot still holds its key, so a recycled slot is a miss, never another
+# text's vector.
+class EmbeddingCache:
+
+    # fraction of slots freed at once when the cache is full
+    EVICT_FRACTION = 1 / 16
+
+    def __init__(self, model_name: str, cache_dir: str = None, max_vectors: int = None):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir or config.EMBEDDING_CACHE_DIR, re.sub(r"[^\w.-]", "_", model_name))
+        self.capacity = max_vectors or config.EMBEDDING_CACHE_MAX_VECTORS
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._file_lock = FileLock(self._path("write.lock"))
+        self._slots: Dict[int, int] = {}  # key -> slot
+        self._free: List[int] = []
+        self._clock = 0
+        self._generation = 0  # of the shared slot table, when last read
+        self._vectors = self._keys = self._used = self._shared_generation = None
+
+        meta = self._read_meta()
+        if meta and meta["capacity"] == self.capacity:
+            self._open(meta["dim"], "r+")
+
+    # (model, whitespace-normalised text) -> non-zero 64-bit key
+    def key(self, text: str) -> int:
+        normalized = " ".join(text.split())
+        return xxhash.xxh3_64_intdigest(f"{self.model_name}\0{normalized}") or 1
+
+    # cached vector for each key, or None on a miss
+    def get_many(self, keys: List[int]) -> List[Optional[List[float]]]:
+        with self._lock:
+            # another process may have created the cache since this one started
+            meta = self._read_meta() if self._vectors is None else None
+            if meta and meta["capacity"] == self.capacity:
+                self._open(meta["dim"], "r+")
+            elif self._vectors is not None and self._changed_elsewhere():
+                self._load_slots()
+            found = []
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    found.append(None)
+                    continue
+                vector = self._vectors[slot].tolist()
+                # recycled by another process since the slot table was read
+                if int(self._keys[slot]) != key:
+                    del self._slots[key]
+                    found.append(None)
+                    continue
+                self._clock += 1
+                self._used[slot] = self._clock
+                found.append(vector)
+            hits = sum(v is not None for v in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return found
+
+    def put_many(self, keys: List[int], vectors: List[List[float]]):
+        if not keys:
+            return
+        with self._lock, self._file_lock:
+            if self._vectors is None:
+                meta = self._read_meta()
+                # another process may have created the files meanwhile
+                if meta and meta["capacity"] == self.capacity and meta["dim"] == len(vectors[0]):
+                    self._open(meta["dim"], "r+")
+                else:
+                    self._open(len(vectors[0]), "w+")
+            elif self._changed_elsewhere():
+                self._load_slots()
+            for key, vector in zip(keys, vectors):
+                slot = self._slots.get(key)
+                if slot is None:
+                    if not self._free:
+                        self._evict()
+                    slot = self._free.pop()
+                    self._slots[key] = slot
+                    # readers see the slot as free until its vector is written
+                    self._keys[slot] = 0
+                    self._vectors[slot] = vector
+                    self._keys[slot] = key
+                else:
+                    self._vectors[slot] = vector
+                self._clock += 1
+                self._used[slot] = self._clock
+            self._vectors.flush()
+            self._keys.flush()
+            self._used.flush()
+            self._generation = int(self._shared_generation[0]) + 1
+            self._shared_generation[0] = self._generation
+            self._shared_generation.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._slots),
+                "capacity": self.capacity,
+            }
+
+    # recycle the least recently used slots (locks held)
+    def _evict(self):
+        count = max(1, int(self.capacity * self.EVICT_FRACTION))
+        victims = np.argpartition(self._used, count - 1)[:count]
+        for slot in victims.tolist():
+            self._slots.pop(int(self._keys[slot]), None)
+            self._keys[slot] = 0
+            self._used[slot] = 0
+            self._free.append(slot)
+
+    def _open(self, dim: int, mode: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode=mode, shape=(self.capacity, dim))
+        self._keys = np.memmap(self._path("keys.u64"), dtype=np.uint64, mode=mode, shape=(self.capacity,))
+        self._used = np.memmap(self._path("used.u64"), dtype=np.uint64, mode=mode, shape=(self.capacity,))
+        # caches written before the counter existed start it at 0
+        generation_mode = mode if os.path.exists(self._path("generation.u64")) else "w+"
+        self._shared_generation = np.memmap(self._path("generation.u64"), dtype=np.uint64, mode=generation_mode, shape=(1,))
+        self._load_slots()
+        if mode == "w+":
+            with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"dim": dim, "capacity": self.capacity, "model": self.model_name}, f)
+
+    # (re)read the slot table shared by every process using the cache
+    def _load_slots(self):
+        self._generation = int(self._shared_generation[0])
+        occupied = np.flatnonzero(self._keys)
+        self._slots = {int(k): int(s) for k, s in zip(self._keys[occupied], occupied)}
+        # pop() hands out low slots first
+        self._free = np.flatnonzero(self._keys == 0)[::-1].tolist()
+        self._clock = max(self._clock, int(self._used.max()))
+
+    def _changed_elsewhere(self) -> bool:
+        return int(self._shared_generation[0]) != self._generation
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+
+# In-process LRU of question embeddings, keyed by model and whitespace-
+# normalised question, so canned and repeated questions skip the model.
+class QueryEmbeddingCache:
+
+    def __init__(self, model_name: str, max_size: int = None):
+        self.model_name = model_name
+        self.max_size = max_size or config.QUERY_CACHE_SIZE
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, List[float]]" = OrderedDict()
+
+    def key(self, text: str) -> tuple:
+        return self.model_name, " ".join(text.split())
+
+    def get(self, key: tuple) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(vector)
+
+    def put(self, key: tuple, vector: List[float]):
+        with self._lock:
+            self._entries[key] = list(vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+# Embeddings wrapper that serves repeated chunk texts (boilerplate clauses)
+# from an EmbeddingCache and repeated questions from a QueryEmbeddingCache;
+# only cache misses reach the wrapped model. Either cache may be omitted.
+class CachedEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache = None, query_cache: QueryEmbeddingCache = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self.embeddings.embed_documents(texts)
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        missing: Dict[int, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if not missing:
+            return vectors
+
+        computed = self.embeddings.embed_documents(list(missing.values()))
+        self.cache.put_many(list(missing), computed)
+        fresh = dict(zip(missing, computed))
+        return [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+        key = self.query_cache.key(text)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.query_cache.put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return await self.embeddings.aembed_query(text)
+        key = self.query_cache.key(text)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.query_cache.put(key, vector)
+        return vector
@@ -1,13 +1,44 @@
+import multiprocessing
 import os
-from typing import Optional
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 import fitz  # PyMuPDF
-import docx  # python-docx
+from lxml import etree
+from config import config
+
+# WordprocessingML tags used by the streaming DOCX reader
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_PARAGRAPH, _ROW, _CELL = f"{_W}p", f"{_W}tr", f"{_W}tc"
+_BODY = f"{_W}body"
+# run content that contributes to paragraph text, as in python-docx's Paragraph.text
+_RUN_TEXT = {f"{_W}t": None, f"{_W}tab": "\t", f"{_W}br": "\n", f"{_W}cr": "\n", f"{_W}noBreakHyphen": "-"}
+
+
+# Runs in a worker process: extract one contiguous range of pages.
+# Each worker opens its own handle because PyMuPDF documents can't be pickled.
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    pages = []
+    with fitz.open(file_path) as pdf_document:
+        for page_number in range(start, end):
+            pages.append((page_number, pdf_document[page_number].get_text()))
+    return pages
 
 
 class FileParser:
 
     SUPPORTED_EXTENSIONS = {".pdf", ".docx"}
 
+    def __init__(
+        self,
+        parallel: Optional[bool] = None,
+        workers: Optional[int] = None,
+        pages_per_task: Optional[int] = None,
+    ):
+        self.parallel = config.PDF_PARALLEL if parallel is None else parallel
+        self.workers = workers or config.PDF_WORKERS
+        self.pages_per_task = pages_per_task or config.PDF_PAGES_PER_TASK
+
     def parse(self, file_path: str) -> str:
         # Check file exists
         if not os.path.exists(file_path):
@@ -27,30 +58,133 @@ class FileParser:
                 f"Supported: {self.SUPPORTED_EXTENSIONS}"
             )
 
+    # Yield the document as a stream of text pieces (PDF pages, DOCX paragraphs).
+    # "\n".join(pieces) is exactly what parse() returns.
+    def iter_pages(self, file_path: str) -> Iterator[str]:
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        _, extension = os.path.splitext(file_path)
+        extension = extension.lower()
+
+        if extension == ".pdf":
+            pieces = self.iter_pdf_pages(file_path)
+        elif extension == ".docx":
+            pieces = self._iter_docx_paragraphs(file_path)
+        else:
+            raise ValueError(
+                f"Unsupported file type: {extension}. "
+                f"Supported: {self.SUPPORTED_EXTENSIONS}"
+            )
+
+        found_text = False
+        for piece in pieces:
+            found_text = found_text or bool(piece.strip())
+            yield piece
+        if not found_text:
+            raise ValueError(f"No text could be extracted from the {extension[1:].upper()}.")
+
     def _parse_pdf(self, file_path: str) -> str:
-        text_parts = []
-        with fitz.open(file_path) as pdf_document:
-            for page_number in range(len(pdf_document)):
-                page = pdf_document[page_number]
-                page_text = page.get_text()
-                if page_text.strip():
-                    text_parts.append(
-                        f"\n[Page {page_number + 1}]\n{page_text}"
-                    )
-
-        full_text = "\n".join(text_parts)
+        full_text = "\n".join(self.iter_pdf_pages(file_path))
         if not full_text.strip():
             raise ValueError("No text could be extracted from the PDF.")
         return full_text
 
-    def _parse_docx(self, file_path: str) -> str:
-        doc = docx.Document(file_path)
-        text_parts = []
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text_parts.append(paragraph.text)
+    # Yield "[Page N]"-tagged page texts in order, skipping blank pages.
+    # Large documents are split into page ranges extracted by a process pool;
+    # small ones (or parallel=False) take the serial path.
+    def iter_pdf_pages(self, file_path: str) -> Iterator[str]:
+        with fitz.open(file_path) as pdf_document:
+            page_count = len(pdf_document)
+            if not self._use_pool(page_count):
+                for page_number in range(page_count):
+                    yield from self._format_page(page_number, pdf_document[page_number].get_text())
+                return
+
+        yield from self._iter_pdf_pages_parallel(file_path, page_count)
+
+    def _use_pool(self, page_count: int) -> bool:
+        return self.parallel and self.workers > 1 and page_count > self.pages_per_task
 
-        full_text = "\n".join(text_parts)
+    def _iter_pdf_pages_parallel(self, file_path: str, page_count: int) -> Iterator[str]:
+        ranges = [
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+        workers = min(self.workers, len(ranges))
+        # Keep only a small window of ranges in flight so pages are handed
+        # downstream as soon as the next range in order is ready.
+        window = workers * 2
+        # spawn: the server process runs torch/faiss threads, which fork can deadlock
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = [
+                pool.submit(_extract_page_range, file_path, start, end)
+                for start, end in ranges[:window]
+            ]
+            next_range = len(pending)
+            while pending:
+                pages = pending.pop(0).result()
+                if next_range < len(ranges):
+                    start, end = ranges[next_range]
+                    pending.append(pool.submit(_extract_page_range, file_path, start, end))
+                    next_range += 1
+                for page_number, page_text in pages:
+                    yield from self._format_page(page_number, page_text)
+
+    @staticmethod
+    def _format_page(page_number: int, page_text: str) -> Iterator[str]:
+        if page_text.strip():
+            yield f"\n[Page {page_number + 1}]\n{page_text}"
+
+    def _parse_docx(self, file_path: str) -> str:
+        full_text = "\n".join(self._iter_docx_paragraphs(file_path))
         if not full_text.strip():
             raise ValueError("No text could be extracted from the DOCX.")
-        return full_text
\ No newline at end of file
+        return full_text
+
+    # Stream word/document.xml instead of building python-docx's object model.
+    # Yields body paragraphs and table rows (cells joined by " | ") in document
+    # order; each element is cleared once read so memory stays flat.
+    def _iter_docx_paragraphs(self, file_path: str) -> Iterator[str]:
+        rows: List[List[str]] = []   # open table rows (nested tables stack)
+        cells: List[List[str]] = []  # paragraphs of the open table cells
+        with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml_file:
+            events = etree.iterparse(xml_file, events=("start", "end"), tag=(_PARAGRAPH, _ROW, _CELL))
+            for event, element in events:
+                tag = element.tag
+                if event == "start":
+                    if tag == _ROW:
+                        rows.append([])
+                    elif tag == _CELL:
+                        cells.append([])
+                    continue
+
+                if tag == _PARAGRAPH:
+                    text = self._docx_paragraph_text(element)
+                    if cells:
+                        cells[-1].append(text)
+                    elif text.strip():
+                        yield text
+                elif tag == _CELL:
+                    rows[-1].append(" ".join(p.strip() for p in cells.pop() if p.strip()))
+                else:
+                    row = " | ".join(rows.pop())
+                    if cells:
+                        cells[-1].append(row)
+                    elif row.strip(" |"):
+                        yield row
+
+                element.clear()
+                # drop already-processed siblings so the body stays empty
+                parent = element.getparent()
+                if parent is not None and parent.tag == _BODY:
+                    while element.getprevious() is not None:
+                        del parent[0]
+
+    @staticmethod
+    def _docx_paragraph_text(paragraph) -> str:
+        parts = []
+        for node in paragraph.iter(*_RUN_TEXT):
+            replacement = _RUN_TEXT[node.tag]
+            parts.append((node.text or "") if replacement is None else replacement)
+        return "".join(parts)
\ No newline at end of file
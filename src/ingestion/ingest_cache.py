@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import xxhash
+from config import config
+
+# bump when the entry layout changes so old entries are never read back
+CACHE_FORMAT_VERSION = 3
+
+
+# On-disk cache of ingestion results keyed by the uploaded bytes plus the
+# settings that shape them (chunking config, embedding model).
+# Each entry holds the chunk texts + metadata and their vectors, so an
+# identical re-upload skips parsing, chunking and embedding entirely.
+# Entries are evicted least-recently-used once the total size passes max_bytes.
+class IngestionCache:
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or config.INGEST_CACHE_DIR
+        self.max_bytes = max_bytes or config.INGEST_CACHE_MAX_MB * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # key -> {"size": bytes on disk, "last_used": timestamp}
+        self._entries: Dict[str, Dict] = self._load_index()
+
+    # Hash the file contents in blocks together with the ingestion settings
+    # chunk_config: TextChunker.config_key
+    def key_for(self, file_path: str, chunk_config: str, model_name: str) -> str:
+        hasher = xxhash.xxh3_128()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(block)
+        hasher.update(f"|v{CACHE_FORMAT_VERSION}|{chunk_config}|{model_name}".encode())
+        return hasher.hexdigest()
+
+    # Return the cached entry ({"texts", "metadatas", "vectors", "stats"}) or None
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            entry_dir = self._entry_dir(key)
+            try:
+                with open(os.path.join(entry_dir, "chunks.json"), encoding="utf-8") as f:
+                    payload = json.load(f)
+                vectors = np.load(os.path.join(entry_dir, "vectors.npy"))
+            except (OSError, ValueError):
+                # entry was removed or is corrupt: forget it and recompute
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries[key]["last_used"] = time.time()
+            self._save_index()
+
+        return {
+            "texts": payload["texts"],
+            "metadatas": payload["metadatas"],
+            "vectors": vectors,
+            "stats": payload["stats"],
+        }
+
+    def put(self, key: str, texts: List[str], metadatas: List[dict], vectors: np.ndarray, stats: Dict):
+        payload = {"texts": texts, "metadatas": metadatas, "stats": stats}
+        tmp_dir = self._entry_dir(key) + f".tmp{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        with open(os.path.join(tmp_dir, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        np.save(os.path.join(tmp_dir, "vectors.npy"), np.asarray(vectors, dtype=np.float32))
+        size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+
+        with self._lock:
+            if size > self.max_bytes:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            self._remove(key)
+            os.replace(tmp_dir, self._entry_dir(key))
+            self._entries[key] = {"size": size, "last_used": time.time()}
+            self._evict()
+            self._save_index()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "size_bytes": sum(e["size"] for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._save_index()
+
+    # drop least recently used entries until the cache fits (lock held)
+    def _evict(self):
+        total = sum(e["size"] for e in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._entries[key]["size"]
+            self._remove(key)
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load_index(self) -> Dict[str, Dict]:
+        path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {k: v for k, v in entries.items() if os.path.isdir(self._entry_dir(k))}
+
+    def _save_index(self):
+        path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,202 @@
+import json
+import os
+import re
+from collections import Counter
+from typing import Container, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config import config
+
+# words, numbers and dotted/hyphenated references ("12.3", "net-30", "2(b)" -> "2", "b")
+_TOKEN = re.compile(r"\w+(?:[.\-/]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+# BM25 over chunk texts, as an inverted index (term -> postings) in flat numpy
+# arrays so a query scores only the postings of its terms, vectorized.
+#
+# Postings are (term, slot, tf) triples sorted by term, with indptr[t] the
+# start of term t's run. New chunks are appended to an unsorted tail and
+# removed chunks only cleared from `alive`; both are folded in (sort, drop
+# dead postings, renumber slots) before the next search.
+class BM25Index:
+
+    FILES = ("terms", "slots", "tfs", "indptr", "doc_len")
+    # query terms found in more than this fraction of chunks are skipped
+    MAX_DF = 0.5
+
+    def __init__(self, k1: float = None, b: float = None):
+        self.k1 = config.BM25_K1 if k1 is None else k1
+        self.b = config.BM25_B if b is None else b
+        self.vocabulary: Dict[str, int] = {}
+        # slot -> chunk ID; any indexable sequence (lazily read after load())
+        self.chunk_ids: Sequence[str] = []
+        self._slot_of: Optional[Dict[str, int]] = {}
+        self._terms = np.zeros(0, dtype=np.int32)
+        self._slots = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.float32)
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._alive: Optional[np.ndarray] = None
+        self._tail: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._tail_lengths: List[int] = []
+        self._read_only = False
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids) if self._alive is None else int(self._alive.sum())
+
+    def add(self, chunk_ids: List[str], texts: List[str]):
+        self._writable()
+        terms, slots, tfs = [], [], []
+        for chunk_id, text in zip(chunk_ids, texts):
+            slot = len(self.chunk_ids)
+            self.chunk_ids.append(chunk_id)
+            self._slot_of[chunk_id] = slot
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                terms.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                slots.append(slot)
+                tfs.append(tf)
+            self._tail_lengths.append(sum(counts.values()))
+        self._tail.append((np.array(terms, dtype=np.int32), np.array(slots, dtype=np.int32), np.array(tfs, dtype=np.float32)))
+
+    def remove(self, chunk_ids: List[str]):
+        self._writable()
+        self._fold()
+        if self._alive is None:
+            self._alive = np.ones(len(self.chunk_ids), dtype=bool)
+        for chunk_id in chunk_ids:
+            slot = self._slot_of.pop(chunk_id, None)
+            if slot is not None:
+                self._alive[slot] = False
+
+    # top-k (chunk ID, score) by BM25; chunks sharing no term with the query are
+    # left out, and so are chunks not in `ids` when it is given
+    def search(self, query: str, k: int, ids: Optional[Container[str]] = None) -> List[Tuple[str, float]]:
+        self._compact()
+        term_ids = sorted({self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary})
+        if not term_ids or not len(self._doc_len):
+            return []
+        n = len(self._doc_len)
+        term_ids = np.array(term_ids)
+        starts, ends = self._indptr[term_ids], self._indptr[term_ids + 1]
+        # terms in most chunks ("the", "section") add almost nothing to the
+        # ranking but most of the postings; skip them unless nothing else matches
+        rare = (ends - starts) <= n * self.MAX_DF
+        if rare.any():
+            starts, ends = starts[rare], ends[rare]
+        df = (ends - starts).astype(np.float64)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+
+        postings = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+        slots = np.asarray(self._slots[postings])
+        tfs = np.asarray(self._tfs[postings])
+        weights = np.repeat(idf, ends - starts)
+        avg_len = float(self._doc_len.mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * np.asarray(self._doc_len[slots]) / avg_len)
+        contributions = weights * tfs * (self.k1 + 1) / (tfs + norm)
+
+        if len(slots) * 8 > n:
+            # dense accumulator: linear, no sort
+            scores = np.bincount(slots, weights=contributions, minlength=n)
+            matched = np.flatnonzero(scores)
+            scores = scores[matched]
+        else:
+            matched, inverse = np.unique(slots, return_inverse=True)
+            scores = np.bincount(inverse, weights=contributions)
+        if ids is not None:
+            keep = np.fromiter((self.chunk_ids[int(m)] in ids for m in matched), dtype=bool, count=len(matched))
+            matched, scores = matched[keep], scores[keep]
+        if len(matched) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(matched))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.chunk_ids[int(matched[i])], float(scores[i])) for i in top]
+
+    # Write the index in the order of `chunk_ids` (e.g. FAISS positions), so
+    # load() can resolve slots through any sequence in that same order
+    def save(self, path: str, chunk_ids: Sequence[str]):
+        self._compact()
+        order = np.array([self._slot_of[chunk_id] for chunk_id in chunk_ids], dtype=np.int64)
+        position = np.empty(len(order), dtype=np.int32)
+        position[order] = np.arange(len(order), dtype=np.int32)
+        np.save(os.path.join(path, "bm25.terms.npy"), self._terms)
+        np.save(os.path.join(path, "bm25.slots.npy"), position[self._slots])
+        np.save(os.path.join(path, "bm25.tfs.npy"), self._tfs)
+        np.save(os.path.join(path, "bm25.indptr.npy"), self._indptr)
+        np.save(os.path.join(path, "bm25.doc_len.npy"), self._doc_len[order])
+        with open(os.path.join(path, "bm25.vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": list(self.vocabulary)}, f)
+
+    # Open a saved index memory-mapped and read-only; chunk_ids maps slot -> ID
+    @classmethod
+    def load(cls, path: str, chunk_ids: Sequence[str]) -> "BM25Index":
+        with open(os.path.join(path, "bm25.vocab.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(meta["k1"], meta["b"])
+        index.vocabulary = {term: n for n, term in enumerate(meta["terms"])}
+        index._terms, index._slots, index._tfs, index._indptr, index._doc_len = (
+            np.load(os.path.join(path, f"bm25.{name}.npy"), mmap_mode="r") for name in cls.FILES
+        )
+        index.chunk_ids = chunk_ids
+        index._slot_of = None
+        index._read_only = True
+        return index
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "bm25.vocab.json"))
+
+    # Copy a loaded index into memory so it can be updated; chunk_ids is now a list
+    def materialize(self, chunk_ids: List[str]):
+        if not self._read_only:
+            return
+        self._terms, self._slots, self._tfs, self._indptr, self._doc_len = (
+            np.array(a) for a in (self._terms, self._slots, self._tfs, self._indptr, self._doc_len)
+        )
+        self.chunk_ids = list(chunk_ids)
+        self._slot_of = {chunk_id: slot for slot, chunk_id in enumerate(self.chunk_ids)}
+        self._read_only = False
+
+    def _writable(self):
+        if self._read_only:
+            raise RuntimeError("BM25 index was loaded read-only; call materialize() first")
+
+    # move the unsorted tail into the sorted postings
+    def _fold(self):
+        if not self._tail:
+            return
+        terms = np.concatenate([self._terms, *(t for t, _, _ in self._tail)])
+        slots = np.concatenate([self._slots, *(s for _, s, _ in self._tail)])
+        tfs = np.concatenate([self._tfs, *(f for _, _, f in self._tail)])
+        self._doc_len = np.concatenate([self._doc_len, np.array(self._tail_lengths, dtype=np.float32)])
+        if self._alive is not None:
+            self._alive = np.concatenate([self._alive, np.ones(len(self._tail_lengths), dtype=bool)])
+        self._tail, self._tail_lengths = [], []
+        order = np.argsort(terms, kind="stable")
+        self._terms, self._slots, self._tfs = terms[order], slots[order], tfs[order]
+        self._reindex()
+
+    # fold the tail and drop removed chunks, renumbering the remaining slots
+    def _compact(self):
+        if self._read_only:
+            return
+        self._fold()
+        if self._alive is None:
+            return
+        keep = self._alive[self._slots]
+        renumber = np.cumsum(self._alive, dtype=np.int64) - 1
+        self._terms, self._tfs = self._terms[keep], self._tfs[keep]
+        self._slots = renumber[self._slots[keep]].astype(np.int32)
+        self._doc_len = self._doc_len[self._alive]
+        self.chunk_ids = [chunk_id for chunk_id, alive in zip(self.chunk_ids, self._alive) if alive]
+        self._slot_of = {chunk_id: slot for slot, chunk_id in enumerate(self.chunk_ids)}
+        self._alive = None
+        self._reindex()
+
+    def _reindex(self):
+        counts = np.bincount(self._terms, minlength=len(self.vocabulary))
+        self._indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
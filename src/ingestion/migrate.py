@@ -0,0 +1,17 @@
+import argparse
+from .embedder import EmbedderStore
+
+
+# One-time conversion of an index saved by an older version (a single
+# index.faiss + index.pkl) to the per-document segment format that
+# EmbedderStore.load_store() reads. The server never converts on its own.
+def main():
+    parser = argparse.ArgumentParser(description="Convert an older single-file FAISS index to per-document segments.")
+    parser.add_argument("index_dir", nargs="?", default=None, help="index directory (default: config.FAISS_INDEX_DIR)")
+    args = parser.parse_args()
+
+    EmbedderStore().migrate_legacy(args.index_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+import queue
+import threading
+from typing import Dict, Iterable, Iterator, List
+from langchain.schema import Document
+from config import config
+from .file_parser import FileParser
+from .chunker import TextChunker
+from .embedder import EmbedderStore
+from .ingest_cache import IngestionCache
+
+# end-of-stream marker passed between stages
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+# Streaming parse -> chunk -> embed -> index ingestion.
+# Parsing and chunking run in their own threads and hand work downstream
+# through bounded queues; the calling thread embeds chunk batches and adds
+# them to the FAISS index as they arrive. Parsing therefore overlaps with
+# embedding, and at most `queue_size` pages / batches are held at once.
+# With a cache, identical re-uploads are restored without any of the stages.
+class IngestionPipeline:
+
+    def __init__(
+        self,
+        file_parser: FileParser = None,
+        chunker: TextChunker = None,
+        embedder: EmbedderStore = None,
+        queue_size: int = None,
+        batch_size: int = None,
+        cache: IngestionCache = None,
+    ):
+        self.file_parser = file_parser or FileParser()
+        self.chunker = chunker or TextChunker()
+        self.embedder = embedder or EmbedderStore()
+        self.queue_size = queue_size or config.INGEST_QUEUE_SIZE
+        self.batch_size = batch_size or config.EMBED_BATCH_SIZE
+        self.cache = cache
+
+    # Ingest one file; the resulting index is left on self.embedder.vector_store.
+    # doc_id identifies the document across revisions (default: its source name);
+    # re-ingesting a doc_id only embeds the chunks that changed.
+    def run(self, file_path: str, metadata: dict = None, save_path: str = None, doc_id: str = None) -> Dict:
+        metadata = metadata or {}
+        doc_id = doc_id or metadata.get("source") or os.path.basename(file_path)
+        key = None
+        if self.cache is not None:
+            key = self.cache.key_for(file_path, self.chunker.config_key, self.embedder.model_name)
+            cached = self.cache.get(key)
+            if cached is not None:
+                # same bytes may arrive under a new name: caller metadata wins
+                metadatas = [{**m, **metadata} for m in cached["metadatas"]]
+                self.embedder.create_from_embeddings(cached["texts"], cached["vectors"], metadatas, save_path, doc_id)
+                return {**cached["stats"], **self._update_stats(), "cached": True}
+
+        stats = self._stream(file_path, metadata, save_path, doc_id)
+
+        if key is not None:
+            documents = self.embedder.get_documents(doc_id)
+            self.cache.put(
+                key,
+                [doc.page_content for doc in documents],
+                [doc.metadata for doc in documents],
+                self.embedder.get_embeddings(doc_id),
+                stats,
+            )
+        return {**stats, **self._update_stats(), "cached": False}
+
+    # how much of the last ingestion was embedded vs. reused from a previous
+    # revision, and how many of the embedded chunks the embedding cache served
+    def _update_stats(self) -> Dict:
+        update = self.embedder.last_update
+        lookups = update["cache_hits"] + update["cache_misses"]
+        return {
+            "embedded": update["embedded"],
+            "reused": update["reused"],
+            "removed": update["removed"],
+            "embedding_cache_hits": update["cache_hits"],
+            "embedding_cache_hit_rate": round(update["cache_hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    def _stream(self, file_path: str, metadata: dict, save_path: str, doc_id: str) -> Dict:
+        stop = threading.Event()
+        pages: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        batches: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stats = {"characters": 0, "pages": 0, "total_chunks": 0, "chunk_characters": 0}
+
+        def counted_pages() -> Iterator[str]:
+            for page in self.file_parser.iter_pages(file_path):
+                # +1 for the "\n" joining pieces in FileParser.parse
+                stats["characters"] += len(page) + (1 if stats["pages"] else 0)
+                stats["pages"] += 1
+                yield page
+
+        def counted_batches() -> Iterator[List[Document]]:
+            chunks = self.chunker.iter_chunks(self._drain(pages, stop), metadata)
+            for batch in self._batch(chunks):
+                stats["total_chunks"] += len(batch)
+                stats["chunk_characters"] += sum(len(doc.page_content) for doc in batch)
+                yield batch
+
+        stages = [
+            threading.Thread(target=self._produce, args=(counted_pages(), pages, stop), daemon=True),
+            threading.Thread(target=self._produce, args=(counted_batches(), batches, stop), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            self.embedder.create_and_store_stream(self._drain(batches, stop), save_path, doc_id)
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+
+        return {
+            "characters": stats["characters"],
+            "pages": stats["pages"],
+            "total_chunks": stats["total_chunks"],
+            "avg_chunk_size": stats["chunk_characters"] // max(stats["total_chunks"], 1),
+        }
+
+    def _batch(self, documents: Iterable[Document]) -> Iterator[List[Document]]:
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Stage body: push every item of `items` downstream, then the end marker.
+    # Errors are forwarded so the consuming stage re-raises them.
+    @staticmethod
+    def _produce(items: Iterable, out: queue.Queue, stop: threading.Event):
+        try:
+            for item in items:
+                if not IngestionPipeline._put(out, item, stop):
+                    return
+        except Exception as e:
+            IngestionPipeline._put(out, _StageError(e), stop)
+            return
+        IngestionPipeline._put(out, _DONE, stop)
+
+    @staticmethod
+    def _put(out: queue.Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _drain(source: queue.Queue, stop: threading.Event) -> Iterator:
+        while not stop.is_set():
+            try:
+                item = source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
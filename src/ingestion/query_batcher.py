@@ -0,0 +1,123 @@
+import asyncio
+import bisect
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+from langchain_core.embeddings import Embeddings
+from config import config
+
+
+# Fixed-bucket histogram: counts[i] is the number of observations <= bounds[i]
+# (and above the previous bound); the last count is everything above.
+class Histogram:
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            buckets = {f"le_{bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+            buckets["inf"] = self.counts[-1]
+            return {
+                "count": self.count,
+                "mean": round(self.total / self.count, 4) if self.count else 0.0,
+                "buckets": buckets,
+            }
+
+
+# Embeddings wrapper that micro-batches questions. Concurrent embed_query
+# callers are queued; a background thread waits up to window_ms after the
+# first one (or until max_batch questions are queued), embeds the whole
+# batch in one forward pass and hands each caller its vector. Documents pass
+# straight through. Batch sizes and queue waits are kept as histograms.
+class QueryBatcher(Embeddings):
+
+    BATCH_SIZE_BOUNDS = (1, 2, 4, 8, 16, 32, 64)
+    WAIT_MS_BOUNDS = (0.5, 1, 2, 5, 10, 20, 50, 100)
+
+    def __init__(self, embeddings: Embeddings, window_ms: float = None, max_batch: int = None):
+        self.embeddings = embeddings
+        self.window_ms = config.QUERY_BATCH_WINDOW_MS if window_ms is None else window_ms
+        self.max_batch = max_batch or config.QUERY_BATCH_MAX_SIZE
+        self.batch_sizes = Histogram(self.BATCH_SIZE_BOUNDS)
+        self.queue_wait_ms = Histogram(self.WAIT_MS_BOUNDS)
+        self._queue: List[Tuple[str, float, Future]] = []
+        self._ready = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        with self._ready:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                self._worker.start()
+            self._queue.append((text, time.perf_counter(), future))
+            self._ready.notify()
+        return future
+
+    def stats(self) -> Dict:
+        return {
+            "window_ms": self.window_ms,
+            "max_batch": self.max_batch,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for _, queued, _ in batch:
+                self.queue_wait_ms.observe((started - queued) * 1000)
+            try:
+                vectors = self._embed([text for text, _, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    # block until a question arrives, then collect for up to window_ms
+    def _next_batch(self) -> List[Tuple[str, float, Future]]:
+        with self._ready:
+            while not self._queue:
+                self._ready.wait()
+            deadline = self._queue[0][1] + self.window_ms / 1000
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            batch, self._queue = self._queue[: self.max_batch], self._queue[self.max_batch :]
+            return batch
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) == 1:
+            return [self.embeddings.embed_query(texts[0])]
+        # models with a query-specific path embed the batch in one pass there
+        embed_queries = getattr(self.embeddings, "embed_queries", None)
+        if embed_queries is not None:
+            return embed_queries(texts)
+        return self.embeddings.embed_documents(texts)
@@ -0,0 +1,41 @@
+import re
+from functools import lru_cache
+from typing import Callable
+from config import config
+
+# words and punctuation marks; used when no real tokenizer can be loaded
+_APPROX_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def approximate_token_count(text: str) -> int:
+    return len(_APPROX_TOKEN.findall(text))
+
+
+# Return a text -> token count function for `name` ("tiktoken:<encoding>" or
+# "hf:<model>", default config.TOKENIZER). Tokenizers are loaded once per
+# process and shared by the chunker and the QA chain.
+def get_token_counter(name: str = None) -> Callable[[str], int]:
+    return _load_token_counter(name or config.TOKENIZER)
+
+
+@lru_cache(maxsize=None)
+def _load_token_counter(name: str) -> Callable[[str], int]:
+    backend, _, model = name.partition(":")
+    if backend not in ("tiktoken", "hf"):
+        raise ValueError(f"Unknown tokenizer: {name}. Use 'tiktoken:<encoding>' or 'hf:<model>'.")
+
+    try:
+        if backend == "tiktoken":
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(model)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_pretrained(model)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+    except Exception as e:
+        # e.g. offline and the vocabulary isn't cached yet
+        print(f"Tokenizer '{name}' unavailable ({e}); approximating token counts")
+        return approximate_token_count
@@ -0,0 +1,300 @@
+import math
+from typing import Callable, Iterable, Optional
+import faiss
+import numpy as np
+from config import config
+
+# ordered from cheapest to build to most scalable
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+# how vectors are stored in the index: float32, float16, 8-bit scalar
+# quantization or product quantization (PQ_M bytes per vector)
+COMPRESSIONS = ("none", "fp16", "sq8", "pq")
+
+
+# Index type for a corpus of n vectors. "auto" keeps exact search while a
+# linear scan is cheap, switches to an HNSW graph for mid-sized corpora and
+# to a trained inverted file once there are enough vectors to learn good
+# clusters. A forced "ivf" stays flat until it can be trained.
+def choose_index_type(n: int, index_type: str = None) -> str:
+    index_type = index_type or config.INDEX_TYPE
+    if index_type not in INDEX_TYPES + ("auto",):
+        raise ValueError(f"Unknown index type '{index_type}'. Supported: auto, {', '.join(INDEX_TYPES)}")
+    if index_type == "ivf":
+        return "ivf" if n >= config.IVF_MIN_VECTORS else "flat"
+    if index_type != "auto":
+        return index_type
+    if n >= config.IVF_MIN_VECTORS:
+        return "ivf"
+    if n >= config.FLAT_MAX_VECTORS:
+        return "hnsw"
+    return "flat"
+
+
+# PQ codebooks need ~10k training vectors; until then use 8-bit SQ
+def choose_compression(n: int, compression: str = None) -> str:
+    compression = compression or config.INDEX_COMPRESSION
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}'. Supported: {', '.join(COMPRESSIONS)}")
+    if compression == "pq" and n < config.PQ_MIN_VECTORS:
+        return "sq8"
+    return compression
+
+
+def unwrap(index) -> faiss.Index:
+    while isinstance(index, (RerankingIndex, TombstoneIndex)):
+        index = index.index
+    return index
+
+
+# the TombstoneIndex in an installed index's wrappers, if any
+def tombstones_of(index) -> Optional["TombstoneIndex"]:
+    if isinstance(index, RerankingIndex):
+        index = index.index
+    return index if isinstance(index, TombstoneIndex) else None
+
+
+def index_type_of(index) -> str:
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def compression_of(index) -> str:
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+
+# IndexFlat (and its compressed variants) compact on remove_ids, which is what
+# LangChain's FAISS.delete expects; the other types hide deleted positions
+# (see TombstoneIndex) until they are rebuilt (see rebuild_index)
+def supports_remove(index) -> bool:
+    return index_type_of(index) == "flat"
+
+
+# number of IVF lists: ~4*sqrt(n), with at least 39 training points per list
+def ivf_nlist(n: int) -> int:
+    return max(1, min(config.IVF_NLIST or int(4 * math.sqrt(n)), n // 39))
+
+
+# PQ sub-quantizers: PQ_M, or the largest divisor of dim below it
+def pq_subquantizers(dim: int) -> int:
+    return next(m for m in range(min(config.PQ_M, dim), 0, -1) if dim % m == 0)
+
+
+def factory_string(index_type: str, compression: str, n: int, dim: int) -> str:
+    storage = {
+        "none": "Flat",
+        "fp16": "SQfp16",
+        "sq8": "SQ8",
+        "pq": f"PQ{pq_subquantizers(dim)}x8",
+    }[compression]
+    if index_type == "hnsw":
+        # HNSW's own PQ storage takes no "x8" suffix
+        return f"HNSW{config.HNSW_M},{storage.replace('x8', '')}"
+    if index_type == "ivf":
+        return f"IVF{ivf_nlist(n)},{storage}"
+    return storage
+
+
+# Empty index of the given type and compression for vectors like `vectors`;
+# anything that needs training (IVF, SQ8, PQ) is trained on (a sample of)
+# them. Search knobs come from config.
+def new_index(vectors: np.ndarray, index_type: str, compression: str = "none") -> faiss.Index:
+    dim = vectors.shape[1]
+    index = faiss.index_factory(dim, factory_string(index_type, compression, len(vectors), dim), faiss.METRIC_L2)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+    if compression == "pq":
+        # polysemous codes (on by default in index_factory) only help Hamming
+        # filtering, which we don't use, and make training orders slower
+        storage = faiss.downcast_index(index.storage) if index_type == "hnsw" else index
+        storage.do_polysemous_training = False
+    if not index.is_trained:
+        sample = vectors
+        points = ivf_nlist(len(vectors)) * config.IVF_TRAIN_POINTS_PER_LIST if index_type == "ivf" else 0
+        points = max(points, config.PQ_MIN_VECTORS if compression == "pq" else 0)
+        if points and len(vectors) > points:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), points, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    if index_type == "ivf":
+        # keeps reconstruct() working for get_embeddings and segment saves
+        index.make_direct_map()
+    set_search_params(index)
+    return index
+
+
+# index of the chosen type and compression holding `vectors` (ids 0..n-1)
+def build_index(vectors: np.ndarray, index_type: str = None, compression: str = None) -> faiss.Index:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = new_index(
+        vectors,
+        choose_index_type(len(vectors), index_type),
+        choose_compression(len(vectors), compression),
+    )
+    index.add(vectors)
+    return index
+
+
+# A copy of the index holding only `vectors`, for indexes that can't remove
+# in place. The copy keeps IVF centroids and SQ/PQ codebooks, so this is just
+# a re-add; the original keeps serving searches until the copy replaces it.
+def rebuild_index(index, vectors: np.ndarray) -> faiss.Index:
+    index = faiss.clone_index(unwrap(index))
+    index.reset()
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    set_search_params(index)
+    return index
+
+
+def set_search_params(index):
+    index = unwrap(index)
+    kind = index_type_of(index)
+    if kind == "hnsw":
+        index.hnsw.efSearch = config.HNSW_EF_SEARCH
+    elif kind == "ivf":
+        faiss.extract_index_ivf(index).nprobe = config.IVF_NPROBE
+
+
+# Maximal marginal relevance: pick k of the candidates, each time the one
+# maximising lambda_mult * relevance - (1 - lambda_mult) * (cosine similarity
+# to the closest one already picked), so overlapping neighbours of a chunk
+# (e.g. adjacent chunks sharing chunk_overlap text) don't crowd out the rest.
+# All pairwise similarities come from one matrix product; the greedy loop is
+# k vector operations. Returns candidate indices in pick order.
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float = None) -> list:
+    lambda_mult = config.MMR_LAMBDA if lambda_mult is None else lambda_mult
+    relevance = np.asarray(relevance, dtype=np.float32)
+    if not len(relevance):
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+    picked = [int(np.argmax(relevance))]
+    closest = similarity[picked[0]].copy()
+    available = np.ones(len(relevance), dtype=bool)
+    available[picked[0]] = False
+    for _ in range(min(k, len(relevance)) - 1):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * closest, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        np.maximum(closest, similarity[best], out=closest)
+    return picked
+
+
+# Exact L2 search over a memory-mapped float32 matrix. faiss reads flat
+# indexes fully into RAM even with IO_FLAG_MMAP (only IVF lists are mapped),
+# so a flat checkpoint is served from the vectors file itself: the scan goes
+# block by block and the OS shares the file's pages between processes.
+class MmapFlatIndex:
+
+    BLOCK = 65536
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+        self.ntotal = len(vectors)
+        self.d = vectors.shape[1]
+        self.is_trained = True
+
+    def search(self, x: np.ndarray, k: int):
+        x = np.asarray(x, dtype=np.float32)
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        query_norms = (x ** 2).sum(axis=1)[:, None]
+        for start in range(0, self.ntotal, self.BLOCK):
+            block = np.asarray(self.vectors[start : start + self.BLOCK])
+            block_distances = query_norms - 2 * x @ block.T + (block ** 2).sum(axis=1)[None, :]
+            block_labels = np.broadcast_to(np.arange(start, start + len(block)), block_distances.shape)
+            merged = np.hstack([distances, np.maximum(block_distances, 0)])
+            merged_labels = np.hstack([labels, block_labels])
+            top = np.argpartition(merged, k - 1, axis=1)[:, :k]
+            distances = np.take_along_axis(merged, top, axis=1)
+            labels = np.take_along_axis(merged_labels, top, axis=1)
+        order = np.argsort(distances, axis=1)
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def reconstruct(self, key: int) -> np.ndarray:
+        return np.array(self.vectors[key])
+
+    def reconstruct_batch(self, keys: np.ndarray) -> np.ndarray:
+        return np.asarray(self.vectors[keys])
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        return np.array(self.vectors[start : start + n])
+
+
+# Wraps an HNSW or IVF index, which can't remove vectors in place: deleted
+# positions are only recorded, and searches skip them through a faiss
+# IDSelector, so a delete costs nothing up front. The positions stay taken
+# (LangChain's FAISS maps positions to chunks) until the index is rebuilt
+# without them once they pass config.INDEX_COMPACT_FRACTION of it.
+class TombstoneIndex:
+
+    def __init__(self, index: faiss.Index):
+        self.index = index
+        self.deleted: set = set()
+        self._params = None
+
+    def delete(self, positions: Iterable[int]):
+        self.deleted.update(positions)
+        self._params = None
+
+    def search(self, x: np.ndarray, k: int):
+        if not self.deleted:
+            return self.index.search(x, k)
+        return self.index.search(x, k, params=self._search_params())
+
+    # the selector objects are kept alive here: faiss holds raw pointers to them
+    def _search_params(self):
+        if self._params is None:
+            deleted = faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+            keep = faiss.IDSelectorNot(deleted)
+            if index_type_of(self.index) == "hnsw":
+                params = faiss.SearchParametersHNSW(sel=keep, efSearch=self.index.hnsw.efSearch)
+            else:
+                params = faiss.SearchParametersIVF(sel=keep, nprobe=faiss.extract_index_ivf(self.index).nprobe)
+            self._params = (params, keep, deleted)
+        return self._params[0]
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+# Wraps a compressed index: each search fetches k * k_factor candidates from
+# it, then re-ranks them by exact L2 distance against the float32 vectors
+# returned by exact_vectors(positions) (read from disk, not held in RAM).
+# Everything else is delegated, so LangChain's FAISS can use it as its index.
+class RerankingIndex:
+
+    def __init__(self, index: faiss.Index, exact_vectors: Callable[[np.ndarray], np.ndarray], k_factor: int):
+        self.index = index
+        self.exact_vectors = exact_vectors
+        self.k_factor = k_factor
+
+    def search(self, x: np.ndarray, k: int):
+        candidates = min(k * self.k_factor, self.index.ntotal) or k
+        _, ids = self.index.search(x, candidates)
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        for row, query in enumerate(x):
+            found = ids[row][ids[row] >= 0]
+            if not len(found):
+                continue
+            exact = ((self.exact_vectors(found) - query) ** 2).sum(axis=1)
+            best = np.argsort(exact)[:k]
+            distances[row, : len(best)] = exact[best]
+            labels[row, : len(best)] = found[best]
+        return distances, labels
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
@@ -1 +1,6 @@
-from .qa_chain import QAChain
\ No newline at end of file
+from .qa_chain import QAChain
+from .hybrid import HybridRetriever
+from .reranker import CrossEncoderReranker
+from .answer_cache import SemanticAnswerCache
+from .sessions import Session, SessionManager
+from .chat_history import ChatHistory
\ No newline at end of file
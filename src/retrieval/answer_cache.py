@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from config import config
+
+
+# Answers to earlier questions, found by meaning rather than wording: a lookup
+# is a nearest-neighbour search over the cached question embeddings (one
+# matrix-vector product) and hits when the best cosine similarity reaches
+# `threshold`.
+#
+# A version is a (scope, revision) pair: scope is what retrieval searched (a
+# document ID, or None for the whole index) and revision identifies its
+# contents. Only answers of the same scope are candidates, and when a scope's
+# revision changes just that scope's answers are dropped, so one user's upload
+# leaves everyone else's cached answers alone. Entries expire after ttl_s (their
+# slots are freed as soon as a lookup or a full cache finds them) and the least
+# recently used one is evicted past max_entries. A scope's revision is
+# forgotten with its last answer, so the cache stays bounded however many
+# documents come and go.
+class SemanticAnswerCache:
+
+    def __init__(self, threshold: float = None, ttl_s: float = None, max_entries: int = None):
+        self.threshold = config.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl_s = config.ANSWER_CACHE_TTL_S if ttl_s is None else ttl_s
+        self.max_entries = max_entries or config.ANSWER_CACHE_SIZE
+        # scope -> its current revision
+        self.versions: Dict[Optional[str], str] = {}
+        self.hits = 0
+        self.misses = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._created = np.zeros(self.max_entries)
+        # slot -> cached answer, in LRU order
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._scope_of: Dict[int, Optional[str]] = {}
+        self._slots: Dict[Optional[str], Set[int]] = {}
+        self._free: List[int] = list(range(self.max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    # cached answer (with its "similarity") for a question like this one, or None
+    def get(self, version: Tuple[Optional[str], str], query_vector: List[float]) -> Optional[Dict]:
+        with self._lock:
+            self._release_expired(self._slots.get(version[0], ()))
+            self._check_version(version)
+            scope_slots = self._slots.get(version[0])
+            if not scope_slots:
+                self.misses += 1
+                return None
+            slots = np.fromiter(scope_slots, dtype=np.int64, count=len(scope_slots))
+            similarity = self._vectors[slots] @ self._normalize(query_vector)
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.threshold:
+                self.misses += 1
+                return None
+            slot = int(slots[best])
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return {**self._entries[slot], "similarity": float(similarity[best])}
+
+    # an answer for a revision other than the one its scope was last looked
+    # up at is stale (or the cache has moved on) and is dropped
+    def put(self, version: Tuple[Optional[str], str], query_vector: List[float], answer: Dict):
+        scope, revision = version
+        with self._lock:
+            if self.versions.get(scope, revision) != revision:
+                return
+            vector = self._normalize(query_vector)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            if not self._free:
+                self._release_expired(self._entries)
+            if not self._free:
+                self._release(next(iter(self._entries)))
+            self._check_version(version)
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._created[slot] = time.time()
+            self._entries[slot] = answer
+            self._scope_of[slot] = scope
+            self._slots.setdefault(scope, set()).add(slot)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+            }
+
+    # a new revision of a scope drops that scope's answers, no others; scopes
+    # looked up but never answered are forgotten once they outnumber the slots
+    def _check_version(self, version: Tuple[Optional[str], str]):
+        scope, revision = version
+        if self.versions.get(scope) != revision:
+            for slot in list(self._slots.get(scope, ())):
+                self._release(slot)
+            self.versions[scope] = revision
+        if len(self.versions) > self.max_entries:
+            for other in [other for other in self.versions if other not in self._slots and other != scope]:
+                del self.versions[other]
+
+    def _release_expired(self, slots):
+        if not slots:
+            return
+        slots = np.fromiter(slots, dtype=np.int64, count=len(slots))
+        for slot in slots[time.time() - self._created[slots] > self.ttl_s]:
+            self._release(int(slot))
+
+    def _release(self, slot: int):
+        del self._entries[slot]
+        scope = self._scope_of.pop(slot)
+        self._slots[scope].discard(slot)
+        if not self._slots[scope]:
+            del self._slots[scope]
+            self.versions.pop(scope, None)
+        self._free.append(slot)
+
+    def _clear(self):
+        self._entries.clear()
+        self._scope_of.clear()
+        self._slots.clear()
+        self.versions.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
@@ -0,0 +1,156 @@
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from config import config
+
+# summaries run here unless a ChatHistory is given its own executor
+_summary_executor: Optional[ThreadPoolExecutor] = None
+_summary_executor_lock = threading.Lock()
+
+
+def _default_executor() -> ThreadPoolExecutor:
+    global _summary_executor
+    with _summary_executor_lock:
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=config.HISTORY_SUMMARY_WORKERS,
+                                                   thread_name_prefix="history-summary")
+        return _summary_executor
+
+
+SUMMARY_PROMPT = """Update the running summary of a conversation about a contract.
+Keep every fact, figure, date, party name and clause/section reference the user
+may ask about again; drop greetings and repetition. Write at most {max_words} words.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW TURNS:
+{turns}
+
+UPDATED SUMMARY:"""
+
+
+# One question and its answer, with their token count
+class _Turn:
+
+    def __init__(self, question: str, answer: str, tokens: int):
+        self.messages = [HumanMessage(content=question), AIMessage(content=answer)]
+        self.tokens = tokens
+
+
+# Conversation memory for the prompt, within a token budget. The most recent
+# turns are kept verbatim; once they outgrow token_budget - summary_tokens, the
+# oldest are folded into a running summary by the LLM on a background executor,
+# so no request waits for it. Until the summary is ready those turns stay in
+# the prompt, and if summaries fall behind (or fail) the oldest turns are
+# dropped at twice the budget, so the history never grows without bound.
+class ChatHistory:
+
+    def __init__(
+        self,
+        summarize: Callable[[List[BaseMessage]], str],
+        count_tokens: Callable[[str], int],
+        token_budget: int = None,
+        summary_tokens: int = None,
+        executor: Executor = None,
+    ):
+        self.summarize = summarize
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget or config.HISTORY_TOKEN_BUDGET
+        self.summary_tokens = summary_tokens or config.HISTORY_SUMMARY_TOKENS
+        self.executor = executor
+        self.summary = ""
+        self.folded = 0
+        self.dropped = 0
+        self._summary_cost = 0
+        self._turns: List[_Turn] = []
+        self._pending: Optional[Future] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    # messages for the prompt's chat_history placeholder
+    def messages(self) -> List[BaseMessage]:
+        with self._lock:
+            messages = [m for turn in self._turns for m in turn.messages]
+            if self.summary:
+                messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation:\n{self.summary}"))
+            return messages
+
+    # estimated tokens of messages()
+    def tokens(self) -> int:
+        with self._lock:
+            return self._summary_cost + sum(turn.tokens for turn in self._turns)
+
+    def add(self, question: str, answer: str):
+        with self._lock:
+            self._turns.append(_Turn(question, answer, self.count_tokens(question) + self.count_tokens(answer)))
+            self._enforce_cap()
+            self._maybe_fold()
+
+    def clear(self):
+        with self._lock:
+            self._turns = []
+            self.summary = ""
+            self._summary_cost = 0
+            self._pending = None
+            self._generation += 1
+
+    # block until a running summary is done (tests, benchmarks, shutdown)
+    def wait(self, timeout: float = None):
+        while True:
+            pending = self._pending
+            if pending is None:
+                return
+            pending.exception(timeout)
+
+    def _maybe_fold(self):
+        if self._pending is not None:
+            return
+        verbatim = self.token_budget - self.summary_tokens
+        total = sum(turn.tokens for turn in self._turns)
+        fold: List[_Turn] = []
+        # the latest turn always stays verbatim
+        for turn in self._turns[:-1]:
+            if total <= verbatim:
+                break
+            fold.append(turn)
+            total -= turn.tokens
+        if not fold:
+            return
+        executor = self.executor or _default_executor()
+        self._pending = executor.submit(self._fold, self.summary, fold, self._generation)
+
+    def _fold(self, summary: str, turns: List[_Turn], generation: int):
+        messages = [HumanMessage(content=SUMMARY_PROMPT.format(
+            max_words=int(self.summary_tokens * 0.75),
+            summary=summary or "(none yet)",
+            turns="\n\n".join(f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}"
+                              for turn in turns for m in turn.messages),
+        ))]
+        try:
+            new_summary = self.summarize(messages).strip()
+        except Exception as e:
+            print(f"Chat history summary failed: {e}")
+            with self._lock:
+                if generation == self._generation:
+                    self._pending = None
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            folded = {id(turn) for turn in turns}
+            self._turns = [turn for turn in self._turns if id(turn) not in folded]
+            self.summary = new_summary
+            self._summary_cost = self.count_tokens(new_summary)
+            self.folded += len(turns)
+            self._pending = None
+            # turns added meanwhile may already need the next fold
+            self._maybe_fold()
+
+    # summaries behind or failing: drop the oldest turns past twice the budget
+    def _enforce_cap(self):
+        total = self._summary_cost + sum(turn.tokens for turn in self._turns)
+        while len(self._turns) > 1 and total > 2 * self.token_budget:
+            total -= self._turns.pop(0).tokens
+            self.dropped += 1
@@ -0,0 +1,125 @@
+import math
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from langchain.schema import Document
+
+
+# The LLM context for one question: passages in relevance order, their
+# estimated tokens, and what the same chunks would have cost sent one by one
+class Context(NamedTuple):
+    passages: List[Document]
+    tokens: int
+    chunk_tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.chunk_tokens - self.tokens
+
+
+# A run of one document's text covered by one or more retrieved chunks
+class _Passage:
+
+    def __init__(self, source: str, start: int, text: str, tokens: float, rank: int, chunks: List[Document]):
+        self.source = source
+        self.start = start
+        self.end = start + len(text)
+        self.text = text
+        self.tokens = tokens
+        self.rank = rank
+        self.chunks = chunks
+
+    # characters of text[start:end] this passage already covers
+    def covered(self, start: int, end: int) -> int:
+        return max(0, min(end, self.end) - max(start, self.start))
+
+    # same document text where both cover it (a chunk of another revision doesn't merge)
+    def agrees(self, start: int, text: str) -> bool:
+        lo, hi = max(start, self.start), min(start + len(text), self.end)
+        return hi <= lo or self.text[lo - self.start : hi - self.start] == text[lo - start : hi - start]
+
+
+# Builds the context from retrieved chunks. Chunks are taken in relevance order
+# while they fit the token budget. Chunks of the same document that overlap or
+# touch (by their start_index / chunk_size offsets from the chunker) are merged
+# into one passage, so the overlap between neighbouring chunks is sent once and
+# only a chunk's new text counts against the budget. Token counts come from
+# each chunk's stored token_count, scaled by the share of its text that is new.
+class ContextBuilder:
+
+    # chunks this close are contiguous (the chunker trims whitespace between them)
+    MAX_GAP = 4
+
+    def __init__(self, token_counter: Callable[[str], int]):
+        self.count_tokens = token_counter
+
+    def build(self, documents: List[Document], token_budget: int) -> Context:
+        passages: List[_Passage] = []
+        used = 0.0
+        chunk_tokens = 0
+        for rank, doc in enumerate(documents):
+            tokens = doc.metadata.get("token_count")
+            if tokens is None:
+                tokens = self.count_tokens(doc.page_content)
+            span = self._span(doc)
+            touching = [p for p in passages if span is not None and self._touches(p, *span, doc.page_content)]
+            added = float(tokens)
+            if touching:
+                start, end = span[1], span[2]
+                new_chars = (end - start) - sum(p.covered(start, end) for p in touching)
+                added = tokens * new_chars / max(end - start, 1)
+            # the best chunk is always kept, even if it alone exceeds the budget
+            if passages and used + added > token_budget:
+                continue
+            used += added
+            chunk_tokens += tokens
+            if span is None:
+                passages.append(_Passage(None, 0, doc.page_content, tokens, rank, [doc]))
+                continue
+            for p in touching:
+                passages.remove(p)
+            passages.append(self._merge(touching, _Passage(span[0], span[1], doc.page_content, added, rank, [doc])))
+
+        passages.sort(key=lambda p: p.rank)
+        return Context([self._document(p) for p in passages], math.ceil(used - 1e-9), chunk_tokens)
+
+    # (source, start, end) of a chunk with usable offsets, else None
+    @staticmethod
+    def _span(doc: Document) -> Optional[Tuple[str, int, int]]:
+        start = doc.metadata.get("start_index")
+        source = doc.metadata.get("source")
+        if start is None or source is None or doc.metadata.get("chunk_size", len(doc.page_content)) != len(doc.page_content):
+            return None
+        return source, start, start + len(doc.page_content)
+
+    def _touches(self, passage: _Passage, source: str, start: int, end: int, text: str) -> bool:
+        return (passage.source == source and start <= passage.end + self.MAX_GAP
+                and passage.start <= end + self.MAX_GAP and passage.agrees(start, text))
+
+    # one passage spanning `new` and the passages it touches
+    @staticmethod
+    def _merge(touching: List[_Passage], new: _Passage) -> _Passage:
+        if not touching:
+            return new
+        pieces = sorted(touching + [new], key=lambda p: p.start)
+        text = pieces[0].text
+        end = pieces[0].end
+        for piece in pieces[1:]:
+            if piece.end <= end:
+                continue
+            # a gap is whitespace the chunker trimmed; keep text aligned to the offsets
+            text += piece.text[end - piece.start :] if piece.start <= end else "\n" * (piece.start - end) + piece.text
+            end = piece.end
+        chunks = [chunk for piece in pieces for chunk in piece.chunks]
+        return _Passage(new.source, pieces[0].start, text, sum(p.tokens for p in pieces),
+                        min(p.rank for p in pieces), chunks)
+
+    @staticmethod
+    def _document(passage: _Passage) -> Document:
+        if len(passage.chunks) == 1 and passage.text is passage.chunks[0].page_content:
+            return passage.chunks[0]
+        chunks = sorted(passage.chunks, key=lambda doc: doc.metadata["start_index"])
+        return Document(page_content=passage.text, metadata={
+            **chunks[0].metadata,
+            "chunk_indices": [doc.metadata.get("chunk_index") for doc in chunks],
+            "chunk_size": len(passage.text),
+            "token_count": math.ceil(passage.tokens),
+        })
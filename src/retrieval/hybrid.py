@@ -0,0 +1,25 @@
+from typing import Any, List, Optional
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+
+# LangChain retriever over EmbedderStore.hybrid_search (dense + BM25, fused
+# by reciprocal rank), EmbedderStore.mmr_search (search_type="mmr") or
+# EmbedderStore.similarity_search (search_type="dense"), over the chunks of
+# doc_id only when it is set.
+# It holds the store, not its index, so it keeps working as documents are
+# added or the index is rebuilt.
+class HybridRetriever(BaseRetriever):
+
+    embedder: Any
+    k: int = 4
+    search_type: str = "hybrid"
+    doc_id: Optional[str] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.search_type == "mmr":
+            return self.embedder.mmr_search(query, k=self.k, doc_id=self.doc_id)
+        if self.search_type == "dense":
+            return self.embedder.similarity_search(query, k=self.k, doc_id=self.doc_id)
+        return self.embedder.hybrid_search(query, k=self.k, doc_id=self.doc_id)
@@ -1,23 +1,50 @@
-from typing import List,Dict,Optional
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Callable,Iterator,List,Dict,Optional,Tuple
 from langchain.schema import Document
 from langchain.prompts import ChatPromptTemplate,MessagesPlaceholder
-from langchain_core.messages import HumanMessage,AIMessage
+from langchain_core.messages import BaseMessage
 from config import config
 from langchain_groq import ChatGroq
+from src.ingestion.tokenizer import get_token_counter
+from .chat_history import ChatHistory
+from .context_builder import Context,ContextBuilder
 
 
 class QAChain:
-    def __init__(self,vector_store):
+    #retriever: e.g. EmbedderStore.as_retriever() for hybrid search; defaults
+    #to dense similarity search on vector_store. With a reranker the retriever
+    #should return config.CROSS_ENCODER_CANDIDATES chunks, of which the
+    #reranker keeps the best config.TOP_RESULTS.
+    #answer_cache: SemanticAnswerCache shared across chains; index_version()
+    #returns the (scope, revision) of what the retriever searches (e.g.
+    #EmbedderStore.search_version of the session's document) and is required
+    #with a cache: only the store knows when its content changed
+    #executor: where aask() runs retrieval and reranking (CPU-bound); None
+    #uses the event loop's default executor
+    #llm: chat model to share between chains (one per session); default a new
+    #client from new_llm()
+    def __init__(self,vector_store,retriever=None,reranker=None,answer_cache=None,
+                 index_version:Callable[[],Tuple[Optional[str],str]]=None,executor:Executor=None,llm=None):
         self.vector_store = vector_store
-        self.llm =ChatGroq(model=config.GROQ_MODEL,
-                           groq_api_key=config.GROQ_API_KEY,
-                           temperature=0.2,         # mostyly careful
-                           max_tokens=1024          #max response length
-                        )
-        self.chat_history:List=[]
+        self.executor = executor
+        if answer_cache is not None and index_version is None:
+            raise ValueError("answer_cache needs index_version (e.g. EmbedderStore.search_version)")
+        self.answer_cache = answer_cache
+        self.index_version = index_version
+        self.llm = llm or self.new_llm()
+        self.count_tokens = get_token_counter()
+        #recent turns verbatim, older ones folded into a summary in the background
+        self.history = ChatHistory(summarize=lambda messages: self.llm.invoke(messages).content,
+                                   count_tokens=self.count_tokens)
+        self.context_token_budget = config.CONTEXT_TOKEN_BUDGET
+        self.context_builder = ContextBuilder(self.count_tokens)
         #retriever from FAISS
-        self.retriever = vector_store.as_retriever(search_type ="similarity",
-                                                   search_kwargs={"k": config.TOP_RESULTS})
+        self.reranker = reranker
+        k = config.CROSS_ENCODER_CANDIDATES if reranker else config.TOP_RESULTS
+        self.retriever = retriever or vector_store.as_retriever(search_type ="similarity",
+                                                                search_kwargs={"k": k})
         #QA prompt template
         self.qa_prompt = ChatPromptTemplate.from_messages([
             ("system", self._get_system_prompt()),
@@ -25,6 +52,19 @@ class QAChain:
             ("human", "{question}"),
         ])
 
+    @staticmethod
+    def new_llm()->ChatGroq:
+        return ChatGroq(model=config.GROQ_MODEL,
+                        groq_api_key=config.GROQ_API_KEY,
+                        temperature=0.2,         # mostyly careful
+                        max_tokens=1024          #max response length
+                        )
+
+    #messages for the prompt (summary of earlier turns first, if any)
+    @property
+    def chat_history(self)->List[BaseMessage]:
+        return self.history.messages()
+
     def _get_system_prompt(self) -> str:
         return """You are a helpful contract analysis assistant. Your job is to 
         answer questions about documents based ONLY on the provided context.
@@ -45,28 +85,112 @@ class QAChain:
 
     #process a user question and return an answer with the sources
     def ask(self,question:str)->Dict:
-        #retrieve relevant chunks
-        relevant_docs = self.retriever.invoke(question)
-        context=self.format_context(relevant_docs)
-        #build prompt
-        prompt_messages = self.qa_prompt.format_messages(
-            context=context,
-            chat_history=self.chat_history,
-            question=question
-        )
+        cache_key,cached = self._cached_answer(question)
+        if cached is not None:
+            return cached
+
+        prompt_messages,sources,context = self._prepare(question)
+        started = time.perf_counter()
         response = self.llm.invoke(prompt_messages)
         #extract answer text
         if hasattr(response,"content"):
             answer_text = response.content
         else:
             answer_text=str(response)
+        generation_ms = (time.perf_counter() - started) * 1000
+
+        result = self._finish(question,answer_text,sources,context,cache_key)
+        return {**result,"generation_ms":round(generation_ms,1)}
+
+    #Async variant of ask() for the API server: the question embedding and the
+    #LLM call are awaited, retrieval and reranking run on self.executor, so
+    #the event loop is never blocked while a question is answered.
+    async def aask(self,question:str)->Dict:
+        cache_key,cached = await self._acached_answer(question)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        prompt_messages,sources,context = await loop.run_in_executor(self.executor,self._prepare,question)
+        started = time.perf_counter()
+        response = await self.llm.ainvoke(prompt_messages)
+        answer_text = response.content if hasattr(response,"content") else str(response)
+        generation_ms = (time.perf_counter() - started) * 1000
 
-        #update conversation hist
-        self.chat_history.append(HumanMessage(content=question))
-        self.chat_history.append(AIMessage(content=answer_text))
-        if len(self.chat_history) > 20:
-            self.chat_history = self.chat_history[-20:]
+        result = self._finish(question,answer_text,sources,context,cache_key)
+        return {**result,"generation_ms":round(generation_ms,1)}
 
+    #Streaming variant of ask(): yields {"event": "sources", ...} as soon as
+    #retrieval is done, then {"event": "token", "text": ...} per LLM chunk,
+    #then {"event": "done", ...} with the full result (as ask() returns it)
+    #plus time to first token and total generation time in ms. Chat history
+    #and the answer cache are updated once the answer is complete.
+    def ask_stream(self,question:str)->Iterator[Dict]:
+        cache_key,cached = self._cached_answer(question)
+        if cached is not None:
+            yield {"event":"sources","sources":cached["sources"],"num_sources":cached["num_sources"],"cached":True}
+            yield {"event":"token","text":cached["answer"]}
+            yield {"event":"done",**cached,"ttft_ms":0.0,"generation_ms":0.0}
+            return
+
+        prompt_messages,sources,context = self._prepare(question)
+        yield {"event":"sources","sources":sources,"num_sources":len(sources),"cached":False}
+
+        started = time.perf_counter()
+        ttft_ms = None
+        parts = []
+        for chunk in self.llm.stream(prompt_messages):
+            text = chunk.content if hasattr(chunk,"content") else str(chunk)
+            if not text:
+                continue
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            parts.append(text)
+            yield {"event":"token","text":text}
+        generation_ms = (time.perf_counter() - started) * 1000
+
+        result = self._finish(question,"".join(parts),sources,context,cache_key)
+        yield {"event":"done",**result,"ttft_ms":round(ttft_ms if ttft_ms is not None else generation_ms,1),
+               "generation_ms":round(generation_ms,1)}
+
+    #A follow-up depends on the conversation, so only opening questions are
+    #answered from / stored in the semantic cache. Returns the key to store the
+    #answer under (when it can be cached and wasn't found): the index version read
+    #before retrieval and the question's embedding; and the cached result, if any.
+    def _cached_answer(self,question:str)->Tuple[Optional[Tuple[Tuple[Optional[str],str],List[float]]],Optional[Dict]]:
+        if self.answer_cache is None or self.chat_history:
+            return None,None
+        version = self.index_version()
+        query_vector = self.vector_store.embedding_function.embed_query(question)
+        cached = self.answer_cache.get(version,query_vector)
+        if cached is None:
+            return (version,query_vector),None
+        self._remember(question,cached["answer"])
+        return None,{**cached,"cached":True}
+
+    async def _acached_answer(self,question:str)->Tuple[Optional[Tuple[Tuple[Optional[str],str],List[float]]],Optional[Dict]]:
+        if self.answer_cache is None or self.chat_history:
+            return None,None
+        version = self.index_version()
+        query_vector = await self.vector_store.embedding_function.aembed_query(question)
+        cached = self.answer_cache.get(version,query_vector)
+        if cached is None:
+            return (version,query_vector),None
+        self._remember(question,cached["answer"])
+        return None,{**cached,"cached":True}
+
+    #retrieve relevant chunks and build the prompt; one source per passage
+    def _prepare(self,question:str)->Tuple[list,List[Dict],Context]:
+        relevant_docs = self.retriever.invoke(question)
+        if self.reranker is not None:
+            relevant_docs = self.reranker.rerank(question,relevant_docs,config.TOP_RESULTS)
+        context = self.context_builder.build(relevant_docs,self.context_token_budget)
+        relevant_docs = context.passages
+        prompt_messages = self.qa_prompt.format_messages(
+            context=self.format_context(relevant_docs),
+            chat_history=self.chat_history,
+            question=question
+        )
         sources = [
             {
                 "content": doc.page_content[:200] + "...",
@@ -74,27 +198,46 @@ class QAChain:
             }
             for doc in relevant_docs
         ]
+        return prompt_messages,sources,context
 
-        return {
+    #context_tokens_saved: tokens of chunk overlap that merging kept out of the prompt.
+    #The answer is cached under the index version retrieval started from, and
+    #only if the index hasn't changed since (an upload during generation).
+    def _finish(self,question:str,answer_text:str,sources:List[Dict],context:Context,cache_key)->Dict:
+        self._remember(question,answer_text)
+        result = {
             "answer": answer_text,
             "sources": sources,
             "num_sources": len(sources),
+            "context_tokens": context.tokens,
+            "context_tokens_saved": context.saved_tokens,
         }
+        if cache_key is not None and cache_key[0] == self.index_version():
+            self.answer_cache.put(*cache_key,result)
+        return {**result,"cached":False}
+
+    #update conversation hist
+    def _remember(self,question:str,answer_text:str):
+        self.history.add(question,answer_text)
     
     def format_context(self,documents:List[Document])->str:
         if not documents:
             return"No relevant information found in the document."
         context_parts=[]
         for i,doc in enumerate(documents,1):
-            chunk_idx = doc.metadata.get("chunk_index","?")
+            chunk_indices = doc.metadata.get("chunk_indices")
+            if chunk_indices:
+                chunks = f"chunks {chunk_indices[0]}-{chunk_indices[-1]}"
+            else:
+                chunks = f"chunk {doc.metadata.get('chunk_index','?')}"
             source = doc.metadata.get("source","unknown")
-            context_parts.append(f"--- Source {i} (chunk {chunk_idx} from {source}) ---\n"
+            context_parts.append(f"--- Source {i} ({chunks} from {source}) ---\n"
                 f"{doc.page_content}"
             )
         return "\n\n".join(context_parts)
     
     def clear_history(self):
-        self.chat_history=[]
+        self.history.clear()
         print("🗑️ Conversation history cleared")
         
 
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import xxhash
+from langchain.schema import Document
+from config import config
+
+
+# Second retrieval stage: score (question, chunk) pairs with a local
+# cross-encoder and keep the best k. Pair scores are cached (repeat questions
+# and boilerplate chunks skip the model), and scoring stops once budget_ms is
+# spent; the candidates are then returned in their first-stage order. Loading
+# the model never counts against the budget: call load() at start-up so the
+# first question doesn't wait for it either.
+class CrossEncoderReranker:
+
+    def __init__(
+        self,
+        model_name: str = None,
+        model=None,
+        batch_size: int = None,
+        budget_ms: float = None,
+        cache_size: int = None,
+    ):
+        self.model_name = model_name or config.CROSS_ENCODER_MODEL
+        self.batch_size = batch_size or config.CROSS_ENCODER_BATCH_SIZE
+        self.budget_ms = config.CROSS_ENCODER_BUDGET_MS if budget_ms is None else budget_ms
+        self.cache_size = cache_size or config.CROSS_ENCODER_CACHE_SIZE
+        self._model = model
+        self._scores: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reranked = 0
+        self.fallbacks = 0
+
+    @property
+    def model(self):
+        return self.load()
+
+    # load the model once, however many questions arrive while it loads
+    def load(self):
+        with self._load_lock:
+            if self._model is None:
+                self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        from sentence_transformers import CrossEncoder
+
+        return CrossEncoder(self.model_name, device="cpu")
+
+    def rerank(self, query: str, documents: List[Document], k: int = None) -> List[Document]:
+        k = k or config.TOP_RESULTS
+        if len(documents) <= 1:
+            return documents[:k]
+        model = self.load()
+        started = time.perf_counter()
+        query = " ".join(query.split())
+        keys = [(query, xxhash.xxh3_64_intdigest(doc.page_content)) for doc in documents]
+        scores = self._cached(keys)
+
+        missing = [n for n, score in enumerate(scores) if score is None]
+        for start in range(0, len(missing), self.batch_size):
+            if start and (time.perf_counter() - started) * 1000 > self.budget_ms:
+                # over budget with pairs left: keep what was scored for next time
+                with self._lock:
+                    self.fallbacks += 1
+                return documents[:k]
+            batch = missing[start : start + self.batch_size]
+            batch_scores = model.predict([(query, documents[n].page_content) for n in batch],
+                                              batch_size=len(batch), show_progress_bar=False)
+            for n, score in zip(batch, batch_scores):
+                scores[n] = float(score)
+            self._store([keys[n] for n in batch], [scores[n] for n in batch])
+
+        with self._lock:
+            self.reranked += 1
+        order = sorted(range(len(documents)), key=lambda n: scores[n], reverse=True)
+        return [documents[n] for n in order[:k]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._scores),
+                "reranked": self.reranked,
+                "fallbacks": self.fallbacks,
+            }
+
+    def _cached(self, keys: List[Tuple[str, int]]) -> List[Optional[float]]:
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._scores.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._scores.move_to_end(key)
+                    self.hits += 1
+                scores.append(score)
+            return scores
+
+    def _store(self, keys: List[Tuple[str, int]], scores: List[float]):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = score
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from config import config
+from .qa_chain import QAChain
+
+
+# One user's conversation: its own QAChain (chat history) and the document it
+# uploaded last, if any, which its retriever is limited to. The chains of all
+# sessions share the LLM client and caches, so a session costs little beyond
+# its history.
+class Session:
+
+    # measured with tracemalloc: an idle session (QAChain with its prompt
+    # template) and each history message object, excluding its text
+    BASE_BYTES = 8 * 1024
+    MESSAGE_BYTES = 800
+
+    def __init__(self, session_id: str, chain: QAChain):
+        self.session_id = session_id
+        self.chain = chain
+        self.document_id: Optional[str] = None
+        self.created = time.time()
+        self.last_used = self.created
+
+    # estimated bytes held by this session (history is stored as Python str)
+    def size(self) -> int:
+        history = self.chain.chat_history
+        return self.BASE_BYTES + sum(self.MESSAGE_BYTES + len(message.content) for message in history)
+
+
+# Sessions by ID, in least-recently-used order. A session idle for longer than
+# ttl_s expires; past max_sessions or max_bytes the least recently used ones are
+# evicted, so memory stays bounded however many users come and go. An evicted
+# user simply starts over with an empty history.
+class SessionManager:
+
+    def __init__(
+        self,
+        new_chain: Callable[[], QAChain],
+        max_sessions: int = None,
+        ttl_s: float = None,
+        max_bytes: int = None,
+    ):
+        self.new_chain = new_chain
+        self.max_sessions = max_sessions or config.SESSION_MAX
+        self.ttl_s = config.SESSION_TTL_S if ttl_s is None else ttl_s
+        self.max_bytes = max_bytes or config.SESSION_MAX_MB * 1024 * 1024
+        self.bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            self._expire(time.time())
+            return session_id in self._sessions
+
+    # the session for session_id, created if it's new (or was evicted)
+    def get(self, session_id: str) -> Session:
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self.new_chain())
+                self._sessions[session_id] = session
+                self._sizes[session_id] = 0
+                self.created += 1
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = now
+            self._resize(session)
+            self._evict(keep=session_id)
+            return session
+
+    # account for a session's history after it has changed (e.g. after ask())
+    def update(self, session: Session):
+        with self._lock:
+            if self._sessions.get(session.session_id) is session:
+                self._resize(session)
+                self._evict(keep=session.session_id)
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            return self._remove(session_id) is not None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self.bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+    def _resize(self, session: Session):
+        size = session.size()
+        self.bytes += size - self._sizes[session.session_id]
+        self._sizes[session.session_id] = size
+
+    # LRU order is last-use order, so the expired sessions are at the front
+    def _expire(self, now: float):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used <= self.ttl_s:
+                break
+            self._remove(session.session_id)
+            self.expired += 1
+
+    def _evict(self, keep: str):
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self.bytes > self.max_bytes):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                self._sessions.move_to_end(session_id)
+                continue
+            self._remove(session_id)
+            self.evicted += 1
+
+    def _remove(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.bytes -= self._sizes.pop(session_id)
+        return session
@@ -4,10 +4,47 @@ Run with: pytest tests/ -v
 """
 
 import os
+from typing import List
+import numpy as np
 import pytest
+from langchain.schema import Document
+from langchain_community.embeddings import DeterministicFakeEmbedding
 from src.ingestion.file_parser import FileParser
 from src.ingestion.chunker import TextChunker
 from src.ingestion.embedder import EmbedderStore
+from src.ingestion.pipeline import IngestionPipeline
+from src.ingestion.ingest_cache import IngestionCache
+from src.ingestion.bulk import BulkIngestor
+from src.ingestion.embedding_cache import EmbeddingCache, CachedEmbeddings, QueryEmbeddingCache
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Fake embeddings that record every batch of chunks and every question they embed."""
+
+    batches: List[List[str]] = []
+    queries: List[str] = []
+
+    @property
+    def embedded(self):
+        return [text for batch in self.batches for text in batch]
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def _docs(source, texts):
+    """One chunk Document per text, in order, from the given source file."""
+    return [Document(page_content=t, metadata={"source": source, "chunk_index": i}) for i, t in enumerate(texts)]
+
+
+def _clauses(source, count):
+    """count distinct numbered clauses from source."""
+    return _docs(source, [f"{source} clause {i}." for i in range(count)])
 
 
 class TestFileParser:
@@ -31,6 +68,68 @@ class TestFileParser:
         assert ".pdf" in FileParser.SUPPORTED_EXTENSIONS
         assert ".docx" in FileParser.SUPPORTED_EXTENSIONS
 
+    def _make_pdf(self, path, pages):
+        import fitz
+
+        document = fitz.open()
+        for i in range(pages):
+            page = document.new_page()
+            if i != 3:  # leave one page blank
+                page.insert_text((72, 72), f"Clause {i + 1}: payment terms apply.")
+        document.save(path)
+        document.close()
+
+    def test_parallel_pdf_matches_serial(self, tmp_path):
+        """Process-pool extraction should match the serial output exactly."""
+        path = str(tmp_path / "contract.pdf")
+        self._make_pdf(path, 9)
+
+        serial = FileParser(parallel=False)
+        parallel = FileParser(parallel=True, workers=2, pages_per_task=2)
+
+        assert parallel.parse(path) == serial.parse(path)
+
+    def test_pdf_pages_streamed_in_order(self, tmp_path):
+        """Pages should be yielded in order with [Page N] markers, skipping blanks."""
+        path = str(tmp_path / "contract.pdf")
+        self._make_pdf(path, 9)
+
+        parser = FileParser(parallel=True, workers=2, pages_per_task=2)
+        pages = list(parser.iter_pdf_pages(path))
+
+        assert len(pages) == 8
+        assert pages[0].startswith("\n[Page 1]\n")
+        assert pages[3].startswith("\n[Page 5]\n")
+        assert "Clause 9" in pages[-1]
+
+
+    def test_docx_paragraphs_and_tables_in_order(self, tmp_path):
+        """DOCX text should include table rows, in document order."""
+        import docx
+
+        document = docx.Document()
+        document.add_paragraph("1. Payment Schedule")
+        paragraph = document.add_paragraph("Fees are ")
+        paragraph.add_run("due quarterly").bold = True
+        table = document.add_table(rows=2, cols=2)
+        table.rows[0].cells[0].text = "Milestone"
+        table.rows[0].cells[1].text = "Amount"
+        table.rows[1].cells[0].text = "Delivery"
+        table.rows[1].cells[1].text = "USD 5,000"
+        document.add_paragraph("")
+        document.add_paragraph("2. Termination")
+        path = str(tmp_path / "contract.docx")
+        document.save(path)
+
+        assert list(self.parser.iter_pages(path)) == [
+            "1. Payment Schedule",
+            "Fees are due quarterly",
+            "Milestone | Amount",
+            "Delivery | USD 5,000",
+            "2. Termination",
+        ]
+        assert self.parser.parse(path).startswith("1. Payment Schedule\nFees are due quarterly\n")
+
 
 class TestChunker:
     """Test text chunking."""
@@ -86,6 +185,113 @@ class TestChunker:
         assert stats["avg_chunk_size"] > 0
         assert stats["min_chunk_size"] <= stats["max_chunk_size"]
 
+    def test_iter_chunks_matches_chunk_text(self):
+        """Streaming pages through the chunker should give the same chunks."""
+        pages = [
+            f"\n[Page {i}]\n" + "The supplier shall deliver the goods on time. " * (i + 3)
+            for i in range(1, 12)
+        ]
+        expected = [d.page_content for d in self.chunker.chunk_text("\n".join(pages))]
+        streamed = list(self.chunker.iter_chunks(pages, metadata={"source": "test.pdf"}))
+
+        assert [d.page_content for d in streamed] == expected
+        assert [d.metadata["chunk_index"] for d in streamed] == list(range(len(expected)))
+        assert streamed[0].metadata["source"] == "test.pdf"
+        full_text = "\n".join(pages)
+        for doc in streamed:
+            start = doc.metadata["start_index"]
+            assert full_text[start:start + doc.metadata["chunk_size"]] == doc.page_content
+
+    def test_iter_chunks_matches_chunk_text_across_page_breaks(self):
+        """Separators straddling page joins or first seen late don't change the chunks."""
+        pages = [
+            "[Page 1]\n" + "Notice is given in writing. " * 4,
+            "The supplier delivers the goods.",
+            # the first blank line only appears here, across the page join
+            "\nPayment is due in 30 days.\n\n[Page 3]\n" + "Either party may terminate on notice. " * 4,
+        ]
+        for chunker in (self.chunker, TextChunker(chunk_size=37, chunk_overlap=9)):
+            chunker.WINDOW_CHUNKS = 1
+            expected = chunker.chunk_text("\n".join(pages))
+            streamed = list(chunker.iter_chunks(pages))
+
+            assert [(d.page_content, d.metadata["start_index"], d.metadata["page"]) for d in streamed] == \
+                [(d.page_content, d.metadata["start_index"], d.metadata["page"]) for d in expected]
+
+    def test_iter_chunks_memory_flat_without_blank_lines(self):
+        """DOCX-like text (paragraphs joined by "\\n", no blank line) isn't buffered whole."""
+        import tracemalloc
+
+        def paragraphs(count):
+            for i in range(count):
+                yield f"{i}. The supplier shall deliver the goods described in the order on time."
+
+        chunker = TextChunker(chunk_size=100, chunk_overlap=20, token_counter=lambda t: len(t.split()))
+        chunker.WINDOW_CHUNKS = 2
+        expected = chunker.chunk_text("\n".join(paragraphs(500)))
+        assert [(d.page_content, d.metadata["start_index"]) for d in chunker.iter_chunks(paragraphs(500))] == \
+            [(d.page_content, d.metadata["start_index"]) for d in expected]
+
+        # ~1.6 MB of text; the buffer should stay around a window (1000 chars)
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in chunker.iter_chunks(paragraphs(20_000)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert count > 10_000
+        assert peak < 100_000
+
+    def test_spans_match_recursive_splitter(self):
+        """Span chunks should equal RecursiveCharacterTextSplitter output."""
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        sample = os.path.join("data", "sample_contracts", "sample_service_agreement.pdf")
+        texts = [
+            FileParser().parse(sample),
+            "Clause 1.\n\n\nThe  party. \tPays.\n" * 40 + "x" * 700 + " end",
+        ]
+        for chunk_size, chunk_overlap in [(500, 50), (100, 20), (37, 5)]:
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                separators=TextChunker.SEPARATORS,
+                length_function=len,
+            )
+            chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            for text in texts:
+                spans = chunker.chunk_spans(text)
+                assert [text[s.start:s.end] for s in spans] == splitter.split_text(text)
+
+    def test_token_length_mode(self):
+        """In token mode chunk_size counts tokens and each chunk stores its count."""
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        def count_words(text):
+            return len(text.split())
+
+        chunker = TextChunker(chunk_size=30, chunk_overlap=5, length_mode="tokens", token_counter=count_words)
+        text = "The licensee shall not sublicense the software.\n" * 40
+        chunks = chunker.chunk_text(text)
+
+        assert all(c.metadata["token_count"] == count_words(c.page_content) for c in chunks)
+        assert max(c.metadata["token_count"] for c in chunks) <= 30
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=30, chunk_overlap=5, separators=TextChunker.SEPARATORS, length_function=count_words
+        )
+        assert [c.page_content for c in chunks] == splitter.split_text(text)
+        assert chunker.config_key != TextChunker(chunk_size=30, chunk_overlap=5).config_key
+
+    def test_chunks_carry_page_numbers(self):
+        """Each chunk should record the PDF page it starts on."""
+        text = "\n".join(f"\n[Page {i}]\n" + "Rent is due monthly. " * 10 for i in range(1, 4))
+        chunks = self.chunker.chunk_text(text)
+
+        assert chunks[0].metadata["page"] == 1
+        assert chunks[-1].metadata["page"] == 3
+        pages = [c.metadata["page"] for c in chunks]
+        assert pages == sorted(pages)
+
 
 class TestEmbedder:
     """Test embedding and FAISS store."""
@@ -148,4 +354,907 @@ class TestEmbedder:
             # Each result should be (Document, score) tuple
             assert len(results[0]) == 2
             # Contract-related chunk should score better (lower distance)
-            # results are sorted by score ascending
\ No newline at end of file
+            # results are sorted by score ascending
+
+
+class TestIngestionPipeline:
+    """Test the streaming parse -> chunk -> embed -> index pipeline."""
+
+    def setup_method(self):
+        self.embedder = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=32))
+        self.pipeline = IngestionPipeline(
+            FileParser(parallel=False),
+            TextChunker(chunk_size=100, chunk_overlap=20),
+            self.embedder,
+            queue_size=2,
+            batch_size=4,
+        )
+
+    def test_run_indexes_all_chunks(self, tmp_path):
+        """Every streamed chunk should end up in the saved index."""
+        import fitz
+
+        path = str(tmp_path / "contract.pdf")
+        document = fitz.open()
+        for i in range(5):
+            document.new_page().insert_text((72, 72), f"Section {i}: the buyer pays within 30 days.")
+        document.save(path)
+        document.close()
+
+        stats = self.pipeline.run(path, metadata={"source": "contract.pdf"}, save_path=str(tmp_path / "index"))
+
+        assert stats["pages"] == 5
+        assert stats["characters"] == len(FileParser().parse(path))
+        assert self.embedder.vector_store.index.ntotal == stats["total_chunks"]
+        assert os.path.exists(tmp_path / "index" / "documents.json")
+        assert len(os.listdir(tmp_path / "index" / "segments")) == 2
+        documents = self.embedder.get_documents()
+        assert documents[0].metadata["source"] == "contract.pdf"
+
+    def test_reupload_restored_from_cache(self, tmp_path):
+        """A second upload of the same bytes should skip embedding entirely."""
+        import fitz
+
+        path = str(tmp_path / "contract.pdf")
+        document = fitz.open()
+        document.new_page().insert_text((72, 72), "The buyer pays within 30 days of invoice.")
+        document.save(path)
+        document.close()
+
+        self.pipeline.cache = IngestionCache(str(tmp_path / "cache"))
+        first = self.pipeline.run(path, metadata={"source": "a.pdf"}, save_path=str(tmp_path / "index"))
+        vectors = self.embedder.get_embeddings()
+
+        class NoModel(DeterministicFakeEmbedding):
+            def embed_documents(self, texts):
+                raise AssertionError("cache hit should not embed")
+
+        self.embedder.embeddings = NoModel(size=32)
+        second = self.pipeline.run(path, metadata={"source": "b.pdf"}, save_path=str(tmp_path / "index"))
+
+        assert first["cached"] is False and second["cached"] is True
+        assert second["total_chunks"] == first["total_chunks"]
+        assert (self.embedder.get_embeddings("b.pdf") == vectors).all()
+        assert self.embedder.get_documents("b.pdf")[0].metadata["source"] == "b.pdf"
+        # the copy is indexed alongside the original
+        assert self.embedder.vector_store.index.ntotal == 2 * first["total_chunks"]
+        assert self.pipeline.cache.stats()["hits"] == 1
+
+    def test_parse_errors_propagate(self, tmp_path):
+        """A failing parse stage should surface in the caller."""
+        path = tmp_path / "empty.pdf"
+        import fitz
+
+        document = fitz.open()
+        document.new_page()
+        document.save(str(path))
+        document.close()
+
+        with pytest.raises(ValueError, match="No text could be extracted"):
+            self.pipeline.run(str(path), save_path=str(tmp_path / "index"))
+
+    def test_failed_upload_rolled_back_and_retried(self, tmp_path):
+        """Chunks indexed before a parse failure are taken out; the same upload then succeeds."""
+        import time
+
+        embedder = self.embedder
+        pages = [f"Section {i}: the buyer pays invoice {i} within {i} days of delivery." for i in range(300)]
+
+        class FlakyParser(FileParser):
+            calls = 0
+
+            def iter_pages(self, file_path):
+                FlakyParser.calls += 1
+                yield from pages
+                if FlakyParser.calls == 1:
+                    # fail only once the first batches are in the index
+                    deadline = time.time() + 10
+                    while (embedder.vector_store is None or embedder.vector_store.index.ntotal <= 1) and time.time() < deadline:
+                        time.sleep(0.01)
+                    raise RuntimeError("parser crashed")
+
+        index_dir = str(tmp_path / "index")
+        embedder.create_and_store(_docs("seed.pdf", ["Governing law is Delaware."]), save_path=index_dir, doc_id="seed")
+        self.pipeline.file_parser = FlakyParser(parallel=False)
+
+        with pytest.raises(RuntimeError, match="parser crashed"):
+            self.pipeline.run("contract.pdf", save_path=index_dir, doc_id="contract")
+
+        assert list(embedder.documents) == ["seed"] and embedder.vector_store.index.ntotal == 1
+        assert [d.metadata["source"] for d in embedder.vector_store.similarity_search("buyer pays", k=4)] == ["seed.pdf"]
+
+        stats = self.pipeline.run("contract.pdf", metadata={"source": "contract.pdf"}, save_path=index_dir, doc_id="contract")
+        assert embedder.vector_store.index.ntotal == 1 + stats["total_chunks"]
+        assert len(embedder.documents["contract"]) == stats["total_chunks"]
+
+
+class TestIngestionCache:
+    """Test the content-addressed ingestion cache."""
+
+    def _entry(self, n):
+        import numpy as np
+
+        texts = [f"chunk {i}" for i in range(n)]
+        metadatas = [{"chunk_index": i} for i in range(n)]
+        return texts, metadatas, np.ones((n, 8), dtype="float32"), {"total_chunks": n}
+
+    def test_key_depends_on_settings(self, tmp_path):
+        """The same bytes under different chunk settings should not collide."""
+        path = tmp_path / "a.pdf"
+        path.write_bytes(b"contract bytes")
+        cache = IngestionCache(str(tmp_path / "cache"))
+
+        key = cache.key_for(str(path), "chars:500:50", "m")
+        assert key == cache.key_for(str(path), "chars:500:50", "m")
+        assert key != cache.key_for(str(path), "chars:400:50", "m")
+        assert key != cache.key_for(str(path), "chars:500:50", "other")
+
+    def test_hits_and_misses(self, tmp_path):
+        """get() should count misses, then hit after put()."""
+        cache = IngestionCache(str(tmp_path / "cache"))
+        assert cache.get("k") is None
+        cache.put("k", *self._entry(3))
+
+        entry = cache.get("k")
+        assert entry["texts"] == ["chunk 0", "chunk 1", "chunk 2"]
+        assert entry["vectors"].shape == (3, 8)
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    def test_lru_eviction(self, tmp_path):
+        """The least recently used entry is evicted once the size cap is hit."""
+        cache = IngestionCache(str(tmp_path / "cache"), max_bytes=10**9)
+        cache.put("a", *self._entry(50))
+        entry_size = cache.stats()["size_bytes"]
+        cache.max_bytes = int(entry_size * 2.5)
+
+        cache.put("b", *self._entry(50))
+        cache.get("a")  # "b" is now the least recently used
+        cache.put("c", *self._entry(50))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        # the index survives a restart
+        assert IngestionCache(str(tmp_path / "cache")).stats()["entries"] == 2
+
+
+class TestBulkIngestor:
+    """Test multi-file ingestion into one combined index."""
+
+    def test_directory_ingest_reports_failures(self, tmp_path):
+        """Good files are indexed together; a broken one is reported, not fatal."""
+        import fitz
+
+        docs_dir = tmp_path / "contracts"
+        docs_dir.mkdir()
+        for i in range(3):
+            document = fitz.open()
+            document.new_page().insert_text((72, 72), f"Contract {i}: rent is due monthly. " * 3)
+            document.save(str(docs_dir / f"contract_{i}.pdf"))
+            document.close()
+        (docs_dir / "broken.pdf").write_bytes(b"not really a pdf")
+        (docs_dir / "notes.txt").write_text("ignored")
+
+        embedder = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=16))
+        ingestor = BulkIngestor(embedder, TextChunker(chunk_size=60, chunk_overlap=10), workers=2, batch_size=3)
+        progress = []
+        result = ingestor.run_directory(str(docs_dir), save_path=str(tmp_path / "index"), on_progress=progress.append)
+
+        assert (result["succeeded"], result["failed"]) == (3, 1)
+        assert len(progress) == 4 and progress[-1]["done"] == 4
+        assert embedder.vector_store.index.ntotal == result["total_chunks"]
+        sources = {d.metadata["source"] for d in embedder.get_documents()}
+        assert sources == {"contract_0.pdf", "contract_1.pdf", "contract_2.pdf"}
+
+    def test_same_file_name_in_two_folders(self, tmp_path):
+        """Files are identified by their path under the directory, not their name alone."""
+        import fitz
+
+        docs_dir = tmp_path / "contracts"
+        for year in ("2023", "2024"):
+            (docs_dir / year).mkdir(parents=True)
+            document = fitz.open()
+            document.new_page().insert_text((72, 72), f"The {year} NDA lasts one year. " * 3)
+            document.save(str(docs_dir / year / "nda.pdf"))
+            document.close()
+
+        embedder = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=16))
+        ingestor = BulkIngestor(embedder, TextChunker(chunk_size=60, chunk_overlap=10), workers=2)
+        result = ingestor.run_directory(str(docs_dir), save_path=str(tmp_path / "index"))
+
+        assert result["succeeded"] == 2
+        assert set(embedder.documents) == {"2023/nda.pdf", "2024/nda.pdf"}
+        for year, other in (("2023", "2024"), ("2024", "2023")):
+            text = " ".join(d.page_content for d in embedder.get_documents(f"{year}/nda.pdf"))
+            assert f"{year} NDA" in text and f"{other} NDA" not in text
+        with pytest.raises(ValueError, match="same document"):
+            ingestor.run([str(docs_dir / "2023" / "nda.pdf"), str(docs_dir / "2024" / "nda.pdf")])
+
+
+class TestRevisions:
+    """Test incremental re-indexing of a new revision of a document."""
+
+    def setup_method(self):
+        self.embeddings = CountingEmbedding(size=16)
+        self.embedder = EmbedderStore(embeddings=self.embeddings)
+
+    def test_only_changed_chunks_embedded(self, tmp_path):
+        """A redline should embed only new chunks, drop deleted ones and keep IDs."""
+        v1 = ["Parties: Acme and Beta.", "Fees: USD 10,000.", "Term: two years.", "Law: New York."]
+        v2 = ["Parties: Acme and Beta.", "Fees: USD 12,000.", "Term: two years.", "Notices: by email."]
+
+        self.embedder.create_and_store(_docs("msa.pdf", v1), save_path=str(tmp_path), doc_id="msa")
+        ids_v1 = dict(zip(v1, self.embedder.documents["msa"]))
+        self.embeddings.batches.clear()
+
+        self.embedder.create_and_store(_docs("msa.pdf", v2), save_path=str(tmp_path), doc_id="msa")
+
+        assert sorted(self.embeddings.embedded) == ["Fees: USD 12,000.", "Notices: by email."]
+        assert self.embedder.last_update == {
+            "doc_id": "msa", "embedded": 2, "reused": 2, "removed": 2, "cache_hits": 0, "cache_misses": 0,
+        }
+        ids_v2 = dict(zip(v2, self.embedder.documents["msa"]))
+        assert ids_v2["Parties: Acme and Beta."] == ids_v1["Parties: Acme and Beta."]
+        assert ids_v2["Term: two years."] == ids_v1["Term: two years."]
+        assert self.embedder.vector_store.index.ntotal == 4
+        documents = self.embedder.get_documents()
+        assert [d.page_content for d in documents] == v2
+        assert [d.metadata["chunk_index"] for d in documents] == [0, 1, 2, 3]
+        assert self.embedder.get_embeddings().shape == (4, 16)
+
+    def test_manifest_survives_reload(self, tmp_path):
+        """A revision after a restart should still be incremental."""
+        v1 = ["Clause one.", "Clause two."]
+        self.embedder.create_and_store(_docs("msa.pdf", v1), save_path=str(tmp_path), doc_id="msa")
+
+        reloaded = EmbedderStore(embeddings=self.embedder.embeddings)
+        reloaded.load_store(str(tmp_path))
+        self.embeddings.batches.clear()
+        reloaded.create_and_store(_docs("msa.pdf", v1 + ["Clause three."]), save_path=str(tmp_path), doc_id="msa")
+
+        assert self.embeddings.embedded == ["Clause three."]
+        assert reloaded.vector_store.index.ntotal == 3
+
+
+class TestMultiDocumentStore:
+    """Test a persistent index holding many documents."""
+
+    def setup_method(self):
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+        self.embedder = EmbedderStore(embeddings=self.embeddings)
+
+    def test_upload_appends_and_delete_removes(self, tmp_path):
+        """Uploading B keeps A; deleting A leaves B searchable."""
+        self.embedder.create_and_store(_docs("a.pdf", ["Rent is monthly.", "Deposit is two months."]),
+                                       save_path=str(tmp_path), doc_id="a")
+        self.embedder.create_and_store(_docs("b.pdf", ["Salary is paid biweekly."]), save_path=str(tmp_path), doc_id="b")
+
+        assert self.embedder.vector_store.index.ntotal == 3
+        assert [d.page_content for d in self.embedder.get_documents("b")] == ["Salary is paid biweekly."]
+
+        assert self.embedder.delete_document("a", save_path=str(tmp_path)) == 2
+        assert self.embedder.vector_store.index.ntotal == 1
+        assert self.embedder.similarity_search("rent", k=4)[0].metadata["source"] == "b.pdf"
+        with pytest.raises(KeyError):
+            self.embedder.delete_document("a", save_path=str(tmp_path))
+
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+        assert list(reloaded.documents) == ["b"]
+        assert (reloaded.get_embeddings() == self.embedder.get_embeddings()).all()
+
+    def test_search_version_changes_with_its_document_only(self, tmp_path):
+        """A new revision of one document leaves the other documents' versions as they were."""
+        self.embedder.create_and_store(_docs("a.pdf", ["Rent is monthly."]), save_path=str(tmp_path), doc_id="a")
+        self.embedder.create_and_store(_docs("b.pdf", ["Salary is paid biweekly."]), save_path=str(tmp_path), doc_id="b")
+        a, b, whole = (self.embedder.search_version(doc_id) for doc_id in ("a", "b", None))
+
+        self.embedder.create_and_store(_docs("a.pdf", ["Rent is weekly."]), save_path=str(tmp_path), doc_id="a")
+
+        assert a[0] == "a" and self.embedder.search_version("a") != a
+        assert self.embedder.search_version("b") == b
+        assert self.embedder.search_version(None) != whole
+
+    def test_search_version_does_not_wait_for_writers(self, tmp_path):
+        """Versions are read while a save or checkpoint holds the index lock."""
+        import threading
+
+        self.embedder.create_and_store(_docs("a.pdf", ["Rent is monthly."]), save_path=str(tmp_path), doc_id="a")
+        expected = self.embedder.search_version("a")
+        held, release = threading.Event(), threading.Event()
+
+        def writer():
+            with self.embedder._lock:
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        held.wait(5)
+        try:
+            result = []
+            reader = threading.Thread(target=lambda: result.append(self.embedder.search_version("a")))
+            reader.start()
+            reader.join(1)
+            assert result == [expected]
+        finally:
+            release.set()
+            thread.join()
+
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+        assert reloaded.search_version("a") == expected
+
+    def test_save_only_touches_new_document(self, tmp_path):
+        """Adding a document writes its own segment, not the others'."""
+        self.embedder.create_and_store(_docs("a.pdf", ["Clause A."]), save_path=str(tmp_path), doc_id="a")
+        segments = tmp_path / "segments"
+        before = {name: os.stat(segments / name).st_mtime_ns for name in os.listdir(segments)}
+
+        # a fresh process appends to the store on disk
+        other = EmbedderStore(embeddings=self.embeddings)
+        other.create_and_store(_docs("b.pdf", ["Clause B."]), save_path=str(tmp_path), doc_id="b")
+
+        after = {name: os.stat(segments / name).st_mtime_ns for name in os.listdir(segments)}
+        assert len(after) == 4
+        assert all(after[name] == mtime for name, mtime in before.items())
+        assert set(other.documents) == {"a", "b"}
+
+    def test_legacy_index_converted(self, tmp_path):
+        """A single-file index from an older version is only converted on request, keeping the originals."""
+        from langchain_community.vectorstores import FAISS
+
+        docs = _docs("old.pdf", ["Old clause one.", "Old clause two."])
+        FAISS.from_documents(docs, self.embeddings).save_local(str(tmp_path))
+
+        with pytest.raises(ValueError, match="src.ingestion.migrate"):
+            self.embedder.load_store(str(tmp_path))
+        assert not os.path.exists(tmp_path / "documents.json")
+
+        self.embedder.migrate_legacy(str(tmp_path))
+
+        assert list(self.embedder.documents) == ["old.pdf"]
+        assert os.path.exists(tmp_path / "index.faiss") and os.path.exists(tmp_path / "index.pkl")
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+        assert [d.page_content for d in reloaded.get_documents()] == ["Old clause one.", "Old clause two."]
+
+
+class TestVectorIndex:
+    """Test size-based index selection (flat / HNSW / IVF)."""
+
+    def setup_method(self):
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+
+    def test_choose_index_type(self, monkeypatch):
+        """auto grows flat -> hnsw -> ivf; a forced ivf waits until it can train."""
+        from config import config
+        from src.ingestion.vector_index import choose_index_type
+
+        monkeypatch.setattr(config, "FLAT_MAX_VECTORS", 100)
+        monkeypatch.setattr(config, "IVF_MIN_VECTORS", 1000)
+        assert [choose_index_type(n, "auto") for n in (10, 100, 1000)] == ["flat", "hnsw", "ivf"]
+        assert [choose_index_type(n, "ivf") for n in (10, 1000)] == ["flat", "ivf"]
+        assert choose_index_type(10, "hnsw") == "hnsw"
+        with pytest.raises(ValueError):
+            choose_index_type(10, "annoy")
+
+    def test_index_upgraded_as_corpus_grows(self, tmp_path, monkeypatch):
+        """Crossing a threshold rebuilds the index; results and reload still work."""
+        import faiss
+        from config import config
+        from src.ingestion.vector_index import unwrap
+
+        monkeypatch.setattr(config, "FLAT_MAX_VECTORS", 50)
+        monkeypatch.setattr(config, "IVF_MIN_VECTORS", 400)
+        embedder = EmbedderStore(embeddings=self.embeddings, index_type="auto")
+
+        embedder.create_and_store(_clauses("a.pdf", 40), save_path=str(tmp_path), doc_id="a")
+        assert isinstance(embedder.vector_store.index, faiss.IndexFlat)
+        embedder.create_and_store(_clauses("b.pdf", 40), save_path=str(tmp_path), doc_id="b")
+        assert isinstance(unwrap(embedder.vector_store.index), faiss.IndexHNSW)
+        embedder.create_and_store(_clauses("c.pdf", 400), save_path=str(tmp_path), doc_id="c")
+        index = unwrap(embedder.vector_store.index)
+        assert isinstance(index, faiss.IndexIVF) and index.is_trained
+        assert faiss.extract_index_ivf(index).nprobe == config.IVF_NPROBE
+
+        hit = embedder.similarity_search("b.pdf clause 7.", k=1)[0]
+        assert hit.page_content == "b.pdf clause 7."
+
+        reloaded = EmbedderStore(embeddings=self.embeddings, index_type="auto")
+        reloaded.load_store(str(tmp_path))
+        assert isinstance(unwrap(reloaded.vector_store.index), faiss.IndexIVF)
+        assert reloaded.vector_store.index.ntotal == 480
+
+    @pytest.mark.parametrize("index_type", ["hnsw", "ivf"])
+    def test_small_delete_tombstones_without_rebuild(self, tmp_path, monkeypatch, index_type):
+        """A small delete only hides chunks; past the compaction fraction the index is rebuilt."""
+        from config import config
+        from src.ingestion.vector_index import tombstones_of, unwrap
+
+        monkeypatch.setattr(config, "IVF_MIN_VECTORS", 100)
+        monkeypatch.setattr(config, "INDEX_COMPACT_FRACTION", 0.2)
+        embedder = EmbedderStore(embeddings=self.embeddings, index_type=index_type)
+        embedder.create_and_store(_clauses("a.pdf", 100), save_path=str(tmp_path), doc_id="a")
+        for doc_id in ("b", "c", "d"):
+            embedder.create_and_store(_clauses(f"{doc_id}.pdf", 5), save_path=str(tmp_path), doc_id=doc_id)
+        index = unwrap(embedder.vector_store.index)
+
+        embedder.delete_document("b", save_path=str(tmp_path))
+
+        assert unwrap(embedder.vector_store.index) is index and index.ntotal == 115
+        assert tombstones_of(embedder.vector_store.index).deleted
+        hits = embedder.vector_store.similarity_search("b.pdf clause 3.", k=20)
+        assert hits and not any(d.metadata["source"] == "b.pdf" for d in hits)
+        assert embedder.similarity_search("c.pdf clause 3.", k=1)[0].page_content == "c.pdf clause 3."
+        assert embedder.get_embeddings().shape == (110, 16)
+
+        embedder.create_and_store(_clauses("a.pdf", 80), save_path=str(tmp_path), doc_id="a")
+
+        assert unwrap(embedder.vector_store.index) is not index
+        assert embedder.vector_store.index.ntotal == 90 and not tombstones_of(embedder.vector_store.index).deleted
+        assert embedder.similarity_search("d.pdf clause 4.", k=1)[0].page_content == "d.pdf clause 4."
+
+    def test_delete_from_hnsw(self, tmp_path):
+        """Deleting from an index without remove_ids rebuilds it consistently."""
+        embedder = EmbedderStore(embeddings=self.embeddings, index_type="hnsw")
+        embedder.create_and_store(_clauses("a.pdf", 5), save_path=str(tmp_path), doc_id="a")
+        embedder.create_and_store(_clauses("b.pdf", 5), save_path=str(tmp_path), doc_id="b")
+
+        embedder.delete_document("a", save_path=str(tmp_path))
+
+        assert embedder.vector_store.index.ntotal == 5
+        hit = embedder.similarity_search("b.pdf clause 3.", k=1)[0]
+        assert hit.page_content == "b.pdf clause 3."
+        assert embedder.get_embeddings().shape == (5, 16)
+
+
+class TestCompressedIndex:
+    """Test SQ/PQ-compressed indexes with exact re-ranking."""
+
+    def setup_method(self):
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+
+    def test_sq8_reranked_against_float_vectors(self, tmp_path):
+        """Scores come from the exact vectors, which survive revisions and reloads."""
+        from src.ingestion.vector_index import RerankingIndex, compression_of
+
+        embedder = EmbedderStore(embeddings=self.embeddings, compression="sq8", rerank_factor=4)
+        embedder.create_and_store(_clauses("a.pdf", 20), save_path=str(tmp_path), doc_id="a")
+        embedder.create_and_store(_clauses("a.pdf", 25), save_path=str(tmp_path), doc_id="a")
+
+        assert isinstance(embedder.vector_store.index, RerankingIndex)
+        assert compression_of(embedder.vector_store.index) == "sq8"
+        exact = np.array(self.embeddings.embed_documents([d.page_content for d in _clauses("a.pdf", 25)]), dtype=np.float32)
+        assert (embedder.get_embeddings("a") == exact).all()
+
+        doc, score = embedder.vector_store.similarity_search_with_score("a.pdf clause 21.", k=1)[0]
+        assert doc.page_content == "a.pdf clause 21." and score == pytest.approx(0.0, abs=1e-6)
+
+        reloaded = EmbedderStore(embeddings=self.embeddings, compression="sq8")
+        reloaded.load_store(str(tmp_path))
+        assert (reloaded.get_embeddings("a") == exact).all()
+
+    def test_pq_trained_once_enough_vectors(self, tmp_path, monkeypatch):
+        """PQ starts as SQ8 and switches once its codebooks can be trained."""
+        from config import config
+        from src.ingestion.vector_index import compression_of
+
+        monkeypatch.setattr(config, "PQ_MIN_VECTORS", 300)
+        embedder = EmbedderStore(embeddings=self.embeddings, compression="pq", index_type="hnsw")
+        embedder.create_and_store(_clauses("a.pdf", 50), save_path=str(tmp_path), doc_id="a")
+        assert compression_of(embedder.vector_store.index) == "sq8"
+
+        embedder.create_and_store(_clauses("b.pdf", 300), save_path=str(tmp_path), doc_id="b")
+        assert compression_of(embedder.vector_store.index) == "pq"
+        assert embedder.similarity_search("b.pdf clause 123.", k=1)[0].page_content == "b.pdf clause 123."
+
+        embedder.delete_document("b", save_path=str(tmp_path))
+        assert embedder.vector_store.index.ntotal == 50
+        assert embedder.similarity_search("a.pdf clause 7.", k=1)[0].page_content == "a.pdf clause 7."
+
+
+class TestCheckpoint:
+    """Test opening a saved store memory-mapped from its checkpoint."""
+
+    def setup_method(self):
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+
+    def test_flat_store_opened_lazily(self, tmp_path):
+        """A checkpointed store searches and reads chunks without rebuilding or unpickling."""
+        from src.ingestion.vector_index import MmapFlatIndex
+
+        embedder = EmbedderStore(embeddings=self.embeddings)
+        embedder.create_and_store(_clauses("a.pdf", 10), save_path=str(tmp_path), doc_id="a")
+        embedder.create_and_store(_clauses("b.pdf", 10), save_path=str(tmp_path), doc_id="b")
+
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+
+        assert isinstance(reloaded.vector_store.index, MmapFlatIndex)
+        assert not list(tmp_path.rglob("*.pkl"))
+        assert reloaded.similarity_search("b.pdf clause 4.", k=1)[0].page_content == "b.pdf clause 4."
+        assert [d.page_content for d in reloaded.get_documents("a")] == [d.page_content for d in _clauses("a.pdf", 10)]
+        assert (reloaded.get_embeddings() == embedder.get_embeddings()).all()
+
+    def test_writes_after_lazy_open(self, tmp_path):
+        """Ingesting or deleting loads the checkpoint into memory first; retrievers stay valid."""
+        embedder = EmbedderStore(embeddings=self.embeddings, index_type="hnsw", compression="sq8")
+        embedder.create_and_store(_clauses("a.pdf", 10), save_path=str(tmp_path), doc_id="a")
+
+        reloaded = EmbedderStore(embeddings=self.embeddings, index_type="hnsw", compression="sq8")
+        store = reloaded.load_store(str(tmp_path))
+        reloaded.create_and_store(_clauses("b.pdf", 5), save_path=str(tmp_path), doc_id="b")
+        reloaded.delete_document("a", save_path=str(tmp_path))
+
+        assert reloaded.vector_store is store
+        assert store.index.ntotal == 5
+        assert store.similarity_search("b.pdf clause 2.", k=1)[0].page_content == "b.pdf clause 2."
+        assert set(reloaded.documents) == {"b"}
+
+    def test_stale_checkpoint_rebuilt(self, tmp_path, monkeypatch):
+        """Saves too small to refresh the checkpoint are still seen on the next load."""
+        from config import config
+
+        embedder = EmbedderStore(embeddings=self.embeddings)
+        embedder.create_and_store(_clauses("a.pdf", 40), save_path=str(tmp_path), doc_id="a")
+        monkeypatch.setattr(config, "CHECKPOINT_FRACTION", 0.5)
+        embedder.create_and_store(_clauses("b.pdf", 2), save_path=str(tmp_path), doc_id="b")
+        assert [p.name for p in tmp_path.glob("checkpoint-*")] == ["checkpoint-1"]
+
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+
+        assert set(reloaded.documents) == {"a", "b"}
+        assert sorted(p.name for p in tmp_path.glob("checkpoint-*")) == ["checkpoint-1", "checkpoint-2"]
+        again = EmbedderStore(embeddings=self.embeddings)
+        again.load_store(str(tmp_path))
+        assert again.similarity_search("b.pdf clause 1.", k=1)[0].page_content == "b.pdf clause 1."
+
+    def test_processes_share_one_store(self, tmp_path, monkeypatch):
+        """Writers in several processes take turns; none loses another's documents or checkpoint."""
+        import subprocess
+        import sys
+        from config import config
+
+        monkeypatch.setattr(config, "CHECKPOINT_KEEP", 1)
+        embedder = EmbedderStore(embeddings=self.embeddings)
+        embedder.create_and_store(_clauses("seed.pdf", 10), save_path=str(tmp_path), doc_id="seed")
+        worker = EmbedderStore(embeddings=self.embeddings)
+        worker.load_store(str(tmp_path))
+        script = (
+            "import sys\n"
+            "from langchain.schema import Document\n"
+            "from langchain_community.embeddings import DeterministicFakeEmbedding\n"
+            "from src.ingestion.embedder import EmbedderStore\n"
+            "store = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=16))\n"
+            "store.load_store(sys.argv[1])\n"
+            "for n in range(4):\n"
+            "    doc_id = f'{sys.argv[2]}-{n}'\n"
+            "    docs = [Document(page_content=f'{doc_id} clause {i}.', metadata={'source': doc_id}) for i in range(5)]\n"
+            "    store.create_and_store(docs, save_path=sys.argv[1], doc_id=doc_id)\n"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, CHECKPOINT_KEEP="1", CHECKPOINT_FRACTION="0")
+        processes = [subprocess.Popen([sys.executable, "-c", script, str(tmp_path), name], cwd=root, env=env)
+                     for name in ("A", "B")]
+        assert [p.wait(timeout=300) for p in processes] == [0, 0]
+
+        # this worker's checkpoint is gone and it never saw A's or B's documents
+        worker.create_and_store(_clauses("c.pdf", 3), save_path=str(tmp_path), doc_id="c")
+        expected = {"seed", "c"} | {f"{name}-{n}" for name in "AB" for n in range(4)}
+        assert set(worker.documents) == expected
+
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+        assert set(reloaded.documents) == expected
+        assert reloaded.similarity_search("B-3 clause 4.", k=1)[0].page_content == "B-3 clause 4."
+        assert reloaded.vector_store.index.ntotal == 10 + 8 * 5 + 3
+
+
+class TestBatchEmbeddings:
+    """Test length-bucketed batch embedding."""
+
+    def test_plan_batches(self):
+        """Similar lengths share a batch, sized to the token budget."""
+        from src.ingestion.batch_embedder import plan_batches
+
+        lengths = [10, 200, 12, 190, 11, 9]
+        batches = plan_batches(lengths, batch_tokens=400, max_batch_size=3)
+
+        assert batches == [[1, 3], [2, 4, 0], [5]]
+        assert sorted(n for batch in batches for n in batch) == list(range(len(lengths)))
+
+    def test_order_restored(self, monkeypatch):
+        """Vectors come back in input order whatever the batching."""
+        from src.ingestion import batch_embedder
+
+        class LengthModel:
+            def __init__(self):
+                self.batches = []
+
+            def encode(self, texts, batch_size, **kwargs):
+                self.batches.append(len(texts))
+                return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+        model = LengthModel()
+        monkeypatch.setattr(batch_embedder, "_load_model", lambda name: model)
+        embeddings = batch_embedder.BatchEmbeddings(
+            "fake", workers=1, batch_tokens=40, max_batch_size=8, normalize=False, token_counter=len
+        )
+        texts = ["x" * n for n in (3, 30, 5, 25, 4, 1)]
+
+        vectors = embeddings.embed_documents(texts)
+
+        assert [v[0] for v in vectors] == [3, 30, 5, 25, 4, 1]
+        assert model.batches == [1, 1, 4]
+        assert embeddings.embed_query("abc") == [3.0, 1.0]
+
+    def test_model_loaded_once_under_concurrency(self, monkeypatch):
+        """Threads asking for the model at the same time share one load."""
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from src.ingestion import batch_embedder
+
+        loads = []
+
+        def slow_load(name):
+            loads.append(name)
+            time.sleep(0.05)
+            return object()
+
+        monkeypatch.setattr(batch_embedder, "_load_model", slow_load)
+        embeddings = batch_embedder.BatchEmbeddings("fake", token_counter=len)
+        start = threading.Barrier(4)
+
+        def get_model(_):
+            start.wait()
+            return embeddings.model
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            models = list(pool.map(get_model, range(4)))
+
+        assert loads == ["fake"]
+        assert all(m is models[0] for m in models)
+
+
+class TestQueryBatcher:
+    """Test micro-batching of concurrent question embeddings."""
+
+    def setup_method(self):
+        self.embeddings = CountingEmbedding(size=8)
+
+    def test_concurrent_questions_share_a_pass(self):
+        """Questions within the window are embedded together; each caller gets its own vector."""
+        from concurrent.futures import ThreadPoolExecutor
+        from src.ingestion.query_batcher import QueryBatcher
+
+        batcher = QueryBatcher(self.embeddings, window_ms=200, max_batch=6)
+        questions = [f"Question {i}?" for i in range(6)]
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            vectors = list(pool.map(batcher.embed_query, questions))
+
+        assert vectors == [self.embeddings.embed_query(q) for q in questions]
+        assert len(self.embeddings.batches) == 1 and sorted(self.embeddings.batches[0]) == questions
+        stats = batcher.stats()
+        assert stats["batch_size"]["count"] == 1 and stats["batch_size"]["buckets"]["le_8"] == 1
+        assert stats["queue_wait_ms"]["count"] == 6
+
+    def test_errors_reach_every_caller(self):
+        """A failed forward pass fails the callers, not the batcher."""
+        from src.ingestion.query_batcher import QueryBatcher
+
+        class Broken:
+            def embed_query(self, text):
+                raise RuntimeError("model unavailable")
+
+        batcher = QueryBatcher(Broken(), window_ms=0)
+        with pytest.raises(RuntimeError):
+            batcher.embed_query("Who are the parties?")
+        batcher.embeddings = self.embeddings
+        assert batcher.embed_query("Who are the parties?") == self.embeddings.embed_query("Who are the parties?")
+
+    def test_search_goes_through_batcher(self, tmp_path):
+        """EmbedderStore search and its retriever embed questions via the batcher."""
+        from src.ingestion.query_batcher import QueryBatcher
+
+        batcher = QueryBatcher(self.embeddings, window_ms=1)
+        embedder = EmbedderStore(embeddings=self.embeddings, query_batcher=batcher)
+        docs = [Document(page_content=t, metadata={"source": "a.pdf"}) for t in ["Rent.", "Term."]]
+        embedder.create_and_store(docs, save_path=str(tmp_path))
+
+        assert embedder.similarity_search("Rent.", k=1)[0].page_content == "Rent."
+        embedder.vector_store.as_retriever(search_kwargs={"k": 1}).invoke("Term.")
+        assert batcher.stats()["batch_size"]["count"] == 2
+
+
+class TestHybridSearch:
+    """Test the BM25 index and dense + BM25 fusion."""
+
+    def setup_method(self):
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+
+    def test_bm25_ranks_exact_terms(self):
+        """Rare exact terms decide the ranking; words in most chunks are skipped."""
+        from src.ingestion.lexical_index import BM25Index, tokenize
+
+        assert tokenize("See Section 12.3, net-30.") == ["see", "section", "12.3", "net-30"]
+        index = BM25Index()
+        index.add(["a", "b", "c"], ["Payment is net 30 days.", "Section 12.3 governs payment.", "Payment by wire."])
+
+        assert [chunk_id for chunk_id, _ in index.search("section 12.3 payment", k=3)] == ["b"]
+        assert [chunk_id for chunk_id, _ in index.search("payment", k=3)][0] == "c"
+        index.remove(["b"])
+        index.add(["d"], ["Section 12.3 is deleted."])
+        assert index.search("12.3", k=3)[0][0] == "d"
+        assert index.search("unknown", k=3) == []
+        assert len(index) == 3
+
+    def test_hybrid_finds_exact_reference(self, tmp_path, monkeypatch):
+        """Hybrid search surfaces a clause by its section number, also after a reload."""
+        from config import config
+
+        monkeypatch.setattr(config, "RETRIEVAL_MODE", "hybrid")
+        filler = [f"Clause {i} covers general obligations of the parties." for i in range(30)]
+        embedder = EmbedderStore(embeddings=self.embeddings)
+        embedder.create_and_store(_docs("msa.pdf", filler + ["Section 12.3: invoices are due net 30."]),
+                                  save_path=str(tmp_path), doc_id="msa")
+
+        retriever = embedder.as_retriever(k=2)
+        assert "Section 12.3" in retriever.invoke("What does section 12.3 say?")[0].page_content
+
+        reloaded = EmbedderStore(embeddings=self.embeddings)
+        reloaded.load_store(str(tmp_path))
+        assert "net 30" in reloaded.hybrid_search("net 30", k=2)[0].page_content
+        reloaded.create_and_store(_docs("sow.pdf", ["Section 4.1: milestones are fixed."]),
+                                  save_path=str(tmp_path), doc_id="sow")
+        reloaded.delete_document("msa", save_path=str(tmp_path))
+        assert [doc.page_content for doc, _ in reloaded.lexical_search("section", k=3)] == ["Section 4.1: milestones are fixed."]
+
+
+class TestMMR:
+    """Test diversity-aware (MMR) retrieval."""
+
+    def test_mmr_select_skips_near_duplicates(self):
+        """A near-copy of the best candidate loses to a different, slightly less relevant one."""
+        from src.ingestion.vector_index import mmr_select
+
+        vectors = np.array([[1.0, 0.0, 0.0], [0.99, 0.01, 0.0], [0.6, 0.8, 0.0], [0.0, 0.0, 1.0]])
+        relevance = np.array([0.95, 0.94, 0.8, 0.1])
+
+        assert mmr_select(relevance, vectors, k=2, lambda_mult=0.5) == [0, 2]
+        assert mmr_select(relevance, vectors, k=2, lambda_mult=1.0) == [0, 1]
+        assert mmr_select(relevance[:0], vectors[:0], k=2) == []
+
+    def test_search_returns_distinct_chunks(self, tmp_path, monkeypatch):
+        """Repeated text is sent once; the MMR retriever uses stored vectors only."""
+        from config import config
+
+        texts = ["Payment is due in 30 days.", "Payment is due in 30 days.", "Notice must be written.", "Law is Delaware."]
+        embeddings = CountingEmbedding(size=16)
+        embedder = EmbedderStore(embeddings=embeddings)
+        embedder.create_and_store(_docs("a.pdf", texts), save_path=str(tmp_path))
+        embeddings.batches.clear()
+
+        assert [d.page_content for d in embedder.similarity_search(texts[0], k=2)] == [texts[0]] * 2
+        top = embedder.mmr_search(texts[0], k=2, lambda_mult=0.3)
+        assert top[0].page_content == texts[0] and top[1].page_content != texts[0]
+
+        monkeypatch.setattr(config, "RETRIEVAL_MODE", "dense")
+        monkeypatch.setattr(config, "MMR_ENABLED", True)
+        monkeypatch.setattr(config, "MMR_LAMBDA", 0.3)
+        assert len({d.page_content for d in embedder.as_retriever(k=2).invoke(texts[0])}) == 2
+        monkeypatch.setattr(config, "RETRIEVAL_MODE", "hybrid")
+        assert len({d.page_content for d in embedder.as_retriever(k=2).invoke(texts[0])}) == 2
+        assert embeddings.embedded == []
+
+
+class TestEmbeddingCache:
+    """Test the persistent chunk-embedding cache."""
+
+    def setup_method(self):
+        self.model = CountingEmbedding(size=8)
+
+    def test_only_misses_reach_model(self, tmp_path):
+        """Repeated and already-cached texts are not embedded again."""
+        cache = EmbeddingCache("fake", cache_dir=str(tmp_path), max_vectors=32)
+        embeddings = CachedEmbeddings(self.model, cache)
+
+        first = embeddings.embed_documents(["Governing law.", "Notices.", "Governing law."])
+        second = embeddings.embed_documents(["Notices.", "Force majeure."])
+
+        assert self.model.embedded == ["Governing law.", "Notices.", "Force majeure."]
+        assert first[0] == first[2] and second[0] == pytest.approx(first[1])
+        assert (cache.hits, cache.misses) == (1, 4)
+
+    def test_persists_across_restart(self, tmp_path):
+        """A reopened cache serves vectors written by a previous process."""
+        cache = EmbeddingCache("fake", cache_dir=str(tmp_path), max_vectors=32)
+        vectors = CachedEmbeddings(self.model, cache).embed_documents(["Term: two years."])
+        self.model.batches.clear()
+
+        reopened = EmbeddingCache("fake", cache_dir=str(tmp_path), max_vectors=32)
+        again = CachedEmbeddings(self.model, reopened).embed_documents(["Term:  two years. "])
+
+        assert self.model.embedded == []
+        assert again[0] == pytest.approx(vectors[0])
+        # the key includes the model, so another model never sees these vectors
+        other = EmbeddingCache("other", cache_dir=str(tmp_path), max_vectors=32)
+        assert other.get_many([other.key("Term: two years.")]) == [None]
+
+    def test_lru_eviction(self, tmp_path):
+        """The least recently used vectors are recycled when the cache is full."""
+        cache = EmbeddingCache("fake", cache_dir=str(tmp_path), max_vectors=16)
+        texts = [f"Clause {i}." for i in range(16)]
+        keys = [cache.key(t) for t in texts]
+        cache.put_many(keys, self.model.embed_documents(texts))
+        cache.get_many(keys[:1])  # clause 0 is now the most recently used
+
+        cache.put_many([cache.key("New clause.")], self.model.embed_documents(["New clause."]))
+
+        assert cache.get_many([keys[1]]) == [None]
+        assert cache.get_many([keys[0]])[0] is not None
+        assert cache.stats()["entries"] == 16
+
+    def test_processes_share_one_cache(self, tmp_path):
+        """Two handles on one cache (two processes) never serve each other's slots as their own."""
+        first = EmbeddingCache("fake", cache_dir=str(tmp_path), max_vectors=16)
+        keys = [first.key(t) for t in ["One.", "Two.", "Three."]]
+        vectors = self.model.embed_documents(["One.", "Two.", "Three."])
+        first.put_many(keys[:1], vectors[:1])
+        second = EmbeddingCache("fake", cache_dir=str(tmp_path), max_vectors=16)
+
+        first.put_many(keys[1:2], vectors[1:2])
+        second.put_many(keys[2:], vectors[2:])
+
+        for cache in (first, second):
+            assert cache.get_many(keys) == [pytest.approx(v) for v in vectors]
+        # a slot recycled behind this handle's back is a miss, not another text's vector
+        second._slots[first.key("Four.")] = second._slots[keys[0]]
+        assert second.get_many([first.key("Four.")]) == [None]
+
+    def test_ingestion_reports_hits(self, tmp_path):
+        """Re-indexing a document under a new ID is served from the cache."""
+        cache = EmbeddingCache("fake", cache_dir=str(tmp_path / "cache"), max_vectors=32)
+        embedder = EmbedderStore(embeddings=self.model, embedding_cache=cache)
+        docs = [Document(page_content=t, metadata={"source": "nda.pdf"}) for t in ["One.", "Two."]]
+
+        embedder.create_and_store(docs, save_path=str(tmp_path / "index"), doc_id="nda-v1")
+        embedder.create_and_store(docs, save_path=str(tmp_path / "index"), doc_id="nda-copy")
+
+        assert self.model.embedded == ["One.", "Two."]
+        assert (embedder.last_update["cache_hits"], embedder.last_update["cache_misses"]) == (2, 0)
+
+
+class TestQueryEmbeddingCache:
+    """Test the in-memory LRU of question embeddings."""
+
+    def test_repeated_questions_skip_model(self, tmp_path):
+        """Search and the retriever share one cache; whitespace is ignored."""
+        embeddings = CountingEmbedding(size=8)
+        embedder = EmbedderStore(embeddings=embeddings, query_cache=QueryEmbeddingCache("fake", max_size=8))
+        docs = [Document(page_content=t, metadata={"source": "a.pdf"}) for t in ["Rent.", "Term."]]
+        embedder.create_and_store(docs, save_path=str(tmp_path))
+
+        embedder.similarity_search("Who are the parties?", k=1)
+        embedder.similarity_search("Who are  the parties? ", k=1)
+        retriever = embedder.vector_store.as_retriever(search_kwargs={"k": 1})
+        retriever.invoke("Who are the parties?")
+
+        assert embeddings.queries == ["Who are the parties?"]
+        stats = embedder.query_cache.stats()
+        assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 1)
+
+    def test_lru_eviction(self):
+        """The least recently asked question is dropped first."""
+        cache = QueryEmbeddingCache("fake", max_size=2)
+        cache.put(cache.key("a"), [1.0])
+        cache.put(cache.key("b"), [2.0])
+        cache.get(cache.key("a"))
+        cache.put(cache.key("c"), [3.0])
+
+        assert cache.get(cache.key("b")) is None
+        assert cache.get(cache.key("a")) == [1.0]
+        assert cache.stats()["size"] == 2
@@ -3,6 +3,8 @@ Tests for the retrieval and QA pipeline.
 """
 
 import pytest
+from langchain.schema import Document
+from config import config
 from src.guardrails.safety import GuardRails
 
 
@@ -60,4 +62,514 @@ class TestGuardRails:
         """Should warn when no sources are provided."""
         answer = "The termination clause states 30 days notice."
         processed, metadata = self.guardrails.check_output(answer, [])
-        assert "No source documents" in str(metadata["warnings"])
\ No newline at end of file
+        assert "No source documents" in str(metadata["warnings"])
+
+
+class TestQAChain:
+    """Test the QA chain with a fake LLM and embeddings."""
+
+    def setup_method(self):
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_community.vectorstores import FAISS
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.retrieval.qa_chain import QAChain
+
+        texts = ["Payment is due within 30 days.", "Either party may terminate with notice."]
+        metadatas = [{"chunk_index": i, "source": "msa.pdf", "token_count": 7} for i in range(2)]
+        store = FAISS.from_texts(texts, DeterministicFakeEmbedding(size=16), metadatas=metadatas)
+        self.qa = QAChain(store, llm=FakeListChatModel(responses=["Payment is due in 30 days (Source 1)."]))
+
+    def test_ask_reports_context_tokens(self):
+        """ask() should answer from the LLM and report the context size."""
+        result = self.qa.ask("When is payment due?")
+
+        assert result["answer"].startswith("Payment is due")
+        assert result["num_sources"] == 2
+        assert result["context_tokens"] == 14
+        assert len(self.qa.chat_history) == 2
+
+    def test_ask_stream_sends_sources_then_tokens(self):
+        """Streaming yields sources first, the answer piecewise, then the result with timings."""
+        events = list(self.qa.ask_stream("When is payment due?"))
+
+        assert events[0]["event"] == "sources" and events[0]["num_sources"] == 2
+        tokens = [e["text"] for e in events if e["event"] == "token"]
+        assert len(tokens) > 1
+        done = events[-1]
+        assert done["event"] == "done"
+        assert "".join(tokens) == done["answer"] == "Payment is due in 30 days (Source 1)."
+        assert 0 <= done["ttft_ms"] <= done["generation_ms"]
+        assert self.qa.chat_history[-1].content == done["answer"]
+
+    def test_aask_matches_ask(self):
+        """aask() answers like ask() without blocking the event loop."""
+        import asyncio
+
+        result = asyncio.run(self.qa.aask("When is payment due?"))
+
+        assert result["answer"].startswith("Payment is due")
+        assert result["num_sources"] == 2 and result["context_tokens"] == 14
+        assert not result["cached"] and result["generation_ms"] >= 0
+        assert len(self.qa.chat_history) == 2
+
+
+class TestContextBuilder:
+    """Test merging of overlapping chunks into token-budgeted passages."""
+
+    def _chunks(self):
+        from src.ingestion.chunker import TextChunker
+
+        text = " ".join(f"Clause {n} sets out obligation number {n} of the supplier." for n in range(40))
+        chunker = TextChunker(chunk_size=120, chunk_overlap=60, token_counter=lambda t: len(t.split()))
+        return text, chunker.chunk_text(text, metadata={"source": "msa.pdf"})
+
+    def test_budget_uses_stored_token_counts(self):
+        """Chunks are kept in order until the token budget is used up."""
+        from src.retrieval.context_builder import ContextBuilder
+
+        docs = [Document(page_content="x", metadata={"token_count": n}) for n in (600, 900, 700, 300)]
+        context = ContextBuilder(lambda t: len(t.split())).build(docs, token_budget=1600)
+
+        assert [d.metadata["token_count"] for d in context.passages] == [600, 900]
+        assert context.tokens == 1500
+
+    def test_best_chunk_kept_over_budget(self):
+        """The top chunk is sent even if it alone exceeds the budget."""
+        from src.retrieval.context_builder import ContextBuilder
+
+        docs = [Document(page_content="x", metadata={"token_count": 5000})]
+        context = ContextBuilder(lambda t: len(t.split())).build(docs, token_budget=100)
+
+        assert len(context.passages) == 1 and context.tokens == 5000
+
+    def test_overlapping_chunks_merge_into_one_passage(self):
+        """Neighbouring chunks become one passage holding the text once."""
+        from src.retrieval.context_builder import ContextBuilder
+
+        text, chunks = self._chunks()
+        retrieved = [chunks[5], chunks[20], chunks[6], chunks[4]]
+        context = ContextBuilder(lambda t: len(t.split())).build(retrieved, token_budget=10_000)
+
+        assert len(context.passages) == 2
+        merged = context.passages[0]
+        assert merged.metadata["chunk_indices"] == [4, 5, 6]
+        start = chunks[4].metadata["start_index"]
+        assert merged.page_content == text[start : chunks[6].metadata["start_index"] + len(chunks[6].page_content)]
+        assert context.passages[1] is chunks[20]
+        assert context.saved_tokens > 0
+        assert context.tokens + context.saved_tokens == sum(c.metadata["token_count"] for c in retrieved)
+
+    def test_overlap_does_not_count_against_budget(self):
+        """A neighbour of a kept chunk costs only its new text, so more chunks fit."""
+        from src.retrieval.context_builder import ContextBuilder
+
+        _, chunks = self._chunks()
+        builder = ContextBuilder(lambda t: len(t.split()))
+        budget = chunks[5].metadata["token_count"] + chunks[6].metadata["token_count"] - 5
+
+        context = builder.build([chunks[5], chunks[6], chunks[30]], token_budget=budget)
+        assert context.passages[0].metadata["chunk_indices"] == [5, 6]
+        assert len(context.passages) == 1 and context.tokens <= budget
+
+    def test_chunks_of_other_revisions_stay_apart(self):
+        """Overlapping offsets with different text (another revision) aren't merged."""
+        from src.retrieval.context_builder import ContextBuilder
+
+        _, chunks = self._chunks()
+        edited = Document(page_content=chunks[6].page_content.replace("supplier", "customer"),
+                          metadata=dict(chunks[6].metadata))
+        context = ContextBuilder(lambda t: len(t.split())).build([chunks[5], edited], token_budget=10_000)
+
+        assert context.passages == [chunks[5], edited] and context.saved_tokens == 0
+
+
+class TestCrossEncoderReranker:
+    """Test the cross-encoder second stage with a fake model."""
+
+    class FakeCrossEncoder:
+        """Scores a pair by how many question words the chunk contains."""
+
+        def __init__(self, delay=0.0):
+            self.pairs = []
+            self.delay = delay
+
+        def predict(self, pairs, batch_size, show_progress_bar):
+            import time
+
+            time.sleep(self.delay)
+            self.pairs.extend(pairs)
+            return [len(set(q.lower().split()) & set(c.lower().split())) for q, c in pairs]
+
+    def _docs(self):
+        texts = ["Governing law is Delaware.", "Payment is due within 30 days.", "Notice must be written.",
+                 "Late payment accrues interest.", "Payment is due within 30 days of invoice receipt."]
+        return [Document(page_content=t, metadata={"chunk_index": i}) for i, t in enumerate(texts)]
+
+    def test_keeps_best_k_and_caches_pairs(self):
+        """The top-k come from cross-encoder scores; repeats skip the model."""
+        from src.retrieval.reranker import CrossEncoderReranker
+
+        model = self.FakeCrossEncoder()
+        reranker = CrossEncoderReranker(model=model, batch_size=2, budget_ms=1000)
+
+        top = reranker.rerank("payment is due within 30 days", self._docs(), k=2)
+        assert [d.metadata["chunk_index"] for d in top] == [4, 1]
+        assert len(model.pairs) == 5
+
+        reranker.rerank("payment  is due within 30 days", self._docs(), k=2)
+        assert len(model.pairs) == 5
+        stats = reranker.stats()
+        assert (stats["hits"], stats["misses"], stats["reranked"]) == (5, 5, 2)
+
+    def test_budget_falls_back_to_first_stage_order(self):
+        """Past the latency budget the candidates keep their retrieval order."""
+        from src.retrieval.reranker import CrossEncoderReranker
+
+        reranker = CrossEncoderReranker(model=self.FakeCrossEncoder(delay=0.05), batch_size=2, budget_ms=10)
+
+        top = reranker.rerank("payment is due within 30 days", self._docs(), k=2)
+
+        assert [d.metadata["chunk_index"] for d in top] == [0, 1]
+        assert reranker.stats()["fallbacks"] == 1
+
+    def test_model_load_not_counted_against_budget(self):
+        """The first question gets the whole budget and its top-k, whether or not load() ran first."""
+        import time
+        from src.retrieval.reranker import CrossEncoderReranker
+
+        fake = self.FakeCrossEncoder
+
+        class SlowLoading(CrossEncoderReranker):
+            loads = 0
+
+            def _load_model(self):
+                SlowLoading.loads += 1
+                time.sleep(0.2)
+                return fake()
+
+        for preload in (True, False):
+            reranker = SlowLoading(model_name="fake", batch_size=2, budget_ms=100)
+            if preload:
+                reranker.load()
+
+            top = reranker.rerank("payment is due within 30 days", self._docs(), k=2)
+
+            assert [d.metadata["chunk_index"] for d in top] == [4, 1]
+            assert reranker.stats()["fallbacks"] == 0 and len(reranker.model.pairs) == 5
+        assert SlowLoading.loads == 2
+
+        # past the budget from the first batch on: first-stage order, cut to k
+        reranker = SlowLoading(model_name="fake", batch_size=2, budget_ms=0)
+        reranker.load()
+        top = reranker.rerank("payment is due within 30 days", self._docs(), k=2)
+        assert [d.metadata["chunk_index"] for d in top] == [0, 1]
+        assert reranker.stats()["fallbacks"] == 1 and len(reranker.model.pairs) == 2
+
+    def test_qa_chain_sends_reranked_chunks(self):
+        """QAChain over-retrieves and passes only the reranked top-k to the LLM."""
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_community.vectorstores import FAISS
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.retrieval.qa_chain import QAChain
+        from src.retrieval.reranker import CrossEncoderReranker
+
+        store = FAISS.from_documents(self._docs(), DeterministicFakeEmbedding(size=16))
+        qa = QAChain(store, reranker=CrossEncoderReranker(model=self.FakeCrossEncoder(), budget_ms=1000),
+                     llm=FakeListChatModel(responses=["Within 30 days."]))
+
+        result = qa.ask("When is payment due within 30 days?")
+
+        assert result["num_sources"] == config.TOP_RESULTS
+        assert result["sources"][0]["metadata"]["chunk_index"] in (1, 4)
+
+
+class TestSemanticAnswerCache:
+    """Test the answer cache keyed by document revision and question embedding."""
+
+    def test_nearest_question_above_threshold_hits(self):
+        """A close enough question gets the cached answer; a different one doesn't."""
+        from src.retrieval.answer_cache import SemanticAnswerCache
+
+        cache = SemanticAnswerCache(threshold=0.9, ttl_s=60, max_entries=4)
+        cache.put(("msa", "r1"), [1.0, 0.0, 0.0], {"answer": "30 days"})
+
+        hit = cache.get(("msa", "r1"), [0.95, 0.1, 0.0])
+        assert hit["answer"] == "30 days" and hit["similarity"] > 0.9
+        assert cache.get(("msa", "r1"), [0.5, 0.5, 0.0]) is None
+        assert cache.get(("msa", "r2"), [1.0, 0.0, 0.0]) is None
+        # the document changed: r1 answers are gone for good
+        assert cache.get(("msa", "r1"), [1.0, 0.0, 0.0]) is None
+        assert cache.stats()["hits"] == 1
+
+    def test_new_revision_only_drops_its_document(self):
+        """Answers are scoped by document; one document changing leaves the others cached."""
+        from src.retrieval.answer_cache import SemanticAnswerCache
+
+        cache = SemanticAnswerCache(threshold=0.9, ttl_s=60, max_entries=4)
+        cache.put(("msa", "r1"), [1.0, 0.0], {"answer": "30 days"})
+        cache.put(("nda", "r1"), [1.0, 0.0], {"answer": "2 years"})
+
+        assert cache.get(("nda", "r1"), [1.0, 0.0])["answer"] == "2 years"
+        assert cache.get(("msa", "r2"), [1.0, 0.0]) is None
+        assert cache.get(("nda", "r1"), [1.0, 0.0])["answer"] == "2 years"
+        assert cache.get((None, "index-1"), [1.0, 0.0]) is None
+        assert cache.stats()["size"] == 1
+
+    def test_ttl_and_lru_eviction(self, monkeypatch):
+        """Expired entries miss; past max_entries the least recently used goes."""
+        from src.retrieval import answer_cache
+        from src.retrieval.answer_cache import SemanticAnswerCache
+
+        now = [1000.0]
+        monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+        cache = SemanticAnswerCache(threshold=0.99, ttl_s=10, max_entries=2)
+        version = ("msa", "r1")
+        cache.put(version, [1.0, 0.0], {"answer": "a"})
+        cache.put(version, [0.0, 1.0], {"answer": "b"})
+        assert cache.get(version, [1.0, 0.0])["answer"] == "a"
+        cache.put(version, [-1.0, 0.0], {"answer": "c"})
+
+        assert cache.get(version, [0.0, 1.0]) is None
+        assert cache.get(version, [1.0, 0.0])["answer"] == "a"
+        now[0] += 11
+        assert cache.get(version, [1.0, 0.0]) is None
+
+    def test_expired_and_forgotten_scopes_free_their_slots(self, monkeypatch):
+        """Expired answers give their slots back, and a scope's revision goes with its last answer."""
+        from src.retrieval import answer_cache
+        from src.retrieval.answer_cache import SemanticAnswerCache
+
+        now = [1000.0]
+        monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+        cache = SemanticAnswerCache(threshold=0.99, ttl_s=10, max_entries=2)
+        cache.put(("msa", "r1"), [1.0, 0.0], {"answer": "a"})
+        cache.put(("nda", "r1"), [1.0, 0.0], {"answer": "b"})
+        now[0] += 11
+
+        assert cache.get(("msa", "r1"), [0.0, 1.0]) is None
+        assert cache.stats()["size"] == 1 and set(cache.versions) == {"msa", "nda"}
+        # a full cache reuses expired slots before evicting live answers
+        now[0] += 5
+        cache.put(("lease", "r1"), [1.0, 0.0], {"answer": "c"})
+        cache.put(("lease", "r1"), [0.0, 1.0], {"answer": "d"})
+        assert cache.stats()["size"] == 2 and set(cache.versions) == {"lease"}
+
+        # scopes that are only ever looked up don't pile up either
+        for n in range(10):
+            cache.get((f"doc-{n}", "r1"), [1.0, 0.0])
+        assert len(cache.versions) <= 2 and "lease" in cache.versions
+
+    def test_repeat_question_skips_llm(self):
+        """A second session asking the same question is answered from the cache."""
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_community.vectorstores import FAISS
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.retrieval.answer_cache import SemanticAnswerCache
+        from src.retrieval.qa_chain import QAChain
+
+        store = FAISS.from_texts(["Payment is due within 30 days."], DeterministicFakeEmbedding(size=16))
+        cache = SemanticAnswerCache(threshold=0.95)
+        version = [("msa", "r1")]
+        chains = [QAChain(store, answer_cache=cache, index_version=lambda: version[0],
+                          llm=FakeListChatModel(responses=["Within 30 days."])) for _ in range(3)]
+
+        first = chains[0].ask("When is payment due?")
+        second = chains[1].ask("When is payment due?")
+        version[0] = ("msa", "r2")
+        third = chains[2].ask("When is payment due?")
+
+        assert (first["cached"], second["cached"], third["cached"]) == (False, True, False)
+        assert second["answer"] == first["answer"] and second["sources"] == first["sources"]
+        assert len(chains[1].chat_history) == 2
+
+    def test_cache_hit_has_no_key_to_store(self):
+        """A hit returns no cache key, so nothing is written back under it."""
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_community.vectorstores import FAISS
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.retrieval.answer_cache import SemanticAnswerCache
+        from src.retrieval.qa_chain import QAChain
+
+        store = FAISS.from_texts(["Payment is due within 30 days."], DeterministicFakeEmbedding(size=16))
+        cache = SemanticAnswerCache(threshold=0.95)
+        llm = FakeListChatModel(responses=["Within 30 days."])
+        QAChain(store, answer_cache=cache, index_version=lambda: ("msa", "r1"), llm=llm).ask("When is payment due?")
+
+        chain = QAChain(store, answer_cache=cache, index_version=lambda: ("msa", "r1"), llm=llm)
+        cache_key, cached = chain._cached_answer("When is payment due?")
+        assert cache_key is None and cached["cached"] is True
+
+    def test_cache_needs_index_version(self):
+        """The chain can't tell when an edit changes the index, so the caller says."""
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_community.vectorstores import FAISS
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.retrieval.answer_cache import SemanticAnswerCache
+        from src.retrieval.qa_chain import QAChain
+
+        store = FAISS.from_texts(["Payment is due within 30 days."], DeterministicFakeEmbedding(size=16))
+        with pytest.raises(ValueError, match="index_version"):
+            QAChain(store, answer_cache=SemanticAnswerCache(), llm=FakeListChatModel(responses=["-"]))
+
+
+    def test_answer_not_cached_if_index_changes_during_generation(self):
+        """An answer built from the old revision isn't cached under the new one."""
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_community.vectorstores import FAISS
+        from langchain_core.messages import AIMessage
+        from langchain_core.runnables import RunnableLambda
+        from src.retrieval.answer_cache import SemanticAnswerCache
+        from src.retrieval.qa_chain import QAChain
+
+        version = [("msa", "r1")]
+
+        def upload_during_generation(messages):
+            version[0] = ("msa", "r2")
+            return AIMessage(content="Within 30 days.")
+
+        store = FAISS.from_texts(["Payment is due within 30 days."], DeterministicFakeEmbedding(size=16))
+        cache = SemanticAnswerCache(threshold=0.95)
+        chain = QAChain(store, answer_cache=cache, index_version=lambda: version[0],
+                        llm=RunnableLambda(upload_during_generation))
+        chain.ask("When is payment due?")
+
+        assert cache.stats()["size"] == 0
+        assert cache.get(("msa", "r2"), DeterministicFakeEmbedding(size=16).embed_query("When is payment due?")) is None
+        # a late answer for an older revision doesn't displace the current one
+        cache.put(("msa", "r1"), [1.0] * 16, {"answer": "stale"})
+        assert cache.versions["msa"] == "r2" and cache.stats()["size"] == 0
+
+class TestSessionManager:
+    """Test per-session chat state with LRU, TTL and memory-cap eviction."""
+
+    class FakeChain:
+        def __init__(self):
+            self.chat_history = []
+
+    def test_sessions_keep_separate_histories(self):
+        """Each session ID gets its own chain; the same ID gets it back."""
+        from langchain_core.messages import HumanMessage
+        from src.retrieval.sessions import SessionManager
+
+        sessions = SessionManager(self.FakeChain, max_sessions=10, ttl_s=60, max_bytes=10**6)
+        alice = sessions.get("alice")
+        alice.chain.chat_history.append(HumanMessage(content="When is payment due?"))
+
+        assert sessions.get("bob").chain.chat_history == []
+        assert sessions.get("alice") is alice and len(alice.chain.chat_history) == 1
+        assert sessions.drop("alice") and "alice" not in sessions
+
+    def test_ttl_and_lru_eviction(self, monkeypatch):
+        """Idle sessions expire; past max_sessions the least recently used goes."""
+        from src.retrieval import sessions as sessions_module
+        from src.retrieval.sessions import SessionManager
+
+        now = [1000.0]
+        monkeypatch.setattr(sessions_module.time, "time", lambda: now[0])
+        sessions = SessionManager(self.FakeChain, max_sessions=2, ttl_s=10, max_bytes=10**6)
+        sessions.get("a")
+        sessions.get("b")
+        sessions.get("a")
+        sessions.get("c")
+        assert "b" not in sessions and "a" in sessions and "c" in sessions
+
+        now[0] += 11
+        sessions.get("d")
+        stats = sessions.stats()
+        assert (stats["sessions"], stats["evicted"], stats["expired"]) == (1, 1, 2)
+
+    def test_memory_cap_evicts_by_history_size(self):
+        """Growing histories push the least recently used sessions out."""
+        from langchain_core.messages import AIMessage
+        from src.retrieval.sessions import Session, SessionManager
+
+        # room for two idle sessions plus c's history, not for all three
+        cap = 2 * Session.BASE_BYTES + Session.MESSAGE_BYTES + 20_000
+        sessions = SessionManager(self.FakeChain, max_sessions=100, ttl_s=60, max_bytes=cap)
+        for session_id in ("a", "b", "c"):
+            sessions.get(session_id)
+        c = sessions.get("c")
+        c.chain.chat_history.append(AIMessage(content="x" * 20_000))
+        sessions.update(c)
+
+        assert sessions.stats()["bytes"] <= cap and sessions.stats()["evicted"] == 1
+        assert "a" not in sessions and "b" in sessions and "c" in sessions
+
+    @pytest.mark.parametrize("mode,mmr", [("dense", False), ("dense", True), ("hybrid", False)])
+    def test_sessions_only_see_their_own_document(self, tmp_path, monkeypatch, mode, mmr):
+        """Two sessions that uploaded different contracts get disjoint sources."""
+        from langchain_community.embeddings import DeterministicFakeEmbedding
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src.ingestion.embedder import EmbedderStore
+        from src.retrieval.qa_chain import QAChain
+        from src.retrieval.sessions import SessionManager
+
+        monkeypatch.setattr(config, "RETRIEVAL_MODE", mode)
+        monkeypatch.setattr(config, "MMR_ENABLED", mmr)
+        embedder = EmbedderStore(embeddings=DeterministicFakeEmbedding(size=16))
+        for source in ("alice.pdf", "bob.pdf"):
+            docs = [Document(page_content=f"{source}: payment is due within {n} days.", metadata={"source": source})
+                    for n in range(10, 70, 10)]
+            embedder.create_and_store(docs, save_path=str(tmp_path), doc_id=source)
+        sessions = SessionManager(lambda: QAChain(embedder.vector_store, retriever=embedder.as_retriever(),
+                                                  llm=FakeListChatModel(responses=["Within 30 days."])))
+
+        sources = {}
+        for session_id, document_id in (("alice", "alice.pdf"), ("bob", "bob.pdf")):
+            session = sessions.get(session_id)
+            session.document_id = document_id
+            session.chain.retriever = embedder.as_retriever(doc_id=document_id)
+            result = session.chain.ask("When is payment due?")
+            sources[session_id] = {s["metadata"]["source"] for s in result["sources"]}
+
+        assert sources == {"alice": {"alice.pdf"}, "bob": {"bob.pdf"}}
+
+
+class TestChatHistory:
+    """Test token-budgeted chat history with background summaries."""
+
+    @staticmethod
+    def count_tokens(text):
+        return len(text.split())
+
+    def test_old_turns_fold_into_summary(self):
+        """Past the budget, older turns become a summary and the latest stays verbatim."""
+        from langchain_core.messages import SystemMessage
+        from src.retrieval.chat_history import ChatHistory
+
+        prompts = []
+
+        def summarize(messages):
+            prompts.append(messages[0].content)
+            return "Payment is due within 30 days."
+
+        history = ChatHistory(summarize, self.count_tokens, token_budget=60, summary_tokens=20)
+        for n in range(6):
+            history.add(f"Question {n}?", " ".join(["word"] * 10))
+            history.wait()
+
+        messages = history.messages()
+        assert isinstance(messages[0], SystemMessage) and "30 days" in messages[0].content
+        assert messages[-2].content == "Question 5?"
+        assert history.folded > 0 and history.dropped == 0
+        assert history.tokens() <= 60
+        # each fold updates the previous summary
+        assert "30 days" in prompts[-1]
+
+    def test_cap_drops_turns_when_summaries_fail(self):
+        """Without summaries the history is still bounded at twice the budget."""
+        from src.retrieval.chat_history import ChatHistory
+
+        def summarize(messages):
+            raise RuntimeError("rate limited")
+
+        history = ChatHistory(summarize, self.count_tokens, token_budget=30, summary_tokens=10)
+        for n in range(20):
+            history.add(f"Question {n}?", " ".join(["word"] * 10))
+            history.wait()
+
+        assert history.tokens() <= 60 and history.dropped > 0
+        assert history.messages()[-2].content == "Question 19?"
+
+        history.clear()
+        assert history.messages() == [] and history.tokens() == 0